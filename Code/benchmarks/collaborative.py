@@ -0,0 +1,133 @@
+"""Scaling benchmark of the collaborative recommender.
+
+Synthetic users rate titles drawn with a long-tailed popularity, their ratings following a
+low-rank taste model plus noise. For each size, the benchmark times the training, the saving
+and memory-mapped loading of the model, batched top-k recommendations for every user and the
+fold-in of new users, and measures how often a held-out favourite title of a folded-in user is
+recommended.
+
+Usage (from the repository root):
+    python -m Code.benchmarks.collaborative --users 100 1000 --titles 10000 100000
+"""
+
+import argparse
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from Code.moviestats.collaborative import RANK, CollaborativeModel
+
+
+RATINGS_PER_USER = 300
+TASTE_RANK = 8
+FOLD_INS = 100
+TOP_N = 100
+SEED = 0
+
+
+def synthetic_ratings(
+    num_users: int, num_titles: int, ratings_per_user: int, rng: np.random.Generator
+) -> tuple:
+    """Generates users rating popular titles more often, following a low-rank taste.
+
+    Returns
+    ----------
+    tuple
+        The user names, the IMDb ids of the titles and the user x title rating matrix
+    """
+    popularity = 1 / np.arange(1, num_titles + 1) ** 0.8
+    popularity /= popularity.sum()
+    tastes = rng.normal(size=(num_users, TASTE_RANK))
+    profiles = rng.normal(size=(num_titles, TASTE_RANK)) / np.sqrt(TASTE_RANK)
+    quality = rng.normal(6.5, 1.0, size=num_titles)
+    per_user = min(ratings_per_user, num_titles)
+    rows, columns = [], []
+    for user in range(num_users):
+        rows.append(np.full(per_user, user))
+        columns.append(rng.choice(num_titles, per_user, replace=False, p=popularity))
+    rows, columns = np.concatenate(rows), np.concatenate(columns)
+    ratings = quality[columns] + 1.5 * np.einsum(
+        "ij,ij->i", tastes[rows], profiles[columns]
+    )
+    ratings = np.clip(np.rint(ratings + rng.normal(0, 0.5, len(ratings))), 1, 10)
+    names = [f"user{user}" for user in range(num_users)]
+    consts = np.array([f"tt{title:07d}" for title in range(num_titles)])
+    return (
+        names,
+        consts,
+        csr_matrix((ratings, (rows, columns)), shape=(num_users, num_titles)),
+    )
+
+
+def run(num_users: int, num_titles: int, ratings_per_user: int, rank: int) -> dict:
+    """Times the recommender on one synthetic size, returning the timings in seconds."""
+    rng = np.random.default_rng(SEED)
+    names, consts, matrix = synthetic_ratings(
+        num_users + FOLD_INS, num_titles, ratings_per_user, rng
+    )
+    train, new_users = matrix[:num_users], matrix[num_users:]
+    results = {"ratings": train.nnz}
+
+    start = perf_counter()
+    model = CollaborativeModel.from_matrix(names[:num_users], consts, train, rank)
+    results["train"] = perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as model_dir:
+        start = perf_counter()
+        model.save(model_dir)
+        results["save"] = perf_counter() - start
+        results["size_mib"] = (
+            sum(path.stat().st_size for path in Path(model_dir).iterdir()) / 2**20
+        )
+        start = perf_counter()
+        model = CollaborativeModel.load(model_dir)
+        results["load_mmap"] = perf_counter() - start
+
+        start = perf_counter()
+        model.recommend(model.names, 10)
+        results["top10_all_users"] = perf_counter() - start
+
+        hits, fold_in_time = 0, 0.0
+        for row in range(FOLD_INS):
+            ratings = new_users[row]
+            held_out = ratings.indices[np.argmax(ratings.data)]
+            kept = ratings.indices != held_out
+            start = perf_counter()
+            model.fold_in(
+                f"new{row}", consts[ratings.indices[kept]], ratings.data[kept]
+            )
+            fold_in_time += perf_counter() - start
+            recommended = model.recommend([f"new{row}"], TOP_N)[0]
+            hits += consts[held_out] in {r.const for r in recommended}
+        results["fold_in_per_user"] = fold_in_time / FOLD_INS
+        results[f"hit_rate@{TOP_N}"] = hits / FOLD_INS
+    return results
+
+
+def main() -> None:
+    """Parses the command line arguments and prints the timings of each size."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--titles", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--ratings-per-user", type=int, default=RATINGS_PER_USER)
+    parser.add_argument("--rank", type=int, default=RANK)
+    args = parser.parse_args()
+    if len(args.users) != len(args.titles):
+        parser.error("--users and --titles need as many sizes")
+
+    for num_users, num_titles in zip(args.users, args.titles):
+        print(f"###### {num_users} users x {num_titles} titles")
+        results = run(num_users, num_titles, args.ratings_per_user, args.rank)
+        for name, value in results.items():
+            print(
+                f"{name:<24}{value:>12.4f}"
+                if isinstance(value, float)
+                else f"{name:<24}{value:>12}"
+            )
+
+
+if __name__ == "__main__":
+    main()
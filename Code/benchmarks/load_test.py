@@ -0,0 +1,167 @@
+"""Load test of the local JSON API.
+
+Keep-alive clients send requests to a running server as fast as it answers them, for a fixed
+duration, then the throughput and the latency percentiles are reported. Without --url, a server
+is started in-process on a synthetic library so that the test is self-contained.
+
+Usage (from the repository root):
+    python -m Code.benchmarks.load_test --clients 16 --duration 10
+    python -m Code.benchmarks.load_test --url http://127.0.0.1:8000 --paths /top?n=10 /genres
+"""
+
+import argparse
+import asyncio
+import tempfile
+from contextlib import redirect_stdout
+from io import StringIO
+from pathlib import Path
+from statistics import quantiles
+from time import perf_counter
+from urllib.parse import urlsplit
+
+from Code.benchmarks.synthetic_library import build_synthetic_database
+
+
+DEFAULT_PATHS = [
+    "/top?n=10",
+    "/genres",
+    "/frequent-actors?n=10",
+    "/frequent-directors?n=10",
+    "/mean-rating",
+    "/watch-time",
+    "/recommendations?n=10",
+]
+
+
+async def client(
+    host: str, port: int, paths: list, deadline: float, offset: int
+) -> tuple:
+    """Sends requests over one keep-alive connection until the deadline.
+
+    Returns
+    ----------
+    tuple
+        The latency of every request in seconds, and the number of non-200 responses
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    latencies, errors = [], 0
+    i = offset
+    while perf_counter() < deadline:
+        path = paths[i % len(paths)]
+        i += 1
+        start = perf_counter()
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode())
+        await writer.drain()
+        status = (await reader.readline()).split()[1]
+        length = 0
+        while (line := await reader.readline()) not in (b"\r\n", b""):
+            name, _, value = line.partition(b":")
+            if name.lower() == b"content-length":
+                length = int(value)
+        await reader.readexactly(length)
+        latencies.append(perf_counter() - start)
+        errors += status != b"200"
+    writer.close()
+    return latencies, errors
+
+
+async def load_test(
+    host: str, port: int, paths: list, clients: int, duration: float
+) -> dict:
+    """Runs concurrent clients against a server and summarises their latencies.
+
+    Parameters
+    ----------
+    host : str
+        The host of the server
+    port : int
+        The port of the server
+    paths : list
+        The request targets, cycled through by every client
+    clients : int
+        The number of concurrent connections
+    duration : float
+        The number of seconds to send requests for
+
+    Returns
+    ----------
+    dict
+        The number of requests and errors, the requests per second and latency percentiles in ms
+    """
+    deadline = perf_counter() + duration
+    start = perf_counter()
+    outcomes = await asyncio.gather(
+        *(client(host, port, paths, deadline, i) for i in range(clients))
+    )
+    elapsed = perf_counter() - start
+    latencies = sorted(latency for result, _ in outcomes for latency in result)
+    percentiles = (
+        quantiles(latencies, n=1000) if len(latencies) > 1 else latencies * 999
+    )
+    return {
+        "requests": len(latencies),
+        "errors": sum(errors for _, errors in outcomes),
+        "requests_per_second": len(latencies) / elapsed,
+        "p50_ms": percentiles[499] * 1000,
+        "p95_ms": percentiles[949] * 1000,
+        "p99_ms": percentiles[989] * 1000,
+        "p999_ms": percentiles[998] * 1000,
+        "max_ms": latencies[-1] * 1000 if latencies else 0.0,
+    }
+
+
+async def run_local(args: argparse.Namespace) -> dict:
+    """Builds a synthetic library, serves it in-process and load tests it."""
+    from Code.moviestats.server import StatsServer
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_name = str(Path(tmp_dir) / "load_test.db")
+        with redirect_stdout(StringIO()):
+            build_synthetic_database(db_name, args.size)
+        server = StatsServer(db_name, args.workers)
+        await server.start("127.0.0.1", 0)
+        try:
+            return await load_test(
+                "127.0.0.1", server.port, args.paths, args.clients, args.duration
+            )
+        finally:
+            await server.stop()
+
+
+def main() -> None:
+    """Parses the command line arguments and prints the load test summary."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--url", default=None, help="server to test, e.g. http://host:port"
+    )
+    parser.add_argument("--paths", nargs="+", default=DEFAULT_PATHS)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument(
+        "--size", type=int, default=10_000, help="titles of the in-process library"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=4, help="query threads of the in-process server"
+    )
+    args = parser.parse_args()
+
+    if args.url:
+        url = urlsplit(args.url)
+        summary = asyncio.run(
+            load_test(url.hostname, url.port, args.paths, args.clients, args.duration)
+        )
+    else:
+        summary = asyncio.run(run_local(args))
+    print(
+        f"{summary['requests']} requests, {summary['errors']} errors, "
+        f"{summary['requests_per_second']:.0f} [req/s]"
+    )
+    print(
+        f"latency p50 {summary['p50_ms']:.2f}, p95 {summary['p95_ms']:.2f}, "
+        f"p99 {summary['p99_ms']:.2f}, p99.9 {summary['p999_ms']:.2f}, "
+        f"max {summary['max_ms']:.2f} [ms]"
+    )
+
+
+if __name__ == "__main__":
+    main()
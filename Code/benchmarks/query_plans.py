@@ -0,0 +1,109 @@
+"""Query plan regression check of the RatingsAnalyser.
+
+Builds a small synthetic database, runs every analyser operation of run_benchmarks with query
+diagnostics and compares the plans of their queries with the snapshot saved in query_plans.json.
+The check fails if a plan changed, for instance because a schema change stopped a query from
+using an index, or if a query scans movie_actors or actors in full without being listed in
+EXPECTED_FULL_SCANS. After an intended change, rerun with --update and commit the new snapshot.
+
+Usage (from the repository root):
+    python -m Code.benchmarks.query_plans [--update]
+"""
+
+import argparse
+import json
+import sqlite3
+import sys
+import tempfile
+from contextlib import redirect_stdout
+from io import StringIO
+from pathlib import Path
+
+from Code.benchmarks.run_benchmarks import ANALYSER_OPERATIONS
+from Code.benchmarks.synthetic_library import build_synthetic_database
+from Code.moviestats.diagnostics import QueryDiagnostics, compare_plans, snapshot_plans
+from Code.moviestats.ratings_analyser import RatingsAnalyser
+
+
+SNAPSHOT_PATH = Path(__file__).resolve().parent / "query_plans.json"
+LIBRARY_SIZE = 2_000
+# the aggregates over every actor have to read the whole link table
+EXPECTED_FULL_SCANS = {
+    "get_mean_rating_for_highest_actors",
+    "get_stats_for_most_frequent_actors",
+}
+
+
+def capture_plans(db_name: str) -> tuple:
+    """Returns the plans of the analyser operations and the operations scanning watched tables.
+
+    Parameters
+    ----------
+    db_name : str
+        The database to query
+
+    Returns
+    ----------
+    tuple
+        The snapshot, mapping each operation to the plans of its queries, and a dict mapping
+        each operation that scans a watched table in full to those tables
+    """
+    diagnostics = QueryDiagnostics(threshold=float("inf"))
+    analyser = RatingsAnalyser(db_name, read_only=True, diagnostics=diagnostics)
+    operations = {
+        name: operation
+        for name, operation in ANALYSER_OPERATIONS.items()
+        if name.startswith("get_")
+    }
+    snapshot, scans = {}, {}
+    for name, operation in operations.items():
+        snapshot.update(snapshot_plans(analyser, {name: operation}))
+        tables = {
+            table for profile in diagnostics.history for table in profile.full_scans
+        }
+        if tables:
+            scans[name] = sorted(tables)
+    return snapshot, scans
+
+
+def main() -> None:
+    """Runs the plan checks and exits with a non-zero status if one fails."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--update", action="store_true", help="save the current plans as the snapshot"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        db_name = str(Path(workdir) / "plans.db")
+        with redirect_stdout(StringIO()):
+            build_synthetic_database(db_name, LIBRARY_SIZE)
+        snapshot, scans = capture_plans(db_name)
+
+    if args.update:
+        saved = {"sqlite_version": sqlite3.sqlite_version, "plans": snapshot}
+        SNAPSHOT_PATH.write_text(json.dumps(saved, indent=2) + "\n")
+        print(f"Saved the plans of {len(snapshot)} operations to {SNAPSHOT_PATH.name}")
+        return
+
+    saved = json.loads(SNAPSHOT_PATH.read_text())
+    if saved["sqlite_version"] != sqlite3.sqlite_version:
+        print(
+            f"note: the snapshot was taken with sqlite {saved['sqlite_version']}, "
+            f"this is sqlite {sqlite3.sqlite_version}"
+        )
+    failures = compare_plans(saved["plans"], snapshot)
+    failures.extend(
+        f"{name} scans {', '.join(tables)} in full"
+        for name, tables in scans.items()
+        if name not in EXPECTED_FULL_SCANS
+    )
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    if failures:
+        sys.exit(1)
+    print(f"Query plans of {len(snapshot)} operations match the snapshot")
+
+
+if __name__ == "__main__":
+    main()
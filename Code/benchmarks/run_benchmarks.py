@@ -0,0 +1,335 @@
+"""End-to-end benchmark suite for the moviestats package.
+
+Synthetic libraries of increasing size are generated, ingested and queried. The timings of every
+operation are written to a JSON file so that runs on different commits can be compared, and a
+scaling exponent is fitted for each operation to show how it grows with the library size.
+
+Usage (from the repository root):
+    python -m Code.benchmarks.run_benchmarks --sizes 1000 10000 100000
+    python -m Code.benchmarks.run_benchmarks --compare Code/benchmarks/results/<commit>.json
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import tempfile
+import tracemalloc
+from contextlib import redirect_stdout
+from datetime import datetime, timezone
+from io import StringIO
+from math import log
+from pathlib import Path
+from statistics import median
+from time import perf_counter
+
+from Code.benchmarks.synthetic_library import (
+    SyntheticFetcher,
+    build_synthetic_database,
+    person_name,
+    write_ratings_csv,
+)
+from Code.moviestats.db_functions import create_local_database, populate_database
+from Code.moviestats.plotting_utils import (
+    get_rating_difference_data,
+    get_rating_scatter_data,
+)
+from Code.moviestats.ratings_analyser import RatingsAnalyser
+from Code.moviestats.records import to_columns
+from Code.moviestats.recommendations import get_movie_genre_combination_ratings
+
+
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+DEFAULT_SIZES = [1_000, 10_000]
+POPULATE_MAX_SIZE = 10_000
+REGRESSION_THRESHOLD = 1.2
+
+ANALYSER_OPERATIONS = {
+    "len": len,
+    "get_top_ratings": lambda a: a.get_top_ratings(10),
+    "get_movies_per_rating": lambda a: a.get_movies_per_rating(),
+    "get_total_movie_watching_time": lambda a: a.get_total_movie_watching_time(),
+    "get_ratings": lambda a: a.get_ratings(),
+    "get_rating_differences": lambda a: a.get_rating_differences(),
+    "get_mean_rating": lambda a: a.get_mean_rating(),
+    "get_average_rating_by_genre": lambda a: a.get_average_rating_by_genre(),
+    "get_title_genre_ratings[movie]": lambda a: a.get_title_genre_ratings(True),
+    "get_title_genre_ratings[tv]": lambda a: a.get_title_genre_ratings(False),
+    "get_mean_rating_for_highest_directors": lambda a: a.get_mean_rating_for_highest_directors(),
+    "get_stats_for_most_frequent_directors": lambda a: a.get_stats_for_most_frequent_directors(),
+    "get_mean_rating_for_highest_actors": lambda a: a.get_mean_rating_for_highest_actors(),
+    "get_stats_for_most_frequent_actors": lambda a: a.get_stats_for_most_frequent_actors(),
+    "get_movie_list_for": lambda a: a.get_movie_list_for(person_name(0)),
+    "get_movie_genre_combination_ratings": get_movie_genre_combination_ratings,
+    "plot_prep[rating_scatter]": lambda a: get_rating_scatter_data(a.get_ratings()),
+    "plot_prep[rating_differences]": lambda a: get_rating_difference_data(
+        a.get_rating_differences()
+    ),
+}
+
+
+def measure(func, *args, repeat: int = 3) -> dict:
+    """Runs func several times and returns its timing statistics.
+
+    Parameters
+    ----------
+    func : callable
+        The function to time
+    args
+        The arguments to pass to func
+    repeat : int
+        The number of runs
+
+    Returns
+    ----------
+    dict
+        The minimum and median runtime in seconds
+    """
+    timings = []
+    for _ in range(repeat):
+        start = perf_counter()
+        func(*args)
+        timings.append(perf_counter() - start)
+    return {"min": min(timings), "median": median(timings)}
+
+
+def retained_memory(func, *args) -> int:
+    """Returns the number of bytes still allocated by func's result once it returned."""
+    tracemalloc.start()
+    try:
+        result = func(*args)
+        retained = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del result
+    return retained
+
+
+def measure_result_memory(analyser: RatingsAnalyser) -> dict:
+    """Compares the memory held by get_ratings as plain tuples, records and NumPy columns.
+
+    Parameters
+    ----------
+    analyser : RatingsAnalyser
+        The analyser to query
+
+    Returns
+    ----------
+    dict
+        The number of bytes retained by each representation
+    """
+    query = """SELECT title, your_rating, imdb_rating FROM imdb_ratings"""
+    return {
+        "tuples": retained_memory(lambda: analyser.cursor.execute(query).fetchall()),
+        "records": retained_memory(analyser.get_ratings),
+        "columns": retained_memory(lambda: to_columns(analyser.get_ratings())),
+    }
+
+
+def measure_populate(workdir: Path, num_titles: int) -> tuple:
+    """Times populate_database on a fresh database, with the IMDb fetcher stubbed.
+
+    Parameters
+    ----------
+    workdir : Path
+        The directory to write the CSV file and database to
+    num_titles : int
+        The number of titles to ingest
+
+    Returns
+    ----------
+    tuple
+        The path of the populated database and the timing statistics
+    """
+    csv_path = write_ratings_csv(workdir / f"ratings_{num_titles}.csv", num_titles)
+    db_name = str(workdir / f"populate_{num_titles}.db")
+    with redirect_stdout(StringIO()):
+        create_local_database(db_name)
+        start = perf_counter()
+        populate_database(csv_path, db_name, SyntheticFetcher(num_titles))
+        elapsed = perf_counter() - start
+    return db_name, {"min": elapsed, "median": elapsed}
+
+
+def run_suite(sizes: list, workdir: Path, repeat: int, populate_max: int) -> dict:
+    """Runs every benchmark for each library size.
+
+    Parameters
+    ----------
+    sizes : list
+        The library sizes, in number of titles
+    workdir : Path
+        The directory to write the generated files to
+    repeat : int
+        The number of runs per operation
+    populate_max : int
+        The largest library size for which populate_database is benchmarked
+
+    Returns
+    ----------
+    tuple
+        The timings and the result memory measurements, each mapping an operation name
+        to a list of measurements, one per size
+    """
+    results, memory_results = {}, {}
+    for num_titles in sorted(sizes):
+        print(f"Benchmarking a library of {num_titles} titles")
+        if num_titles <= populate_max:
+            db_name, timing = measure_populate(workdir, num_titles)
+            results.setdefault("populate_database", []).append(
+                {"n": num_titles, **timing}
+            )
+        else:
+            db_name = str(workdir / f"bulk_{num_titles}.db")
+            with redirect_stdout(StringIO()):
+                build_synthetic_database(db_name, num_titles)
+
+        analyser = RatingsAnalyser(db_name)
+        for name, operation in ANALYSER_OPERATIONS.items():
+            timing = measure(operation, analyser, repeat=repeat)
+            results.setdefault(name, []).append({"n": num_titles, **timing})
+            print(f"  {name:<45} {timing['median'] * 1000:10.2f} [ms]")
+        memory = measure_result_memory(analyser)
+        memory_results.setdefault("get_ratings", []).append({"n": num_titles, **memory})
+        print(f"  {'memory[get_ratings]':<45} {memory} [B]")
+        del analyser
+    return results, memory_results
+
+
+def scaling_exponent(measurements: list) -> float:
+    """Fits runtime ~ n^k on a log-log scale and returns k.
+
+    Parameters
+    ----------
+    measurements : list
+        The measurements of one operation, one per library size
+
+    Returns
+    ----------
+    float
+        The fitted exponent, or None if fewer than two sizes were measured
+    """
+    points = [(log(m["n"]), log(max(m["median"], 1e-9))) for m in measurements]
+    if len(points) < 2:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    num = sum((x - mean_x) * (y - mean_y) for x, y in points)
+    den = sum((x - mean_x) ** 2 for x, _ in points)
+    return num / den
+
+
+def current_commit() -> str:
+    """Returns the short hash of the checked out commit, or "unknown" outside a git tree."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=Path(__file__).resolve().parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare_results(current: dict, baseline: dict) -> list:
+    """Lists the operations that got slower than the baseline by more than the threshold.
+
+    Parameters
+    ----------
+    current : dict
+        The results of the current run
+    baseline : dict
+        The results of a previous run
+
+    Returns
+    ----------
+    list
+        3-tuples of operation, library size and slowdown ratio
+    """
+    regressions = []
+    for name, measurements in current["results"].items():
+        previous = {m["n"]: m["median"] for m in baseline["results"].get(name, [])}
+        for m in measurements:
+            if m["n"] in previous and previous[m["n"]] > 0:
+                ratio = m["median"] / previous[m["n"]]
+                if ratio > REGRESSION_THRESHOLD:
+                    regressions.append((name, m["n"], ratio))
+    return regressions
+
+
+def plot_scaling_curves(report: dict, output: Path) -> None:
+    """Draws the runtime of every operation against the library size on a log-log scale.
+
+    Parameters
+    ----------
+    report : dict
+        The benchmark report
+    output : Path
+        The path of the image to write
+    """
+    import matplotlib  # pylint: disable=import-outside-toplevel
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt  # pylint: disable=import-outside-toplevel
+
+    plt.figure(figsize=(12, 8))
+    for name, measurements in report["results"].items():
+        plt.loglog(
+            [m["n"] for m in measurements],
+            [m["median"] for m in measurements],
+            marker="o",
+            label=name,
+        )
+    plt.xlabel("Number of titles")
+    plt.ylabel("Median runtime [s]")
+    plt.title(f"Scaling curves ({report['commit']})")
+    plt.legend(fontsize="x-small")
+    plt.grid(True)
+    plt.savefig(output)
+
+
+def main() -> None:
+    """Parses the command line, runs the suite and records the results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--populate-max", type=int, default=POPULATE_MAX_SIZE)
+    parser.add_argument("--output", type=Path, default=None)
+    parser.add_argument("--compare", type=Path, default=None)
+    parser.add_argument("--plot", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        results, memory_results = run_suite(
+            args.sizes, Path(workdir), args.repeat, args.populate_max
+        )
+
+    report = {
+        "commit": current_commit(),
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "results": results,
+        "scaling": {name: scaling_exponent(m) for name, m in results.items()},
+        "memory": memory_results,
+    }
+    output = args.output or RESULTS_DIR / f"{report['commit']}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"Results written to {output}")
+
+    if args.plot:
+        plot_scaling_curves(report, output.with_suffix(".png"))
+
+    if args.compare:
+        baseline = json.loads(args.compare.read_text(encoding="utf-8"))
+        regressions = compare_results(report, baseline)
+        for name, num_titles, ratio in regressions:
+            print(f"REGRESSION {name} at n={num_titles}: {ratio:.2f}x slower")
+        if not regressions:
+            print(f"No regressions against {baseline['commit']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Startup-time check of the command line interface.
+
+Builds a small synthetic database, then runs `python -m Code.main stats top` in fresh interpreters.
+The check fails if the median wall time exceeds STARTUP_TARGET_SECONDS, or if the stats subcommand
+imported any of the heavy dependencies that it should never need.
+
+Usage (from the repository root):
+    python -m Code.benchmarks.startup
+"""
+
+import subprocess
+import sys
+import tempfile
+from contextlib import redirect_stdout
+from io import StringIO
+from pathlib import Path
+from statistics import median
+from time import perf_counter
+
+from Code.benchmarks.synthetic_library import build_synthetic_database
+from Code.moviestats.cli import STARTUP_TARGET_SECONDS
+
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+FORBIDDEN_MODULES = ["pandas", "matplotlib", "mysql", "imdb", "numpy"]
+RUNS = 5
+
+IMPORTED_MODULES_SCRIPT = """
+import sys
+from Code.moviestats.cli import main
+main(sys.argv[1:])
+print(",".join(sorted({name.split(".")[0] for name in sys.modules})))
+"""
+
+
+def stats_command(db_name: str) -> list:
+    """Returns the stats subcommand arguments for the given database."""
+    return ["--db", db_name, "stats", "top", "--top", "10"]
+
+
+def imported_top_level_modules(db_name: str) -> set:
+    """Runs the stats subcommand in a fresh interpreter and returns what it imported.
+
+    Parameters
+    ----------
+    db_name : str
+        The database to query
+
+    Returns
+    ----------
+    set
+        The names of the imported top-level modules
+    """
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORTED_MODULES_SCRIPT, *stats_command(db_name)],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=REPO_ROOT,
+    ).stdout
+    return set(output.strip().splitlines()[-1].split(","))
+
+
+def startup_time(db_name: str, runs: int = RUNS) -> float:
+    """Measures the median wall time of the stats subcommand in fresh interpreters.
+
+    Parameters
+    ----------
+    db_name : str
+        The database to query
+    runs : int
+        The number of runs
+
+    Returns
+    ----------
+    float
+        The median wall time in seconds
+    """
+    timings = []
+    for _ in range(runs):
+        start = perf_counter()
+        subprocess.run(
+            [sys.executable, "-m", "Code.main", *stats_command(db_name)],
+            capture_output=True,
+            check=True,
+            cwd=REPO_ROOT,
+        )
+        timings.append(perf_counter() - start)
+    return median(timings)
+
+
+def main() -> None:
+    """Runs the startup checks and exits with a non-zero status if one fails."""
+    failures = []
+    with tempfile.TemporaryDirectory() as workdir:
+        db_name = str(Path(workdir) / "startup.db")
+        with redirect_stdout(StringIO()):
+            build_synthetic_database(db_name, 1_000)
+
+        heavy = sorted(set(FORBIDDEN_MODULES) & imported_top_level_modules(db_name))
+        if heavy:
+            failures.append(f"stats imported {', '.join(heavy)}")
+
+        elapsed = startup_time(db_name)
+        print(
+            f"stats startup: {elapsed * 1000:.1f} [ms] "
+            f"(target {STARTUP_TARGET_SECONDS * 1000:.0f} [ms])"
+        )
+        if elapsed > STARTUP_TARGET_SECONDS:
+            failures.append("stats startup is over the target")
+
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    if failures:
+        sys.exit(1)
+    print("Startup checks passed")
+
+
+if __name__ == "__main__":
+    main()
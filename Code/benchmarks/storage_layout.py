@@ -0,0 +1,145 @@
+"""Benchmark of the compact storage layout against the original one.
+
+A synthetic library is built with the original layout, copied and migrated to the compact layout
+with storage.migrate_to_compact, and both databases are vacuumed. The size of each table and
+index and the timings of typical queries are then compared.
+
+Usage (from the repository root):
+    python -m Code.benchmarks.storage_layout --size 100000
+"""
+
+import argparse
+import shutil
+import tempfile
+from contextlib import redirect_stdout
+from io import StringIO
+from pathlib import Path
+from sqlite3 import connect
+from statistics import median
+from time import perf_counter
+
+from Code.benchmarks.synthetic_library import build_synthetic_database
+from Code.moviestats.ratings_analyser import RatingsAnalyser
+from Code.moviestats.storage import mask_of_genres, migrate_to_compact
+
+
+REPEATS = 5
+LOOKUPS = 1000
+
+
+def table_sizes(db_name: str) -> dict:
+    """Returns the size in bytes of each table and index of a database."""
+    conn = connect(db_name)
+    sizes = dict(
+        conn.execute(
+            """SELECT name, SUM(pgsize) FROM dbstat GROUP BY name ORDER BY name"""
+        ).fetchall()
+    )
+    conn.close()
+    return sizes
+
+
+def genre_filter(compact: bool):
+    """Returns a query counting the dramas, with the genre mask if compact."""
+    if compact:
+        return lambda a: a.cursor.execute(
+            """SELECT COUNT(*) FROM imdb_ratings WHERE genre_mask & :mask = :mask""",
+            {"mask": mask_of_genres(a.cursor, ["Drama"])},
+        ).fetchone()
+    return lambda a: a.cursor.execute(
+        """SELECT COUNT(*) FROM imdb_ratings WHERE id IN (
+            SELECT movie_id FROM movie_genres
+            JOIN genres ON movie_genres.genre_id = genres.genre_id
+            WHERE TRIM(genres.name) = 'Drama'
+        )"""
+    ).fetchone()
+
+
+def query_timings(db_name: str, compact: bool) -> dict:
+    """Times typical queries, returning the median of REPEATS runs in milliseconds."""
+    analyser = RatingsAnalyser(db_name, read_only=True)
+    consts = [
+        row[0]
+        for row in analyser.cursor.execute(
+            f"""SELECT const FROM imdb_ratings ORDER BY random() LIMIT {LOOKUPS}"""
+        )
+    ]
+    actor = analyser.cursor.execute(
+        """SELECT name FROM actors WHERE actor_id = (
+            SELECT actor_id FROM movie_actors GROUP BY actor_id ORDER BY COUNT(*) DESC LIMIT 1
+        )"""
+    ).fetchone()[0]
+    operations = {
+        f"const_lookup_x{LOOKUPS}": lambda a: [
+            a.cursor.execute(
+                """SELECT id, title FROM imdb_ratings WHERE const = ?""", (const,)
+            ).fetchone()
+            for const in consts
+        ],
+        "full_scan": lambda a: a.cursor.execute(
+            """SELECT title_type, COUNT(*), AVG(imdb_rating) FROM imdb_ratings
+            GROUP BY title_type"""
+        ).fetchall(),
+        "get_top_ratings": lambda a: a.get_top_ratings(10),
+        "get_movie_list_for": lambda a: a.get_movie_list_for(actor),
+        "get_stats_for_most_frequent_actors": lambda a: a.get_stats_for_most_frequent_actors(
+            10
+        ),
+        "get_average_rating_by_genre": lambda a: a.get_average_rating_by_genre(),
+        "genre_filter": genre_filter(compact),
+    }
+    timings = {}
+    for name, operation in operations.items():
+        runs = []
+        for _ in range(REPEATS):
+            start = perf_counter()
+            operation(analyser)
+            runs.append(perf_counter() - start)
+        timings[name] = median(runs) * 1000
+    return timings
+
+
+def main() -> None:
+    """Parses the command line arguments and prints the size and timing comparisons."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=100_000, help="number of titles")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        original = str(Path(tmp_dir) / "original.db")
+        compact = str(Path(tmp_dir) / "compact.db")
+        with redirect_stdout(StringIO()):
+            build_synthetic_database(original, args.size, compact=False)
+        conn = connect(original)
+        conn.execute("VACUUM")
+        conn.close()
+        shutil.copy(original, compact)
+        start = perf_counter()
+        before, after = migrate_to_compact(compact)
+        print(f"migration: {perf_counter() - start:.2f} [s]")
+        print(
+            f"file size: {before / 2**20:.1f} -> {after / 2**20:.1f} MiB "
+            f"({after / before - 1:+.0%})"
+        )
+
+        sizes = table_sizes(original), table_sizes(compact)
+        print(f"\n{'table or index':<40}{'original':>12}{'compact':>12}  [KiB]")
+        for name in sorted(set(sizes[0]) | set(sizes[1])):
+            values = [size.get(name) for size in sizes]
+            if max(value or 0 for value in values) >= 64 * 1024:
+                print(
+                    f"{name:<40}"
+                    + "".join(
+                        f"{'-' if value is None else value // 1024:>12}"
+                        for value in values
+                    )
+                )
+
+        timings = query_timings(original, False), query_timings(compact, True)
+        print(f"\n{'query':<40}{'original':>12}{'compact':>12}  [ms]")
+        for name in timings[0]:
+            print(f"{name:<40}{timings[0][name]:>12.2f}{timings[1][name]:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
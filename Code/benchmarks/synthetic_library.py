@@ -0,0 +1,314 @@
+"""Generators for synthetic IMDb ratings exports and their cast and crew data.
+
+The generated CSV files follow the column layout of a genuine IMDb ratings export so that they
+can be fed to the ingestion code as is. Credits are drawn from a skewed distribution so that a few
+people appear in many titles, as they do in real libraries.
+"""
+
+import csv
+import random
+from datetime import date, timedelta
+from pathlib import Path
+from sqlite3 import connect
+from Code.moviestats.changes import create_change_log, drop_change_triggers, record_load
+from Code.moviestats.db_functions import TITLE_COLUMNS, create_local_database
+from Code.moviestats.helpers import date_to_epoch
+from Code.moviestats.storage import insert_titles, update_genre_masks
+
+
+CSV_COLUMNS = [
+    "Const",
+    "Your Rating",
+    "Date Rated",
+    "Title",
+    "URL",
+    "Title Type",
+    "IMDb Rating",
+    "Runtime (mins)",
+    "Year",
+    "Genres",
+    "Num Votes",
+    "Release Date",
+    "Directors",
+]
+TITLE_TYPES = ["movie"] * 14 + ["tvSeries"] * 3 + ["tvMiniSeries", "short", "video"]
+GENRES = [
+    "Action",
+    "Adventure",
+    "Animation",
+    "Biography",
+    "Comedy",
+    "Crime",
+    "Documentary",
+    "Drama",
+    "Family",
+    "Fantasy",
+    "History",
+    "Horror",
+    "Music",
+    "Mystery",
+    "Romance",
+    "Sci-Fi",
+    "Sport",
+    "Thriller",
+    "War",
+    "Western",
+]
+FIRST_NAMES = (
+    "Alice Bruno Clara David Elena Frank Grace Hugo Iris Jonas "
+    "Karin Louis Maria Nadia Oscar Paula Quentin Rosa Simon Tessa"
+).split()
+LAST_NAMES = (
+    "Anders Bauer Costa Dubois Evans Fischer Garcia Hansen Ito Jensen "
+    "Keller Lopez Moreau Novak Olsen Petit Quinn Rossi Schmid Tanaka"
+).split()
+CAST_SIZE = 12
+
+
+def person_name(index: int) -> str:
+    """Builds a unique, human-looking name for the person with the given index.
+
+    Parameters
+    ----------
+    index : int
+        The index of the person
+
+    Returns
+    ----------
+    str
+        The name of the person
+    """
+    first = FIRST_NAMES[index % len(FIRST_NAMES)]
+    last = LAST_NAMES[(index // len(FIRST_NAMES)) % len(LAST_NAMES)]
+    return f"{first} {last} {index}"
+
+
+def skewed_index(rng: random.Random, population: int) -> int:
+    """Draws an index in [0, population) where small indices are much more likely.
+
+    Parameters
+    ----------
+    rng : random.Random
+        The random number generator to use
+    population : int
+        The number of distinct indices
+
+    Returns
+    ----------
+    int
+        The drawn index
+    """
+    return int(population * rng.random() ** 3)
+
+
+def generate_ratings_rows(num_titles: int, seed: int = 0):
+    """Yields synthetic rows of an IMDb ratings export.
+
+    Parameters
+    ----------
+    num_titles : int
+        The number of titles to generate
+    seed : int
+        The seed of the random number generator
+
+    Yields
+    ----------
+    dict
+        A row keyed by the IMDb export column names
+    """
+    rng = random.Random(seed)
+    num_directors = max(num_titles // 4, 1)
+    first_rating_day = date(2000, 1, 1)
+    for idx in range(num_titles):
+        const = f"tt{idx + 1:07d}"
+        year = rng.randint(1930, 2024)
+        imdb_rating = round(min(max(rng.gauss(6.8, 1.1), 1.0), 10.0), 1)
+        your_rating = int(min(max(round(imdb_rating + rng.gauss(0, 1.3)), 1), 10))
+        release = date(year, rng.randint(1, 12), rng.randint(1, 28))
+        title_type = rng.choice(TITLE_TYPES)
+        directors = {
+            person_name(skewed_index(rng, num_directors))
+            for _ in range(1 if rng.random() < 0.9 else 2)
+        }
+        yield {
+            "Const": const,
+            "Your Rating": your_rating,
+            "Date Rated": (
+                first_rating_day + timedelta(days=rng.randint(0, 9000))
+            ).isoformat(),
+            "Title": f"Synthetic Title {idx + 1}",
+            "URL": f"https://www.imdb.com/title/{const}/",
+            "Title Type": title_type,
+            "IMDb Rating": imdb_rating,
+            "Runtime (mins)": (
+                rng.randint(20, 60)
+                if title_type.startswith("tv")
+                else rng.randint(75, 180)
+            ),
+            "Year": year,
+            "Genres": ", ".join(sorted(rng.sample(GENRES, rng.randint(1, 3)))),
+            "Num Votes": int(rng.paretovariate(0.8) * 100),
+            "Release Date": release.isoformat(),
+            "Directors": ",".join(sorted(directors)),
+        }
+
+
+def write_ratings_csv(path: Path, num_titles: int, seed: int = 0) -> Path:
+    """Writes a synthetic IMDb ratings export to disk.
+
+    Parameters
+    ----------
+    path : Path
+        The path of the CSV file to write
+    num_titles : int
+        The number of titles to generate
+    seed : int
+        The seed of the random number generator
+
+    Returns
+    ----------
+    Path
+        The path of the written file
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", newline="", encoding="utf-8") as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames=CSV_COLUMNS)
+        writer.writeheader()
+        writer.writerows(generate_ratings_rows(num_titles, seed))
+    return path
+
+
+def title_credits(const: str, num_titles: int, seed: int = 0) -> dict:
+    """Generates the cast, director and music credits of a single synthetic title.
+
+    The credits only depend on the IMDb ID, the library size and the seed, so that they can be
+    recomputed on demand instead of being held in memory for the whole library.
+
+    Parameters
+    ----------
+    const : str
+        The IMDb ID of the title
+    num_titles : int
+        The number of titles in the synthetic library
+    seed : int
+        The seed of the random number generator
+
+    Returns
+    ----------
+    dict
+        A dict with "cast", "directors" and "music" name lists
+    """
+    rng = random.Random(f"{seed}:{const}")
+    cast = {
+        person_name(skewed_index(rng, num_titles * 2))
+        for _ in range(rng.randint(CAST_SIZE // 2, CAST_SIZE))
+    }
+    return {
+        "cast": sorted(cast),
+        "directors": [person_name(skewed_index(rng, num_titles // 4 + 1))],
+        "music": [person_name(skewed_index(rng, num_titles // 10 + 1))],
+    }
+
+
+class SyntheticFetcher:
+    """A drop-in replacement for IMDbDataFetcher that serves generated credits offline."""
+
+    def __init__(self, num_titles: int, seed: int = 0):
+        self.num_titles = num_titles
+        self.seed = seed
+
+    def get_full_cast_and_crew(self, movie_id: str) -> list[str]:
+        """Get the generated cast of a title."""
+        return title_credits(movie_id, self.num_titles, self.seed)["cast"]
+
+    def get_directors(self, movie_id: str) -> list[str]:
+        """Get the generated directors of a title."""
+        return title_credits(movie_id, self.num_titles, self.seed)["directors"]
+
+    def get_music_contributors(self, movie_id: str) -> list[str]:
+        """Get the generated music contributors of a title."""
+        return title_credits(movie_id, self.num_titles, self.seed)["music"]
+
+
+def build_synthetic_database(
+    db_name: str, num_titles: int, seed: int = 0, compact: bool = True
+) -> None:
+    """Creates and fills a local sqlite database with a synthetic library using bulk inserts.
+
+    This bypasses populate_database, which is too slow to build the largest libraries, but
+    produces the same tables and links.
+
+    Parameters
+    ----------
+    db_name : str
+        The name of the database to create
+    num_titles : int
+        The number of titles to generate
+    seed : int
+        The seed of the random number generator
+    compact : bool
+        If True, the database has the compact layout of storage.py, the original one otherwise
+    """
+    create_local_database(db_name, compact)
+    conn = connect(db_name)
+    cursor = conn.cursor()
+    # a bulk load records one change per table rather than one per row, as import_snapshot does
+    drop_change_triggers(cursor)
+    people = {"actors": {}, "directors": {}, "genres": {}}
+    links = {"actors": [], "directors": [], "genres": []}
+
+    def person_id(table_name: str, name: str) -> int:
+        return people[table_name].setdefault(name, len(people[table_name]) + 1)
+
+    ratings = []
+    for movie_id, row in enumerate(generate_ratings_rows(num_titles, seed), start=1):
+        ratings.append(
+            (
+                movie_id,
+                row["Const"],
+                row["Your Rating"],
+                row["Date Rated"],
+                row["Title"],
+                row["URL"],
+                row["Title Type"],
+                row["IMDb Rating"],
+                row["Runtime (mins)"],
+                row["Year"],
+                row["Num Votes"],
+                row["Release Date"],
+                date_to_epoch(row["Date Rated"]),
+                date_to_epoch(row["Release Date"]),
+            )
+        )
+        # same split as populate_database
+        for genre in row["Genres"].strip().split(","):
+            links["genres"].append((movie_id, person_id("genres", genre)))
+        for director in row["Directors"].split(","):
+            links["directors"].append((movie_id, person_id("directors", director)))
+        for actor in title_credits(row["Const"], num_titles, seed)["cast"]:
+            links["actors"].append((movie_id, person_id("actors", actor)))
+
+    insert_titles(cursor, ["id"] + TITLE_COLUMNS, ratings)
+    for table_name, column_id in (
+        ("actors", "actor_id"),
+        ("directors", "director_id"),
+        ("genres", "genre_id"),
+    ):
+        cursor.executemany(
+            f"""INSERT INTO {table_name} ({column_id}, name) VALUES (?,?)""",
+            ((entry_id, name) for name, entry_id in people[table_name].items()),
+        )
+        cursor.executemany(
+            f"""INSERT OR IGNORE INTO movie_{table_name} (movie_id, {column_id})
+            VALUES (?,?)""",
+            links[table_name],
+        )
+    update_genre_masks(cursor)
+    record_load(cursor, "imdb_ratings")
+    for table_name in people:
+        record_load(cursor, table_name)
+        record_load(cursor, f"movie_{table_name}")
+    create_change_log(cursor)
+    conn.commit()
+    conn.close()
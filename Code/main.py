@@ -1,47 +1,18 @@
 """The main file to run the program.
 
-This file is used to run the program and display the results of the RatingsAnalyser object.
-"""
-
-from statistics import fmean
-from Code.moviestats.db import MySQLDatabaseHandler
-
-from Code.moviestats.helpers import format_basic_output
-from Code.moviestats.ratings_analyser import RatingsAnalyser
-from Code.moviestats.db_functions import create_local_database, populate_database
-
-
-def sqlite_on_start():
-    """The function to run when the program starts."""
-    create_local_database()
-    populate_database()
-
+This file runs the moviestats command line interface, e.g.
 
-def sqlite_main():
-    """Main function to run when using sqlite3 as the database."""
-    sqlite_on_start()
-    analyser = RatingsAnalyser("imdb_ratings.db")
+    python -m Code.main ingest
+    python -m Code.main stats top --top 10
+    python -m Code.main stats --actor "Morgan Freeman"
+    python -m Code.main plot rating-scatter
+    python -m Code.main recommend
 
-    movie_list = analyser.get_movie_list_for("Morgan Freeman")
-    print(format_basic_output(movie_list))
-    print(f"Average rating : {fmean((m[1] for m in movie_list))}")
-
-    del analyser
-
-
-def mysql_on_start():
-    """The function to run for MySQL database population when the program starts."""
-    mysql_db = MySQLDatabaseHandler()
-
-    mysql_db.create_db_tables()
-    mysql_db.populate_database()
+Run `python -m Code.main --help` for the full list of subcommands and options.
+"""
 
-    del mysql_db
+from Code.moviestats.cli import main
 
 
 if __name__ == "__main__":
-    # mysql_on_start()
-    # sqlite_on_start()
-
-    analyser = RatingsAnalyser("imdb_ratings.db")
-    print(format_basic_output(analyser.get_top_ratings(10)))
+    main()
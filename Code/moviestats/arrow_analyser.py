@@ -0,0 +1,371 @@
+"""This module computes the RatingsAnalyser statistics directly on an Arrow snapshot.
+
+The snapshot tables written by warehouse.export_database are memory-mapped, so opening a
+snapshot costs no copy of the data, and the joins and aggregations run in Arrow's vectorised
+compute engine. Methods have the same names, parameters and record types as RatingsAnalyser.
+"""
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from Code.moviestats.ratings_analyser import POSITIVE_INT_ERR_MESSAGE
+from Code.moviestats.records import (
+    NameRating,
+    NameStats,
+    RatingDifference,
+    TitleGenres,
+    TitleRating,
+    TitleRatings,
+)
+from Code.moviestats.warehouse import read_snapshot_table, snapshot_files
+
+
+USER_COLUMNS = ["your_rating", "date_rated", "date_rated_epoch"]
+PEOPLE_TABLES = {
+    "actors": ("movie_actors", "actor_id"),
+    "directors": ("movie_directors", "director_id"),
+    "genres": ("movie_genres", "genre_id"),
+}
+
+
+def to_records(record_type: type, table: pa.Table) -> list:
+    """Wraps the rows of a table into records, its columns being the fields in order."""
+    columns = (column.to_pylist() for column in table.columns)
+    return list(map(record_type._make, zip(*columns)))
+
+
+class ArrowRatingsAnalyser:
+    """A class to analyse the IMDb ratings of a snapshot directory.
+
+    Parameters
+    ----------
+    directory : str
+        The snapshot directory written by warehouse.export_database
+    user : str
+        The user profile to scope the statistics to. The ratings of imdb_ratings if None
+    """
+
+    def __init__(self, directory: str, user: str = None):
+        self.directory = directory
+        self.user = user
+        self._files = snapshot_files(directory)
+        self._tables = {}
+        if "imdb_ratings" not in self._files:
+            raise ValueError(f"no imdb_ratings table in the snapshot {directory}")
+        self.ratings = self.table("imdb_ratings")
+        if user is not None:
+            users = self.table("users")
+            matches = users.filter(pc.equal(users["name"].cast(pa.string()), user))
+            if not len(matches):
+                raise ValueError(f"unknown user: {user}")
+            user_ratings = self.table("user_ratings")
+            user_ratings = user_ratings.filter(
+                pc.equal(user_ratings["user_id"], matches["user_id"][0])
+            ).select(["const", *USER_COLUMNS])
+            self.ratings = self.ratings.drop_columns(USER_COLUMNS).join(
+                user_ratings, "const", join_type="inner"
+            )
+
+    def __len__(self) -> int:
+        return self.ratings.num_rows
+
+    def table(self, table_name: str) -> pa.Table:
+        """Returns a memory-mapped snapshot table, mapping it on first use."""
+        if table_name not in self._tables:
+            if table_name not in self._files:
+                raise ValueError(f"no {table_name} table in the snapshot")
+            self._tables[table_name] = read_snapshot_table(self._files[table_name])
+        return self._tables[table_name]
+
+    def _with_names(self, table_name: str, columns: list) -> pa.Table:
+        """Joins the given ratings columns with the names of their people or genres."""
+        link_table, column_id = PEOPLE_TABLES[table_name]
+        joined = (
+            self.ratings.select(columns)
+            .join(self.table(link_table), "id", "movie_id", join_type="inner")
+            .join(
+                self.table(table_name).select([column_id, "name"]),
+                column_id,
+                join_type="inner",
+            )
+        )
+        return joined.set_column(
+            joined.schema.get_field_index("name"),
+            "name",
+            joined["name"].cast(pa.string()),
+        )
+
+    def get_top_ratings(self, top_n: int = 10) -> list:
+        """Gets the top_n personally highest-rated movies
+
+        Parameters
+        ----------
+        top_n : int
+            the number of movies to return
+
+        Returns
+        ----------
+        list[TitleRating]
+            The top_n movies
+        """
+        if top_n < 1:
+            raise ValueError(POSITIVE_INT_ERR_MESSAGE)
+        return to_records(
+            TitleRating,
+            self.ratings.select(["title", "your_rating"])
+            .sort_by([("your_rating", "descending")])
+            .slice(0, top_n),
+        )
+
+    def get_movies_per_rating(self) -> list:
+        """Gets a movie and/or TV show for each rating.
+
+        Returns
+        ----------
+        list[TitleRating]
+            A title for each rating
+        """
+        grouped = (
+            self.ratings.group_by("your_rating", use_threads=False)
+            .aggregate([("title", "first")])
+            .sort_by([("your_rating", "descending")])
+        )
+        return to_records(TitleRating, grouped.select(["title_first", "your_rating"]))
+
+    def get_total_movie_watching_time(self, days: bool = False) -> float:
+        """Get the total watching time in hours/days. Filter is done on movies only.
+
+        Parameters
+        ----------
+        days : bool
+            if True, return the total watching time in days. Otherwise, return it in hours
+
+        Returns
+        ----------
+        float
+            The total watching time
+        """
+        movies = self.ratings.filter(pc.equal(self.ratings["title_type"], "movie"))
+        total_time = pc.sum(movies["runtime_mins"]).as_py() or 0
+        return total_time / 60 / (24 if days else 1)
+
+    def get_ratings(self) -> list:
+        """Gets the list of IMDb and personal ratings.
+
+        Returns
+        ----------
+        list[TitleRatings]
+            The list of ratings
+        """
+        return to_records(
+            TitleRatings, self.ratings.select(["title", "your_rating", "imdb_rating"])
+        )
+
+    def get_rating_differences(self) -> list:
+        """Calculates the differences between personal ratings and IMDb ratings.
+
+        Returns
+        ----------
+        list[RatingDifference]
+            The list of rating differences
+        """
+        differences = pc.subtract(
+            self.ratings["your_rating"], self.ratings["imdb_rating"]
+        )
+        return to_records(
+            RatingDifference,
+            pa.table({"title": self.ratings["title"], "difference": differences}),
+        )
+
+    def get_mean_rating(self) -> float:
+        """Computes the mean rating across the entire dataset.
+
+        Returns
+        ----------
+        float
+            The mean rating
+        """
+        return pc.mean(self.ratings["your_rating"]).as_py()
+
+    def get_average_rating_by_genre(self) -> list:
+        """Gets the average rating for each genre
+
+        Returns
+        ----------
+        list[NameRating]
+            The average rating for each genre
+        """
+        genres = self._with_names("genres", ["id", "your_rating"])
+        genres = genres.set_column(
+            genres.schema.get_field_index("name"),
+            "name",
+            pc.utf8_trim_whitespace(genres["name"]),
+        )
+        grouped = (
+            genres.group_by("name")
+            .aggregate([("your_rating", "mean")])
+            .sort_by([("your_rating_mean", "descending")])
+        )
+        return to_records(NameRating, grouped.select(["name", "your_rating_mean"]))
+
+    def get_title_genre_ratings(self, is_movie: bool = True) -> list:
+        """Gets the mean personal rating and list of corresponding genres for each movie or TV show
+
+        Parameters
+        ----------
+        is_movie : bool
+            if True, return only movies. Otherwise, return only TV shows or mini-series
+
+        Returns
+        ----------
+        list[TitleGenres]
+            The mean rating and list of genres for each movie or TV show
+        """
+        title_types = ["movie"] if is_movie else ["tvSeries", "tvMiniSeries"]
+        genres = self._with_names(
+            "genres", ["id", "title", "your_rating", "title_type"]
+        )
+        genres = genres.filter(
+            pc.is_in(genres["title_type"].cast(pa.string()), pa.array(title_types))
+        )
+        grouped = (
+            genres.group_by("title", use_threads=False)
+            .aggregate([("name", "list"), ("your_rating", "first")])
+            .sort_by("title")
+        )
+        return to_records(
+            TitleGenres,
+            pa.table(
+                {
+                    "title": grouped["title"],
+                    "genres": pc.binary_join(grouped["name_list"], ","),
+                    "your_rating": grouped["your_rating_first"],
+                }
+            ),
+        )
+
+    def _people_stats(
+        self, table_name: str, top_n: int, sort_key: str, count: bool
+    ) -> pa.Table:
+        """Aggregates the count and mean personal rating of the titles of each person.
+
+        Names are unique, so the titles are grouped by person id and only the names of the
+        top_n people are looked up.
+        """
+        if top_n < 1:
+            raise ValueError(POSITIVE_INT_ERR_MESSAGE)
+        link_table, column_id = PEOPLE_TABLES[table_name]
+        grouped = (
+            self.ratings.select(["id", "your_rating"])
+            .join(self.table(link_table), "id", "movie_id", join_type="inner")
+            .group_by(column_id)
+            .aggregate([("id", "count"), ("your_rating", "mean")])
+            .sort_by([(sort_key, "descending")])
+            .slice(0, top_n)
+        )
+        names = self.table(table_name).select([column_id, "name"])
+        grouped = grouped.join(names, column_id, join_type="inner").sort_by(
+            [(sort_key, "descending")]
+        )
+        columns = (
+            ["name", "id_count", "your_rating_mean"]
+            if count
+            else ["name", "your_rating_mean"]
+        )
+        return grouped.select(columns)
+
+    def get_mean_rating_for_highest_directors(self, top_n: int = 10) -> list:
+        """Gets the mean personal rating for the top_n highest-rated directors
+
+        Parameters
+        ----------
+        top_n : int
+            the number of entries to return
+
+        Returns
+        ----------
+        list[NameRating]
+            The mean rating for each director
+        """
+        return to_records(
+            NameRating,
+            self._people_stats("directors", top_n, "your_rating_mean", count=False),
+        )
+
+    def get_stats_for_most_frequent_directors(self, top_n: int = 10) -> list:
+        """Gets the mean personal rating and count for the top_n directors with the most rated movies
+
+        Parameters
+        ----------
+        top_n : int
+            the number of entries to return
+
+        Returns
+        ----------
+        list[NameStats]
+            The mean rating for each director
+        """
+        return to_records(
+            NameStats, self._people_stats("directors", top_n, "id_count", count=True)
+        )
+
+    def get_mean_rating_for_highest_actors(self, top_n: int = 10) -> list:
+        """Gets the mean personal rating for the top_n highest-rated actors
+
+        Parameters
+        ----------
+        top_n : int
+            the number of entries to return
+
+        Returns
+        ----------
+        list[NameRating]
+            The mean rating for each actor
+        """
+        return to_records(
+            NameRating,
+            self._people_stats("actors", top_n, "your_rating_mean", count=False),
+        )
+
+    def get_stats_for_most_frequent_actors(self, top_n: int = 10) -> list:
+        """Gets the mean personal rating and count for the top_n actors with the most rated movies
+
+        Parameters
+        ----------
+        top_n : int
+            the number of entries to return
+
+        Returns
+        ----------
+        list[NameStats]
+            The mean rating and movie count for each actor
+        """
+        return to_records(
+            NameStats, self._people_stats("actors", top_n, "id_count", count=True)
+        )
+
+    def get_movie_list_for(self, actor_name: str) -> list:
+        """Gets the list of movies and/or TV shows for a given actor.
+
+        Parameters
+        ----------
+        actor_name : str
+            The name of the actor
+
+        Returns
+        ----------
+        list[TitleRating]
+            The list of movies and/or TV shows for the actor
+        """
+        actors = self.table("actors")
+        actor_ids = actors.filter(
+            pc.equal(actors["name"].cast(pa.string()), actor_name)
+        )["actor_id"]
+        links = self.table("movie_actors")
+        movie_ids = links.filter(pc.is_in(links["actor_id"], actor_ids))["movie_id"]
+        return to_records(
+            TitleRating,
+            self.ratings.filter(pc.is_in(self.ratings["id"], movie_ids)).select(
+                ["title", "your_rating"]
+            ),
+        )
@@ -0,0 +1,374 @@
+"""This module records every change made to the ratings database in an append-only change log.
+
+Triggers on the ratings, people, link and user tables append one row per inserted, updated or
+deleted row to the changes table, whatever wrote it: populate_database, a bulk import or a manual
+UPDATE. Each change gets an increasing version number. Bulk loads suspend the triggers and record
+a single load change per table instead, telling consumers to reread the whole table.
+
+Consumers of the database (caches, indexes, aggregates) remember the last version they
+processed. ChangeFeed.pull returns the changes they have not processed yet, so they can update
+incrementally instead of recomputing everything, and ChangeFeed.lag tells how far behind they are.
+ChangeFeed.prune deletes the changes every consumer processed and remembers up to which version
+it did: a consumer still behind it, e.g. one registered later, is sent a load change per table
+instead of the deleted changes.
+"""
+
+from pathlib import Path
+from sqlite3 import OperationalError, connect
+from typing import NamedTuple
+
+
+# table -> SQL expression of the key of a row, {row} being NEW or OLD
+TRACKED_TABLES = {
+    "imdb_ratings": "{row}.const",
+    "actors": "{row}.actor_id",
+    "directors": "{row}.director_id",
+    "genres": "{row}.genre_id",
+    "musicians": "{row}.musician_id",
+    "movie_actors": "{row}.movie_id || ':' || {row}.actor_id",
+    "movie_directors": "{row}.movie_id || ':' || {row}.director_id",
+    "movie_genres": "{row}.movie_id || ':' || {row}.genre_id",
+    "movie_musicians": "{row}.movie_id || ':' || {row}.musician_id",
+    "users": "{row}.user_id",
+    "user_ratings": "{row}.user_id || ':' || {row}.const",
+    "series_episodes": "{row}.const",
+}
+# Unix time with sub-second precision
+NOW = "((julianday('now') - 2440587.5) * 86400.0)"
+
+
+class Change(NamedTuple):
+    """A change of one row of the database."""
+
+    version: int
+    table_name: str
+    key: str
+    op: str  # insert, update, delete or load (the whole table was bulk-loaded)
+    changed_at: float  # Unix time
+
+
+class Lag(NamedTuple):
+    """How far a consumer is behind the change log."""
+
+    versions: int  # number of changes it has not processed
+    seconds: float  # age of the oldest change it has not processed, 0 if up to date
+
+
+def create_change_log(cursor) -> None:
+    """Creates the change log tables and the triggers of the tracked tables that exist.
+
+    Parameters
+    ----------
+    cursor : Cursor
+        The SQL cursor to use
+    """
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS changes(
+            version INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL,
+            key TEXT,
+            op TEXT NOT NULL,
+            changed_at REAL NOT NULL
+        )"""
+    )
+    cursor.execute(
+        """CREATE INDEX IF NOT EXISTS idx_changes_table_name
+        ON changes(table_name, version)"""
+    )
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS change_consumers(
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            updated_at REAL
+        )"""
+    )
+    # a single row holding the version up to which changes were deleted by ChangeFeed.prune
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS change_log_pruned(
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL,
+            pruned_at REAL NOT NULL
+        )"""
+    )
+    tables = {
+        row[0]
+        for row in cursor.execute(
+            """SELECT name FROM sqlite_master WHERE type = 'table'"""
+        ).fetchall()
+    }
+    for table_name, key in TRACKED_TABLES.items():
+        if table_name not in tables:
+            continue
+        for op, row in (("insert", "NEW"), ("update", "NEW"), ("delete", "OLD")):
+            cursor.execute(
+                f"""CREATE TRIGGER IF NOT EXISTS {table_name}_changes_{op}
+                AFTER {op.upper()} ON {table_name}
+                BEGIN
+                    INSERT INTO changes (table_name, key, op, changed_at)
+                    VALUES ('{table_name}', {key.format(row=row)}, '{op}', {NOW});
+                END"""
+            )
+
+
+def drop_change_triggers(cursor) -> None:
+    """Drops the triggers of the tracked tables, e.g. before a bulk load.
+
+    Parameters
+    ----------
+    cursor : Cursor
+        The SQL cursor to use
+    """
+    for table_name in TRACKED_TABLES:
+        for op in ("insert", "update", "delete"):
+            cursor.execute(f"""DROP TRIGGER IF EXISTS {table_name}_changes_{op}""")
+
+
+def record_load(cursor, table_name: str) -> None:
+    """Records that a table was bulk-loaded while its triggers were dropped.
+
+    Parameters
+    ----------
+    cursor : Cursor
+        The SQL cursor to use
+    table_name : str
+        The name of the loaded table
+    """
+    cursor.execute(
+        f"""INSERT INTO changes (table_name, key, op, changed_at)
+        VALUES (?, NULL, 'load', {NOW})""",
+        (table_name,),
+    )
+
+
+def latest_change(cursor, tables: list) -> int:
+    """Returns the version of the latest change of the given tables, 0 without a change log.
+
+    Parameters
+    ----------
+    cursor : Cursor
+        The SQL cursor to use
+    tables : list
+        The names of the tables
+
+    Returns
+    ----------
+    int
+        The latest version, which changes whenever a row of one of the tables changes
+    """
+    try:
+        return max(
+            cursor.execute(
+                """SELECT MAX(version) FROM changes WHERE table_name = ?""", (table,)
+            ).fetchone()[0]
+            or 0
+            for table in tables
+        )
+    except OperationalError:  # database created before the change log
+        return 0
+
+
+class ChangeFeed:
+    """A class to read the change log of a database and track the progress of its consumers.
+
+    Parameters
+    ----------
+    db_name : str
+        The name of the database
+    read_only : bool
+        Whether to open the database read-only, e.g. a replica. The change log is then not
+        created, so consumers can be read but not acknowledged
+    """
+
+    def __init__(self, db_name: str = "imdb_ratings.db", read_only: bool = False):
+        if read_only:
+            # read-only connections may be handed over to worker threads
+            self.conn = connect(
+                f"{Path(db_name).resolve().as_uri()}?mode=ro",
+                uri=True,
+                check_same_thread=False,
+            )
+            self.cursor = self.conn.cursor()
+            return
+        self.conn = connect(db_name)
+        self.cursor = self.conn.cursor()
+        create_change_log(self.cursor)
+        self.conn.commit()
+
+    def __del__(self):
+        self.conn.close()
+
+    def latest_version(self) -> int:
+        """Returns the version of the latest change, 0 if nothing changed yet."""
+        version = self.cursor.execute("""SELECT MAX(version) FROM changes""").fetchone()
+        return version[0] or 0
+
+    def pruned(self) -> tuple:
+        """Returns the version up to which changes were pruned and when, (0, None) if never."""
+        try:
+            row = self.cursor.execute(
+                """SELECT version, pruned_at FROM change_log_pruned"""
+            ).fetchone()
+        except OperationalError:  # read-only database older than change_log_pruned
+            row = None
+        return row or (0, None)
+
+    def changes_since(
+        self, version: int = 0, tables: list = None, limit: int = None
+    ) -> list:
+        """Gets the changes made after a version.
+
+        Changes deleted by prune are not returned, see pull.
+
+        Parameters
+        ----------
+        version : int
+            The version after which changes are returned
+        tables : list
+            The tables whose changes are returned. All if None
+        limit : int
+            The maximum number of changes to return, oldest first. All if None
+
+        Returns
+        ----------
+        list[Change]
+            The changes, in version order
+        """
+        table_filter, params = "", (version,)
+        if tables:
+            table_filter = f"AND table_name IN ({','.join('?' * len(tables))})"
+            params += tuple(tables)
+        return list(
+            map(
+                Change._make,
+                self.cursor.execute(
+                    f"""SELECT version, table_name, key, op, changed_at FROM changes
+                    WHERE version > ? {table_filter} ORDER BY version
+                    LIMIT {-1 if limit is None else int(limit)}""",
+                    params,
+                ),
+            )
+        )
+
+    def has_consumer(self, consumer: str) -> bool:
+        """Returns whether a consumer has acknowledged changes before."""
+        return (
+            self.cursor.execute(
+                """SELECT 1 FROM change_consumers WHERE name = ?""", (consumer,)
+            ).fetchone()
+            is not None
+        )
+
+    def consumer_version(self, consumer: str) -> int:
+        """Returns the last version processed by a consumer, 0 for a new consumer."""
+        row = self.cursor.execute(
+            """SELECT version FROM change_consumers WHERE name = ?""", (consumer,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def pull(self, consumer: str, tables: list = None, limit: int = None) -> list:
+        """Gets the changes a consumer has not processed yet.
+
+        The consumer's version does not move until it calls acknowledge, so changes are
+        delivered again if the consumer fails before processing them (at-least-once delivery).
+        If some of its changes were pruned, they are replaced by a load change of each table,
+        all with the pruned version, telling the consumer to reread the tables. They are
+        returned whatever the limit, so that acknowledging the last change skips none of them.
+
+        Parameters
+        ----------
+        consumer : str
+            The name of the consumer
+        tables : list
+            The tables the consumer is interested in. All if None
+        limit : int
+            The maximum number of changes to return. All if None
+
+        Returns
+        ----------
+        list[Change]
+            The unprocessed changes, in version order
+        """
+        version = self.consumer_version(consumer)
+        pruned_version, pruned_at = self.pruned()
+        if version >= pruned_version:
+            return self.changes_since(version, tables, limit)
+        loads = [
+            Change(pruned_version, table_name, None, "load", pruned_at)
+            for table_name in tables or TRACKED_TABLES
+        ]
+        if limit is not None:
+            limit = max(limit - len(loads), 0)
+        return loads + self.changes_since(pruned_version, tables, limit)
+
+    def acknowledge(self, consumer: str, version: int) -> None:
+        """Records that a consumer processed every change up to version."""
+        self.cursor.execute(
+            f"""INSERT INTO change_consumers (name, version, updated_at) VALUES (?, ?, {NOW})
+            ON CONFLICT(name) DO UPDATE SET
+                version = MAX(version, excluded.version),
+                updated_at = excluded.updated_at""",
+            (consumer, version),
+        )
+        self.conn.commit()
+
+    def lag(self, consumer: str, tables: list = None) -> Lag:
+        """Measures how far a consumer is behind the latest change.
+
+        Parameters
+        ----------
+        consumer : str
+            The name of the consumer
+        tables : list
+            The tables the consumer is interested in, as given to pull. All if None
+
+        Returns
+        ----------
+        Lag
+            The number of changes pull would return and the age of the oldest one
+        """
+        version = self.consumer_version(consumer)
+        pruned_version, pruned_at = self.pruned()
+        table_filter, params = "", (max(version, pruned_version),)
+        if tables:
+            table_filter = f"AND table_name IN ({','.join('?' * len(tables))})"
+            params += tuple(tables)
+        count, oldest = self.cursor.execute(
+            f"""SELECT COUNT(*), MIN(changed_at) FROM changes
+            WHERE version > ? {table_filter}""",
+            params,
+        ).fetchone()
+        if version < pruned_version:  # the pruned changes are replaced by load changes
+            count += len(tables or TRACKED_TABLES)
+            oldest = pruned_at
+        if oldest is None:
+            return Lag(count, 0.0)
+        now = self.cursor.execute(f"""SELECT {NOW}""").fetchone()[0]
+        return Lag(count, now - oldest)
+
+    def prune(self) -> int:
+        """Deletes the changes processed by every consumer, remembering the pruned version.
+
+        Returns
+        ----------
+        int
+            The number of deleted changes
+        """
+        version = self.cursor.execute(
+            """SELECT MIN(version) FROM change_consumers"""
+        ).fetchone()[0]
+        if version is None:
+            return 0
+        deleted = self.cursor.execute(
+            """DELETE FROM changes WHERE version <= ?""", (version,)
+        ).rowcount
+        if deleted:
+            self.cursor.execute(
+                f"""INSERT INTO change_log_pruned (id, version, pruned_at)
+                VALUES (1, ?, {NOW})
+                ON CONFLICT(id) DO UPDATE SET
+                    version = MAX(version, excluded.version),
+                    pruned_at = excluded.pruned_at""",
+                (version,),
+            )
+        self.conn.commit()
+        return deleted
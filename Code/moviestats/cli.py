@@ -0,0 +1,804 @@
+"""Command line interface of the moviestats package.
+
+Every subcommand imports what it needs when it runs, so that heavy dependencies (pandas, the IMDb
+scraper, matplotlib, the MySQL connector) are only paid for by the subcommands that use them. The
+stats subcommand only relies on the standard library.
+"""
+
+import argparse
+from contextlib import nullcontext
+from sqlite3 import connect
+
+
+DEFAULT_DB = "imdb_ratings.db"
+STARTUP_TARGET_SECONDS = 0.15  # wall time budget of `stats top` on a warm cache
+
+STATS_QUERIES = {
+    "top": lambda a, n: a.get_top_ratings(n),
+    "per-rating": lambda a, n: a.get_movies_per_rating(),
+    "genres": lambda a, n: a.get_average_rating_by_genre(),
+    "directors": lambda a, n: a.get_mean_rating_for_highest_directors(n),
+    "frequent-directors": lambda a, n: a.get_stats_for_most_frequent_directors(n),
+    "actors": lambda a, n: a.get_mean_rating_for_highest_actors(n),
+    "frequent-actors": lambda a, n: a.get_stats_for_most_frequent_actors(n),
+    "differences": lambda a, n: a.get_rating_differences(),
+}
+PLOTS = ["genre-combinations", "rating-scatter", "rating-differences"]
+
+
+def ingest(args: argparse.Namespace) -> None:
+    """Creates the database if needed and adds the ratings of the CSV export to it."""
+    if args.backend == "mysql":
+        from Code.moviestats.db import MySQLDatabaseHandler
+
+        mysql_db = MySQLDatabaseHandler()
+        mysql_db.create_db_tables()
+        mysql_db.populate_database()
+        del mysql_db
+        return
+
+    from Code.moviestats.db_functions import (
+        RATINGS_FILE,
+        create_local_database,
+        populate_database,
+        populate_user_ratings,
+    )
+
+    from Code.moviestats.search import SearchIndex
+    from Code.moviestats.sketches import RatingsSketches
+
+    create_local_database(args.db)
+    refresher = nullcontext()
+    if args.replica:
+        from Code.moviestats.replica import ReplicaRefresher
+
+        refresher = ReplicaRefresher(args.db, args.replica, args.replica_interval)
+    with refresher:
+        if args.profile:
+            profiles = dict(profile.split("=", 1) for profile in args.profile)
+            for user, count in populate_user_ratings(
+                profiles,
+                args.db,
+                engine=args.engine,
+                memory_budget=args.memory_budget,
+            ).items():
+                print(f"{user}: {count} ratings")
+        else:
+            conn = connect(args.db)
+            sketches = RatingsSketches.load(conn.cursor())
+            conn.close()
+            populate_database(
+                args.csv or RATINGS_FILE,
+                args.db,
+                sketches=sketches,
+                engine=args.engine,
+                memory_budget=args.memory_budget,
+            )
+        SearchIndex(args.db).build()
+        rebuild_graph(args.db, args.memory_budget)
+        refresh_aggregates(args.db)
+
+
+def rebuild_graph(db_name: str, memory_budget=None) -> None:
+    """Rebuilds and saves the collaboration graph if the link tables changed."""
+    from Code.moviestats.graph import CollaborationGraph
+    from Code.moviestats.ratings_analyser import RatingsAnalyser
+
+    CollaborationGraph.load(RatingsAnalyser(db_name, memory_budget=memory_budget))
+
+
+def refresh_aggregates(db_name: str) -> dict:
+    """Updates the aggregates maintained from the change log, which queries only read.
+
+    Returns
+    ----------
+    dict
+        The number of changes processed by each aggregate
+    """
+    from Code.moviestats.profiles import CareerProfiles
+    from Code.moviestats.watch_time import WatchTime
+
+    return {
+        "watch time": WatchTime(db_name).refresh(),
+        "career profiles": CareerProfiles(db_name).refresh(),
+    }
+
+
+def refresh(args: argparse.Namespace) -> None:
+    """Updates the aggregates with the changes made since the last ingestion or refresh."""
+    for name, count in refresh_aggregates(args.db).items():
+        print(f"{name}: {count} changes")
+
+
+def open_analyser(args: argparse.Namespace, **options):
+    """Opens the RatingsAnalyser of the database scoped to --user, exiting if it is unknown."""
+    from Code.moviestats.ratings_analyser import RatingsAnalyser
+
+    try:
+        return RatingsAnalyser(args.db, user=args.user, **options)
+    except ValueError as e:
+        raise SystemExit(str(e)) from e
+
+
+def export(args: argparse.Namespace) -> None:
+    """Writes every table of the database to Arrow or Parquet files."""
+    from Code.moviestats.warehouse import export_database
+
+    for table_name, count in export_database(
+        args.db, args.directory, args.format, args.batch_size
+    ).items():
+        print(f"{table_name}: {count} rows")
+
+
+def import_(args: argparse.Namespace) -> None:
+    """Bulk-loads an Arrow or Parquet snapshot into an empty database."""
+    from Code.moviestats.warehouse import import_snapshot
+
+    imported = import_snapshot(args.directory, args.db, args.backend, args.batch_size)
+    for table_name, count in imported.items():
+        print(f"{table_name}: {count} rows")
+    if args.backend == "sqlite":
+        from Code.moviestats.search import SearchIndex
+        from Code.moviestats.sketches import RatingsSketches
+
+        conn = connect(args.db)
+        cursor = conn.cursor()
+        # user profiles have their own sketches, see populate_user_ratings
+        users = []
+        if cursor.execute(
+            """SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'users'"""
+        ).fetchone():
+            users = [row[0] for row in cursor.execute("""SELECT name FROM users""")]
+        for name, user in [(user, user) for user in users] or [("default", None)]:
+            RatingsSketches.from_database(
+                cursor, name, args.memory_budget, user=user
+            ).save(cursor)
+        conn.commit()
+        conn.close()
+        SearchIndex(args.db).build()
+        rebuild_graph(args.db, args.memory_budget)
+        refresh_aggregates(args.db)
+
+
+def stats(args: argparse.Namespace) -> None:
+    """Prints one of the statistics computed by the RatingsAnalyser."""
+    from Code.moviestats.helpers import format_basic_output
+
+    if args.snapshot:
+        if args.query not in STATS_QUERIES:
+            raise SystemExit(f"{args.query} is not available on snapshots")
+        from Code.moviestats.arrow_analyser import ArrowRatingsAnalyser
+
+        try:
+            analyser = ArrowRatingsAnalyser(args.snapshot, user=args.user)
+        except ValueError as e:
+            raise SystemExit(str(e)) from e
+        print(format_basic_output(STATS_QUERIES[args.query](analyser, args.top)))
+        return
+
+    diagnostics = None
+    if args.slow_ms is not None:
+        import logging
+
+        from Code.moviestats.diagnostics import QueryDiagnostics
+
+        logging.basicConfig(format="%(levelname)s %(name)s: %(message)s")
+        diagnostics = QueryDiagnostics(threshold=args.slow_ms / 1000)
+    analyser = open_analyser(args, diagnostics=diagnostics)
+    if args.actor:
+        movie_list = analyser.get_movie_list_for(args.actor)
+        if movie_list:
+            print(format_basic_output(movie_list))
+        else:
+            from Code.moviestats.search import SearchIndex
+
+            hits = SearchIndex(args.db).search(args.actor, ["actor"], limit=5)
+            print(f"No titles found for {args.actor!r}")
+            if hits:
+                print(f"Did you mean: {', '.join(hit.name for hit in hits)}?")
+    elif args.approximate and args.query.startswith("frequent-"):
+        from Code.moviestats.sketches import RatingsSketches
+
+        # each user profile has its own sketches, which are merged to cover every user
+        saved = RatingsSketches.saved_names(analyser.cursor)
+        if not saved or args.user and args.user not in saved:
+            raise SystemExit(
+                f"no sketches saved in {args.db}"
+                + (f" for user {args.user}" if args.user else "")
+                + ", ingest or import the ratings to build them"
+            )
+        if args.user:
+            sketches = RatingsSketches.load(analyser.cursor, args.user)
+        else:
+            sketches = RatingsSketches.load_merged(analyser.cursor)
+        query = args.query.replace("frequent-", "get_stats_for_most_frequent_")
+        print(format_basic_output(getattr(sketches, query)(args.top)))
+    elif args.query == "watch-time":
+        from Code.moviestats.watch_time import WatchTime
+
+        try:
+            watch_time = WatchTime(args.db, user=args.user, read_only=not args.episodes)
+            if args.episodes:
+                for const, episodes in args.episodes:
+                    watch_time.set_episodes(const, episodes)
+                watch_time.refresh()
+            if args.by:
+                result = format_basic_output(
+                    watch_time.get_watching_time_by(args.by, args.days)
+                )
+            else:
+                result = f"{watch_time.get_total_watching_time(args.days):.1f}"
+            estimated = watch_time.get_estimated_series(args.days)
+        except ValueError as e:
+            raise SystemExit(str(e)) from e
+        print(result)
+        if estimated:
+            print(
+                f"Includes {len(estimated)} series whose number of episodes is "
+                f"estimated ({sum(entry.hours for entry in estimated):.1f} "
+                f"{'days' if args.days else 'hours'}), e.g. "
+                + ", ".join(f"{entry.const} {entry.title}" for entry in estimated[:3])
+                + ". Set it with --episodes CONST=N"
+            )
+    elif args.query == "report":
+        from Code.moviestats.report import DEFAULT_REPORT
+
+        for entry in analyser.run_report(DEFAULT_REPORT, timeout=args.timeout):
+            status = "cancelled" if entry.cancelled else entry.error or "ok"
+            print(f"###### {entry.name} ({entry.elapsed * 1000:.1f} [ms], {status})")
+            if isinstance(entry.result, list):
+                print(format_basic_output(entry.result[: args.top]))
+            else:
+                print(entry.result)
+    else:
+        print(format_basic_output(STATS_QUERIES[args.query](analyser, args.top)))
+
+
+def plot(args: argparse.Namespace) -> None:
+    """Draws one of the available plots."""
+    from Code.moviestats import plotting_utils
+    from Code.moviestats.recommendations import get_movie_genre_combination_ratings
+
+    analyser = open_analyser(args, memory_budget=args.memory_budget)
+    if args.kind == "genre-combinations":
+        plotting_utils.plot_movie_genre_combinations(
+            get_movie_genre_combination_ratings(analyser)[: args.top]
+        )
+    elif args.kind == "rating-scatter":
+        plotting_utils.plot_rating_difference_scatter(analyser.get_ratings())
+    else:
+        plotting_utils.plot_rating_difference_distribution(
+            analyser.get_rating_differences()
+        )
+
+
+def recommend(args: argparse.Namespace) -> None:
+    """Prints the best rated genre combinations."""
+    from Code.moviestats.helpers import format_genre_combinations_output
+    from Code.moviestats.recommendations import get_movie_genre_combination_ratings
+
+    analyser = open_analyser(args, memory_budget=args.memory_budget)
+    print(
+        format_genre_combinations_output(
+            get_movie_genre_combination_ratings(analyser), args.top
+        )
+    )
+
+
+def graph(args: argparse.Namespace) -> None:
+    """Prints collaboration network statistics."""
+    from Code.moviestats.graph import CollaborationGraph
+    from Code.moviestats.helpers import format_basic_output
+
+    network = CollaborationGraph.load(
+        open_analyser(args, memory_budget=args.memory_budget)
+    )
+    if args.query == "separation":
+        if len(args.people) != 2:
+            raise SystemExit("separation needs the names of two people")
+        try:
+            separation = network.degrees_of_separation(*args.people)
+        except ValueError as e:
+            raise SystemExit(e) from e
+        if separation is None:
+            print("These people are not connected")
+        else:
+            print(f"{separation.degrees} degrees: {' -> '.join(separation.path)}")
+    elif args.query == "central":
+        try:
+            central = network.get_most_central_people(args.top, args.kind, args.around)
+        except ValueError as e:
+            raise SystemExit(e) from e
+        print(format_basic_output(central))
+    else:
+        print(
+            format_basic_output(
+                network.get_directors_with_best_rated_regular_actors(args.top)
+            )
+        )
+
+
+def taste(args: argparse.Namespace) -> None:
+    """Prints what drives personal ratings away from IMDb ratings, or predicted ratings."""
+    from Code.moviestats.helpers import format_basic_output
+    from Code.moviestats.taste_model import TasteModel
+
+    analyser = open_analyser(args, memory_budget=args.memory_budget)
+    try:
+        model = TasteModel(analyser, alpha=args.alpha).fit()
+    except ValueError as e:
+        raise SystemExit(str(e)) from e
+    if args.query == "predict":
+        predictions = model.predict(args.top)
+        if not predictions:
+            # without profiles, the database only holds the titles its owner rated
+            raise SystemExit(
+                "every title with an IMDb rating is rated already"
+                + (
+                    ""
+                    if args.user
+                    else ", load several profiles with ingest --profile and pick one"
+                    " with --user to predict the titles it has not rated"
+                )
+            )
+        print(format_basic_output(predictions))
+        return
+    print(f"###### Above IMDb (R^2 = {model.r_squared:.2f})")
+    print(format_basic_output(model.get_feature_effects(args.top, above=True)))
+    print("###### Below IMDb")
+    print(format_basic_output(model.get_feature_effects(args.top, above=False)))
+
+
+def profile(args: argparse.Namespace) -> None:
+    """Prints the career profiles of people, their filmographies or the best profiles."""
+    from Code.moviestats.helpers import format_basic_output
+    from Code.moviestats.profiles import CareerProfiles
+
+    try:
+        profiles = CareerProfiles(args.db, user=args.user, read_only=True)
+        if not args.names:
+            print(
+                format_basic_output(
+                    profiles.get_top_profiles(args.kind, args.top, args.min_titles)
+                )
+            )
+            return
+        found = profiles.get_profiles(args.names, args.kind)
+    except ValueError as e:
+        raise SystemExit(str(e)) from e
+    print(format_basic_output(found))
+    missing = set(args.names) - {entry.name for entry in found}
+    if missing:
+        print(f"No rated titles found for {', '.join(sorted(missing))}")
+    if args.filmography:
+        for entry in found:
+            print(f"###### {entry.name}")
+            print(format_basic_output(profiles.get_filmography(entry.name, args.kind)))
+
+
+def cube(args: argparse.Namespace) -> None:
+    """Prints the rating statistics of a slice of the rating cube, rolled up to some dimensions."""
+    from Code.moviestats.helpers import format_basic_output
+
+    rating_cube = open_analyser(
+        args, memory_budget=args.memory_budget
+    ).get_rating_cube()
+    print(
+        format_basic_output(
+            rating_cube.aggregate(
+                args.by,
+                genres=args.genres,
+                exact_genres=args.exact,
+                decades=args.decades,
+                title_types=args.types,
+                bands=args.bands,
+            )
+        )
+    )
+
+
+def collab(args: argparse.Namespace) -> None:
+    """Trains the collaborative model, folds a user in or prints their recommendations."""
+    from pathlib import Path
+
+    from Code.moviestats.collaborative import CollaborativeModel, read_user_ratings
+
+    model_dir = args.model or str(Path(args.db).with_suffix(".model"))
+    if args.action == "train":
+        try:
+            model = CollaborativeModel.train(
+                args.db, rank=args.rank, memory_budget=args.memory_budget
+            )
+        except ValueError as e:
+            raise SystemExit(
+                f"{e}, load user profiles with ingest --profile first"
+            ) from e
+        model.save(model_dir)
+        print(
+            f"Trained on {len(model.names)} users and {len(model.consts)} titles "
+            f"(rank {model.rank}), saved to {model_dir}"
+        )
+        return
+    if args.user is None:
+        raise SystemExit(f"collab {args.action} needs a --user")
+    try:
+        model = CollaborativeModel.load(model_dir)
+    except ValueError as e:
+        raise SystemExit(f"{e}, train the model first with collab train") from e
+    conn = connect(args.db)
+    if args.action == "fold-in" or args.user not in model.names:
+        try:
+            known = model.fold_in(
+                args.user, *read_user_ratings(conn.cursor(), args.user)
+            )
+        except ValueError as e:
+            raise SystemExit(str(e)) from e
+        if args.action == "fold-in":
+            model.save(model_dir, users_only=True)
+            print(f"Folded {args.user} in from {known} ratings of known titles")
+            return
+    from Code.moviestats.helpers import format_basic_output
+    from Code.moviestats.taste_model import PredictedRating
+
+    recommendations = model.recommend([args.user], args.top)[0]
+    if not recommendations:
+        raise SystemExit(
+            f"{args.user} rated every title known to the model, train it again to "
+            "include the titles rated since"
+        )
+    titles = dict(
+        (const, (title, imdb_rating))
+        for const, title, imdb_rating in conn.execute(
+            f"""SELECT const, title, imdb_rating FROM imdb_ratings
+            WHERE const IN ({", ".join("?" * len(recommendations))})""",
+            [recommendation.const for recommendation in recommendations],
+        )
+    )
+    conn.close()
+    print(
+        format_basic_output(
+            [
+                PredictedRating(*titles[const], predicted_rating)
+                for const, predicted_rating in recommendations
+                if const in titles
+            ]
+        )
+    )
+
+
+def search(args: argparse.Namespace) -> None:
+    """Prints the people and titles matching a query."""
+    from Code.moviestats.search import SearchIndex
+
+    index = SearchIndex(args.db)
+    try:
+        if args.autocomplete:
+            print("\n".join(index.autocomplete(args.query, args.kind, args.top)))
+            return
+        find = index.fuzzy_search if args.fuzzy else index.search
+        hits = find(args.query, args.kind, args.top)
+    except ValueError as e:
+        raise SystemExit(str(e)) from e
+    for hit in hits:
+        print(f"{hit.kind:<9} {hit.name} ({hit.score:.2f})")
+
+
+def serve(args: argparse.Namespace) -> None:
+    """Serves the statistics as a local JSON API until interrupted."""
+    from Code.moviestats.server import serve as serve_api
+
+    serve_api(args.db, args.host, args.port, args.workers)
+
+
+def changes(args: argparse.Namespace) -> None:
+    """Prints the changes a consumer has not processed yet and how far behind it is."""
+    from Code.moviestats.changes import ChangeFeed
+
+    feed = ChangeFeed(args.db)
+    if args.prune:
+        print(f"{feed.prune()} changes pruned")
+        return
+    pending = feed.pull(args.consumer, args.table, args.limit)
+    for change in pending:
+        print(f"{change.version:>8} {change.op:<6} {change.table_name} {change.key}")
+    lag = feed.lag(args.consumer, args.table)
+    print(f"{args.consumer}: {lag.versions} changes behind ({lag.seconds:.1f}s)")
+    if args.ack and pending:
+        feed.acknowledge(args.consumer, pending[-1].version)
+
+
+def replicate(args: argparse.Namespace) -> None:
+    """Copies a consistent snapshot of the database to a read replica."""
+    from Code.moviestats.replica import create_replica
+
+    elapsed = create_replica(args.db, args.replica)
+    print(f"Replica {args.replica} refreshed in {elapsed:.2f} [s]")
+
+
+def migrate(args: argparse.Namespace) -> None:
+    """Converts the database to the compact storage layout."""
+    from Code.moviestats.storage import migrate_to_compact
+
+    before, after = migrate_to_compact(args.db)
+    print(f"{args.db}: {before / 2**20:.1f} MiB -> {after / 2**20:.1f} MiB")
+
+
+def episodes_count(value: str) -> tuple:
+    """Parses a CONST=N episode count of the --episodes option."""
+    const, _, episodes = value.partition("=")
+    if not const or not episodes.isdigit() or int(episodes) < 1:
+        raise argparse.ArgumentTypeError(
+            f"expected CONST=N, e.g. tt0903747=62: {value}"
+        )
+    return const, int(episodes)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Builds the argument parser with one subparser per subcommand.
+
+    Returns
+    ----------
+    argparse.ArgumentParser
+        The parser of the moviestats command line
+    """
+    parser = argparse.ArgumentParser(
+        prog="moviestats", description="Statistics on your IMDb ratings."
+    )
+    parser.add_argument("--db", default=DEFAULT_DB, help="sqlite database file")
+    parser.add_argument("--user", default=None, help="user profile to analyse")
+    parser.add_argument(
+        "--memory-mb",
+        type=float,
+        default=None,
+        help="memory budget of ingestion and analytics, above which they stream from disk",
+    )
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="trace the peak memory of each operation with tracemalloc (slower)",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    ingest_parser = subparsers.add_parser("ingest", help="load the ratings export")
+    ingest_parser.add_argument("--csv", default=None, help="IMDb ratings export")
+    ingest_parser.add_argument(
+        "--backend", choices=["sqlite", "mysql"], default="sqlite"
+    )
+    ingest_parser.add_argument(
+        "--profile",
+        nargs="+",
+        metavar="USER=CSV",
+        help="load the ratings exports of several user profiles",
+    )
+    ingest_parser.add_argument(
+        "--engine",
+        choices=["c", "pyarrow"],
+        default="c",
+        help="CSV parser, pyarrow being faster on large exports",
+    )
+    ingest_parser.add_argument(
+        "--replica", default=None, help="keep a read replica fresh while ingesting"
+    )
+    ingest_parser.add_argument(
+        "--replica-interval", type=float, default=60.0, help="seconds between refreshes"
+    )
+    ingest_parser.set_defaults(func=ingest)
+
+    stats_parser = subparsers.add_parser("stats", help="print statistics")
+    stats_parser.add_argument(
+        "query",
+        nargs="?",
+        choices=[*STATS_QUERIES, "watch-time", "report"],
+        default="top",
+    )
+    stats_parser.add_argument("--top", type=int, default=10)
+    stats_parser.add_argument("--actor", default=None, help="list titles of an actor")
+    stats_parser.add_argument("--days", action="store_true", help="watch time in days")
+    stats_parser.add_argument(
+        "--by",
+        choices=["type", "genre", "year", "month"],
+        help="break the watch time down",
+    )
+    stats_parser.add_argument(
+        "--episodes",
+        nargs="+",
+        type=episodes_count,
+        metavar="CONST=N",
+        help="record the number of episodes of series, e.g. tt0903747=62",
+    )
+    stats_parser.add_argument(
+        "--approximate",
+        action="store_true",
+        help="answer frequent-actors/directors from the ingestion sketches",
+    )
+    stats_parser.add_argument(
+        "--timeout", type=float, default=None, help="report timeout in seconds"
+    )
+    stats_parser.add_argument(
+        "--snapshot", default=None, help="query an exported snapshot directory"
+    )
+    stats_parser.add_argument(
+        "--slow-ms",
+        type=float,
+        default=None,
+        help="log analyser queries slower than this with their plans, and full scans",
+    )
+    stats_parser.set_defaults(func=stats)
+
+    plot_parser = subparsers.add_parser("plot", help="draw a plot")
+    plot_parser.add_argument("kind", choices=PLOTS)
+    plot_parser.add_argument("--top", type=int, default=20)
+    plot_parser.set_defaults(func=plot)
+
+    recommend_parser = subparsers.add_parser(
+        "recommend", help="print the best rated genre combinations"
+    )
+    recommend_parser.add_argument("--top", type=int, default=10)
+    recommend_parser.set_defaults(func=recommend)
+
+    search_parser = subparsers.add_parser("search", help="search people and titles")
+    search_parser.add_argument("query")
+    search_parser.add_argument(
+        "--kind", nargs="+", choices=["actor", "director", "musician", "title"]
+    )
+    search_parser.add_argument("--top", type=int, default=10)
+    search_parser.add_argument("--fuzzy", action="store_true", help="typo tolerant")
+    search_parser.add_argument("--autocomplete", action="store_true")
+    search_parser.set_defaults(func=search)
+
+    graph_parser = subparsers.add_parser(
+        "graph", help="collaboration network statistics"
+    )
+    graph_parser.add_argument(
+        "query",
+        nargs="?",
+        choices=["separation", "central", "directors"],
+        default="central",
+    )
+    graph_parser.add_argument("people", nargs="*", help="two people for separation")
+    graph_parser.add_argument("--around", help="rank the collaborators of a person")
+    graph_parser.add_argument("--kind", choices=["actor", "director", "musician"])
+    graph_parser.add_argument("--top", type=int, default=10)
+    graph_parser.set_defaults(func=graph)
+
+    taste_parser = subparsers.add_parser(
+        "taste", help="model the gap between your ratings and IMDb ratings"
+    )
+    taste_parser.add_argument("query", choices=["effects", "predict"])
+    taste_parser.add_argument("--top", type=int, default=10)
+    taste_parser.add_argument("--alpha", type=float, default=1.0, help="ridge penalty")
+    taste_parser.set_defaults(func=taste)
+
+    profile_parser = subparsers.add_parser(
+        "profile", help="print the career profiles of actors, directors or musicians"
+    )
+    profile_parser.add_argument(
+        "names", nargs="*", help="people to profile, the best profiles if none"
+    )
+    profile_parser.add_argument(
+        "--kind", choices=["actor", "director", "musician"], default="actor"
+    )
+    profile_parser.add_argument(
+        "--filmography", action="store_true", help="list the rated titles too"
+    )
+    profile_parser.add_argument("--top", type=int, default=10)
+    profile_parser.add_argument(
+        "--min-titles", type=int, default=3, help="rated titles to rank a person"
+    )
+    profile_parser.set_defaults(func=profile)
+
+    cube_parser = subparsers.add_parser(
+        "cube", help="rating statistics by genres, decade, title type and rating band"
+    )
+    cube_parser.add_argument(
+        "--by",
+        nargs="*",
+        choices=["genres", "decade", "title_type", "band"],
+        default=[],
+        help="dimensions to break the statistics down by",
+    )
+    cube_parser.add_argument("--genres", nargs="+", help="genres the titles all have")
+    cube_parser.add_argument(
+        "--exact", action="store_true", help="titles with exactly these genres"
+    )
+    cube_parser.add_argument("--decades", type=int, nargs="+", help="e.g. 1990 2000")
+    cube_parser.add_argument("--types", nargs="+", help="e.g. movie tvSeries")
+    cube_parser.add_argument(
+        "--bands", nargs="+", choices=["1-4", "5-6", "7-8", "9-10"]
+    )
+    cube_parser.set_defaults(func=cube)
+
+    collab_parser = subparsers.add_parser(
+        "collab", help="recommend titles from the ratings of every user profile"
+    )
+    collab_parser.add_argument("action", choices=["train", "fold-in", "recommend"])
+    collab_parser.add_argument(
+        "--model", default=None, help="model directory, next to the database if unset"
+    )
+    collab_parser.add_argument("--rank", type=int, default=32, help="number of factors")
+    collab_parser.add_argument("--top", type=int, default=10)
+    collab_parser.set_defaults(func=collab)
+
+    export_parser = subparsers.add_parser(
+        "export", help="write the database to Arrow or Parquet files"
+    )
+    export_parser.add_argument("directory")
+    export_parser.add_argument(
+        "--format", choices=["arrow", "parquet"], default="arrow"
+    )
+    export_parser.add_argument("--batch-size", type=int, default=65_536)
+    export_parser.set_defaults(func=export)
+
+    import_parser = subparsers.add_parser(
+        "import", help="load an Arrow or Parquet snapshot into an empty database"
+    )
+    import_parser.add_argument("directory")
+    import_parser.add_argument(
+        "--backend", choices=["sqlite", "mysql"], default="sqlite"
+    )
+    import_parser.add_argument("--batch-size", type=int, default=65_536)
+    import_parser.set_defaults(func=import_)
+
+    serve_parser = subparsers.add_parser("serve", help="serve statistics over HTTP")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8000)
+    serve_parser.add_argument(
+        "--workers", type=int, default=4, help="threads running queries"
+    )
+    serve_parser.set_defaults(func=serve)
+
+    changes_parser = subparsers.add_parser(
+        "changes", help="read the change log of the database"
+    )
+    changes_parser.add_argument("--consumer", default="cli", help="consumer name")
+    changes_parser.add_argument("--table", nargs="+", help="only these tables")
+    changes_parser.add_argument("--limit", type=int, default=None)
+    changes_parser.add_argument(
+        "--ack", action="store_true", help="mark the printed changes as processed"
+    )
+    changes_parser.add_argument(
+        "--prune",
+        action="store_true",
+        help="delete the changes every consumer processed",
+    )
+    changes_parser.set_defaults(func=changes)
+
+    replicate_parser = subparsers.add_parser(
+        "replicate", help="refresh a read replica of the database"
+    )
+    replicate_parser.add_argument("replica")
+    replicate_parser.set_defaults(func=replicate)
+
+    migrate_parser = subparsers.add_parser(
+        "migrate", help="convert the database to the compact storage layout"
+    )
+    migrate_parser.set_defaults(func=migrate)
+
+    refresh_parser = subparsers.add_parser(
+        "refresh", help="update the aggregates after changes made outside ingestion"
+    )
+    refresh_parser.set_defaults(func=refresh)
+    return parser
+
+
+def main(argv: list = None) -> None:
+    """Runs the command line interface.
+
+    Parameters
+    ----------
+    argv : list
+        The arguments to parse. Defaults to sys.argv[1:]
+    """
+    args = build_parser().parse_args(argv)
+    args.memory_budget = None
+    if args.memory_mb is not None:
+        import logging
+
+        from Code.moviestats.memory import LOGGER, MemoryBudget
+
+        logging.basicConfig(format="%(levelname)s %(name)s: %(message)s")
+        LOGGER.setLevel(logging.INFO)
+        args.memory_budget = MemoryBudget(
+            int(args.memory_mb * 2**20), trace=args.trace_memory
+        )
+    args.func(args)
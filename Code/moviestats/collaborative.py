@@ -0,0 +1,339 @@
+"""This module recommends titles from the ratings of every user profile of the database.
+
+The ratings of all profiles form a sparse user x title matrix. Each row is centred on the mean
+rating of its user and the matrix is factorised with a truncated SVD (scipy's svds), so that
+missing ratings count as the mean of their user and the matrix is never densified. The factors
+of a user are the projection of their centred ratings on the title factors: the predicted rating
+of a title is the user mean plus the dot product of the user and title factors.
+
+A user that was not part of the training is folded in with that same projection, without
+refactorising the matrix. Models are saved as a directory of .npy files, which are memory-mapped
+when loaded, so that serving a recommendation only reads the title factors it needs.
+"""
+
+import json
+import os
+from pathlib import Path
+from sqlite3 import connect
+from typing import NamedTuple
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.linalg import svds
+
+from Code.moviestats.memory import batch_rows, read_arrays, tracked
+from Code.moviestats.ratings_analyser import POSITIVE_INT_ERR_MESSAGE
+
+
+RANK = 32
+BATCH_SIZE = 128  # users scored at once, each one needing a float32 per title
+MODEL_FILE = "model.json"
+TITLE_ARRAYS = ["consts", "title_factors"]
+USER_ARRAYS = ["user_factors", "user_means", "rated_indptr", "rated_indices"]
+
+
+class Recommendation(NamedTuple):
+    """A title unrated by a user, with the rating the model predicts."""
+
+    const: str
+    predicted_rating: float
+
+
+def rating_matrix(cursor, memory_budget=None) -> tuple:
+    """Reads the ratings of every user profile as a sparse matrix.
+
+    Parameters
+    ----------
+    cursor : Cursor
+        A cursor on a database with user profiles (see db_functions.populate_user_ratings)
+    memory_budget : MemoryBudget
+        The budget sizing the batches in which ratings are read, see memory.py
+
+    Returns
+    ----------
+    tuple
+        The user names, the sorted IMDb ids of the rated titles and the user x title matrix
+    """
+    names, consts, ratings = read_arrays(
+        cursor.execute(
+            """SELECT users.name, user_ratings.const, user_ratings.your_rating
+            FROM user_ratings JOIN users ON users.user_id = user_ratings.user_id
+            WHERE user_ratings.your_rating IS NOT NULL
+            ORDER BY user_ratings.user_id"""
+        ),
+        [str, str, np.float64],
+        batch_rows(memory_budget),
+    )
+    if not len(ratings):
+        raise ValueError("there are no user ratings to train on")
+    names, user_rows = np.unique(names, return_inverse=True)
+    consts, title_columns = np.unique(consts, return_inverse=True)
+    matrix = csr_matrix(
+        (ratings, (user_rows, title_columns)),
+        shape=(len(names), len(consts)),
+    )
+    return [str(name) for name in names], consts, matrix
+
+
+def read_user_ratings(cursor, name: str) -> tuple:
+    """Returns the IMDb ids and ratings of the titles rated by a user profile."""
+    rows = cursor.execute(
+        """SELECT user_ratings.const, user_ratings.your_rating
+        FROM user_ratings JOIN users ON users.user_id = user_ratings.user_id
+        WHERE users.name = ? AND user_ratings.your_rating IS NOT NULL""",
+        (name,),
+    ).fetchall()
+    if not rows:
+        raise ValueError(f"no ratings for user: {name}")
+    consts, ratings = zip(*rows)
+    return list(consts), list(ratings)
+
+
+def factorise(matrix: csr_matrix, rank: int = RANK) -> tuple:
+    """Factorises a user x title rating matrix with a truncated SVD of its centred rows.
+
+    Parameters
+    ----------
+    matrix : csr_matrix
+        The ratings, one row per user. Missing ratings are not stored
+    rank : int
+        The number of factors, at most one less than the number of users and of titles
+
+    Returns
+    ----------
+    tuple
+        The user factors, the title factors (one row per title) and the mean of each user
+    """
+    if rank < 1:
+        raise ValueError("rank must be a positive integer")
+    if min(matrix.shape) < 2:
+        raise ValueError("at least two users and two titles are needed")
+    rank = min(rank, min(matrix.shape) - 1)
+    counts = np.diff(matrix.indptr)
+    means = np.divide(
+        np.asarray(matrix.sum(axis=1)).ravel(),
+        counts,
+        out=np.zeros(matrix.shape[0]),
+        where=counts > 0,
+    )
+    centred = matrix.astype(np.float64, copy=True)
+    centred.data -= np.repeat(means, counts)
+    _, _, vt = svds(centred, k=rank, random_state=0)
+    title_factors = vt[::-1].T  # svds returns the singular values in increasing order
+    return centred @ title_factors, title_factors, means
+
+
+class CollaborativeModel:
+    """A truncated SVD of the ratings of several users, with their rated titles.
+
+    Parameters
+    ----------
+    consts : np.ndarray
+        The sorted IMDb ids of the titles known to the model
+    title_factors : np.ndarray
+        The factors of each title of consts
+    names : list
+        The user names
+    user_factors : np.ndarray
+        The factors of each user of names
+    user_means : np.ndarray
+        The mean rating of each user of names
+    rated_indptr, rated_indices : np.ndarray
+        The positions in consts of the titles rated by each user, in CSR form
+    """
+
+    def __init__(
+        self,
+        consts: np.ndarray,
+        title_factors: np.ndarray,
+        names: list,
+        user_factors: np.ndarray,
+        user_means: np.ndarray,
+        rated_indptr: np.ndarray,
+        rated_indices: np.ndarray,
+    ):
+        self.consts = consts
+        self.title_factors = title_factors
+        self.names = list(names)
+        self.user_factors = user_factors
+        self.user_means = user_means
+        self.rated_indptr = rated_indptr
+        self.rated_indices = rated_indices
+        self._users = {name: i for i, name in enumerate(self.names)}
+
+    @property
+    def rank(self) -> int:
+        return self.title_factors.shape[1]
+
+    @classmethod
+    def from_matrix(
+        cls, names: list, consts: np.ndarray, matrix: csr_matrix, rank: int = RANK
+    ) -> "CollaborativeModel":
+        """Trains a model on a user x title rating matrix, see rating_matrix."""
+        matrix = csr_matrix(matrix)
+        matrix.sort_indices()
+        user_factors, title_factors, means = factorise(matrix, rank)
+        return cls(
+            np.asarray(consts),
+            title_factors.astype(np.float32),
+            names,
+            user_factors.astype(np.float32),
+            means.astype(np.float32),
+            matrix.indptr.astype(np.int64),
+            matrix.indices.astype(np.int32),
+        )
+
+    @classmethod
+    def train(
+        cls, db_name: str, rank: int = RANK, memory_budget=None
+    ) -> "CollaborativeModel":
+        """Trains a model on the ratings of every user profile of a database."""
+        conn = connect(db_name)
+        try:
+            with tracked(memory_budget, "collaborative.rating_matrix", "chunked"):
+                names, consts, matrix = rating_matrix(conn.cursor(), memory_budget)
+        finally:
+            conn.close()
+        return cls.from_matrix(names, consts, matrix, rank)
+
+    def save(self, directory: str, users_only: bool = False) -> None:
+        """Saves the model as .npy files and a model.json listing the users.
+
+        Parameters
+        ----------
+        directory : str
+            The directory of the model, created if needed
+        users_only : bool
+            If True, only the user arrays are rewritten, e.g. after folding users in. The title
+            arrays, by far the largest, are kept as they are and may stay memory-mapped
+        """
+        path = Path(directory)
+        path.mkdir(parents=True, exist_ok=True)
+        # files are replaced rather than overwritten, as loaded models may be mapping them
+        for name in USER_ARRAYS if users_only else TITLE_ARRAYS + USER_ARRAYS:
+            with open(path / f"{name}.npy.tmp", "wb") as file:
+                np.save(file, np.asarray(getattr(self, name)))
+            os.replace(path / f"{name}.npy.tmp", path / f"{name}.npy")
+        (path / f"{MODEL_FILE}.tmp").write_text(
+            json.dumps({"rank": self.rank, "users": self.names}, indent=1)
+        )
+        os.replace(path / f"{MODEL_FILE}.tmp", path / MODEL_FILE)
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> "CollaborativeModel":
+        """Loads a saved model, memory-mapping its arrays unless mmap is False."""
+        path = Path(directory)
+        if not (path / MODEL_FILE).exists():
+            raise ValueError(f"{directory} is not a saved collaborative model")
+        names = json.loads((path / MODEL_FILE).read_text())["users"]
+        arrays = {
+            name: np.load(path / f"{name}.npy", mmap_mode="r" if mmap else None)
+            for name in TITLE_ARRAYS + USER_ARRAYS
+        }
+        return cls(names=names, **arrays)
+
+    def fold_in(self, name: str, consts: list, ratings: list) -> int:
+        """Adds a user, or replaces one, from their ratings without retraining the model.
+
+        Parameters
+        ----------
+        name : str
+            The user name
+        consts : list
+            The IMDb ids of the rated titles. Titles unknown to the model are ignored, and a
+            user rating none of the known titles is rejected
+        ratings : list
+            The rating of each title of consts
+
+        Returns
+        ----------
+        int
+            The number of ratings of the user on titles known to the model
+        """
+        consts = np.asarray(consts, dtype=str)
+        ratings = np.asarray(ratings, dtype=np.float64)
+        positions = np.searchsorted(self.consts, consts)
+        known = positions < len(self.consts)
+        known[known] = self.consts[positions[known]] == consts[known]
+        positions, first = np.unique(positions[known], return_index=True)
+        ratings = ratings[known][first]
+        if not len(ratings):
+            # the user would get the same prediction, the model mean, for every title
+            raise ValueError(
+                f"{name} has no rating of a title known to the model, train it again"
+            )
+        mean = ratings.mean()
+        factors = (ratings - mean) @ self.title_factors[positions]
+
+        indptr, indices = np.asarray(self.rated_indptr), np.asarray(self.rated_indices)
+        user_factors, means = np.asarray(self.user_factors), np.asarray(self.user_means)
+        if name in self._users:
+            i = self._users[name]
+            start, end = indptr[i], indptr[i + 1]
+            indices = np.concatenate([indices[:start], indices[end:]])
+            indptr = np.concatenate([indptr[: i + 1], indptr[i + 2 :] - (end - start)])
+            user_factors = np.delete(user_factors, i, axis=0)
+            means = np.delete(means, i)
+            self.names.pop(i)
+        self.rated_indices = np.concatenate([indices, positions.astype(np.int32)])
+        self.rated_indptr = np.append(indptr, indptr[-1] + len(positions))
+        self.user_factors = np.vstack([user_factors, factors.astype(np.float32)])
+        self.user_means = np.append(means, np.float32(mean))
+        self.names.append(name)
+        self._users = {user: i for i, user in enumerate(self.names)}
+        return len(positions)
+
+    def recommend(
+        self, names: list, top_n: int = 10, batch_size: int = BATCH_SIZE
+    ) -> list:
+        """Recommends the titles with the best predicted ratings that users have not rated.
+
+        Users are scored in batches: a single matrix product predicts the ratings of a batch
+        for every title, the rated titles are masked and the best ones are partitioned out.
+
+        Parameters
+        ----------
+        names : list
+            The users to recommend titles to
+        top_n : int
+            The number of titles per user
+        batch_size : int
+            The number of users scored at once
+
+        Returns
+        ----------
+        list[list[Recommendation]]
+            The recommendations of each user of names, best first
+        """
+        if top_n < 1 or batch_size < 1:
+            raise ValueError(POSITIVE_INT_ERR_MESSAGE)
+        unknown = [name for name in names if name not in self._users]
+        if unknown:
+            raise ValueError(f"unknown users: {', '.join(unknown)}")
+        users = np.array([self._users[name] for name in names], dtype=np.int64)
+        titles = self.title_factors.T
+        recommendations = []
+        for start in range(0, len(users), batch_size):
+            batch = users[start : start + batch_size]
+            scores = np.asarray(self.user_factors)[batch] @ titles
+            scores += np.asarray(self.user_means)[batch, None]
+            starts, ends = self.rated_indptr[batch], self.rated_indptr[batch + 1]
+            rows = np.repeat(np.arange(len(batch)), ends - starts)
+            columns = np.concatenate(
+                [self.rated_indices[s:e] for s, e in zip(starts, ends)] or [[]]
+            ).astype(np.int64)
+            scores[rows, columns] = -np.inf
+            n = min(top_n, scores.shape[1])
+            best = np.argpartition(-scores, n - 1, axis=1)[:, :n]
+            for row, columns in enumerate(best):
+                columns = columns[np.argsort(-scores[row, columns], kind="stable")]
+                recommendations.append(
+                    [
+                        Recommendation(
+                            str(self.consts[c]), float(np.clip(scores[row, c], 1, 10))
+                        )
+                        for c in columns
+                        if scores[row, c] > -np.inf
+                    ]
+                )
+        return recommendations
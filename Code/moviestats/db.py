@@ -1,10 +1,19 @@
+import re
 from pathlib import Path
-import pandas as pd
 from mysql.connector import connect, Error
+from Code.moviestats.helpers import date_to_epoch
 from Code.moviestats.imdb_fetcher import IMDbDataFetcher
+from Code.moviestats.ratings_reader import iter_ratings_chunks, ratings_records
 
 
 RATINGS_FILE = Path(__file__).parent.resolve() / "../data/imdb_ratings.csv"
+DATE_EPOCH_COLUMNS = ["date_rated", "release_date"]
+SEARCH_COLUMNS = {
+    "actor": ("actors", "name"),
+    "director": ("directors", "name"),
+    "musician": ("musicians", "name"),
+    "title": ("imdb_ratings", "title"),
+}
 
 
 class MySQLDatabaseHandler:
@@ -61,10 +70,37 @@ class MySQLDatabaseHandler:
                 runtime_mins INTEGER,
                 year INTEGER,
                 num_votes INTEGER,
-                release_date TEXT
+                release_date TEXT,
+                date_rated_epoch BIGINT,
+                release_date_epoch BIGINT,
+                INDEX idx_imdb_ratings_date_rated_epoch (date_rated_epoch),
+                INDEX idx_imdb_ratings_release_date_epoch (release_date_epoch)
             )"""
         )
 
+    def add_date_epoch_columns(self) -> None:
+        """Adds the indexed integer date columns to imdb_ratings if they are missing.
+
+        Tables created before these columns existed are migrated and backfilled, as
+        db_functions.add_date_epoch_columns does on sqlite. Timestamps are computed with
+        TIMESTAMPDIFF rather than UNIX_TIMESTAMP, which depends on the session time zone and
+        returns 0 before 1970.
+        """
+        columns = set(self.table_columns("imdb_ratings"))
+        for column in DATE_EPOCH_COLUMNS:
+            if f"{column}_epoch" not in columns:
+                self.cursor.execute(
+                    f"""ALTER TABLE imdb_ratings ADD COLUMN {column}_epoch BIGINT,
+                    ADD INDEX idx_imdb_ratings_{column}_epoch ({column}_epoch)"""
+                )
+            self.cursor.execute(
+                f"""UPDATE imdb_ratings SET {column}_epoch = TIMESTAMPDIFF(
+                    SECOND, '1970-01-01', STR_TO_DATE({column}, '%Y-%m-%d')
+                )
+                WHERE {column}_epoch IS NULL
+                AND {column} REGEXP '^[0-9]{{4}}-[0-9]{{2}}-[0-9]{{2}}$'"""
+            )
+
     def create_supplementary_table(self, table_name: str, columns: list) -> None:
         """Creates a table to store table_name elements.
 
@@ -110,6 +146,7 @@ class MySQLDatabaseHandler:
         """Creates the required tables to fit in the title_ratings database."""
         if self.connection:
             self.create_ratings_table()
+            self.add_date_epoch_columns()
             self.create_supplementary_table("actors", ["actor_id", "name"])
             self.create_movie_relations_table("movie_actors", ["actor_id", "actors"])
             self.create_supplementary_table("directors", ["director_id", "name"])
@@ -122,9 +159,90 @@ class MySQLDatabaseHandler:
             self.create_movie_relations_table(
                 "movie_musicians", ["musician_id", "musicians"]
             )
+            self.create_search_indexes()
             self.connection.commit()
             print("Tables created successfully")
 
+    def create_search_indexes(self) -> None:
+        """Adds FULLTEXT indexes on the names of people and on the titles, needed by search.
+
+        MySQL keeps these indexes up to date by itself once created, so create_db_tables adds
+        them along with the tables.
+        """
+        for table_name, column_name in SEARCH_COLUMNS.values():
+            self.cursor.execute(
+                """SELECT COUNT(*) FROM information_schema.statistics
+                WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s""",
+                (table_name, f"ft_{table_name}_{column_name}"),
+            )
+            if not self.cursor.fetchone()[0]:
+                self.cursor.execute(
+                    f"""ALTER TABLE {table_name}
+                    ADD FULLTEXT INDEX ft_{table_name}_{column_name} ({column_name})"""
+                )
+
+    def search(self, query: str, kind: str = "actor", limit: int = 10) -> list:
+        """Finds the entries whose name contains words starting with every word of the query.
+
+        Unlike search.SearchIndex on sqlite, there is no autocomplete nor typo-tolerant search:
+        every word of the query must be spelt right.
+
+        Parameters
+        ----------
+        query : str
+            The words to look for, in any order and case
+        kind : str
+            The kind of entries to search, one of actor, director, musician or title
+        limit : int
+            The maximum number of hits to return
+
+        Returns
+        ----------
+        list
+            2-tuples of name and relevance score, best first
+        """
+        table_name, column_name = SEARCH_COLUMNS[kind]
+        boolean_query = " ".join(f"+{word}*" for word in re.findall(r"\w+", query))
+        self.cursor.execute(
+            f"""SELECT {column_name}, MATCH({column_name}) AGAINST (%s IN BOOLEAN MODE) AS score
+            FROM {table_name} WHERE MATCH({column_name}) AGAINST (%s IN BOOLEAN MODE)
+            ORDER BY score DESC LIMIT %s""",
+            (boolean_query, boolean_query, limit),
+        )
+        return self.cursor.fetchall()
+
+    def table_columns(self, table_name: str) -> list:
+        """Returns the column names of a table, or an empty list if it does not exist."""
+        self.cursor.execute(
+            """SELECT column_name FROM information_schema.columns
+            WHERE table_schema = DATABASE() AND table_name = %s
+            ORDER BY ordinal_position""",
+            (table_name,),
+        )
+        return [row[0] for row in self.cursor.fetchall()]
+
+    def bulk_insert(self, table_name: str, columns: list, rows: list) -> None:
+        """Inserts many rows at once.
+
+        The connector rewrites executemany INSERTs into multi-row statements, so this is much
+        faster than inserting the rows one by one.
+
+        Parameters
+        ----------
+        table_name : str
+            The table to insert into
+        columns : list
+            The names of the columns given by the rows
+        rows : list
+            The tuples of values to insert
+        """
+        self.cursor.executemany(
+            f"""INSERT INTO {table_name} ({', '.join(f'`{c}`' for c in columns)})
+            VALUES ({','.join(['%s'] * len(columns))})""",
+            rows,
+        )
+        self.connection.commit()
+
     def db_adder_helper(
         self, movie_id: int, table_name: str, column_name: str, value: str
     ) -> None:
@@ -161,28 +279,30 @@ class MySQLDatabaseHandler:
             (movie_id, entry_id),
         )
 
-    def add_genres_to_database(self, row: pd.Series, movie_id: int) -> None:
+    def add_genres_to_database(self, row: dict, movie_id: int) -> None:
         """Add genres to the local sqlite database.
 
         Parameters
         ----------
-        row : pd.Series
-            The target row to fetch the genres from
+        row : dict
+            The target row to fetch the genres from, see ratings_reader.ratings_records
         movie_id : int
             The id of the movie to link the genres to
         """
+        if row["Genres"] is None:
+            return
         genres = row["Genres"].split(",")
         for genre in genres:
             self.db_adder_helper(movie_id, "genres", "genre_id", genre.strip())
 
     def add_cast_and_crew_to_database(
-        self, row: pd.Series, fetcher: IMDbDataFetcher, movie_id: int
+        self, row: dict, fetcher: IMDbDataFetcher, movie_id: int
     ) -> None:
         """Adds actors/directors/musicians to the titles database.
 
         Parameters
         ----------
-        row : pd.Series
+        row : dict
             The target row to fetch the cast and crew from
         fetcher : IMDbDataFetcher
             The IMDbDataFetcher object to use
@@ -268,15 +388,20 @@ class MySQLDatabaseHandler:
         """Populates the MySQL database with IMDb ratings.
 
         This function will search for ratings that are not already in the database and add them.
+        The export is validated before the first title is added, see ratings_reader.
         """
         fetcher = IMDbDataFetcher()
-        ratings = pd.read_csv(RATINGS_FILE)
 
         count_query = """SELECT COUNT(*) FROM imdb_ratings"""
         self.cursor.execute(count_query)
         num_db_entries = self.cursor.fetchone()[0]
 
-        for _, row in ratings.iterrows():
+        rows = (
+            row
+            for chunk in iter_ratings_chunks(RATINGS_FILE)
+            for row in ratings_records(chunk)
+        )
+        for row in rows:
             self.cursor.execute(
                 """SELECT const FROM imdb_ratings WHERE const = %s""", (row["Const"],)
             )
@@ -293,13 +418,15 @@ class MySQLDatabaseHandler:
                     row["Year"],
                     row["Num Votes"],
                     row["Release Date"],
+                    date_to_epoch(row["Date Rated"]),
+                    date_to_epoch(row["Release Date"]),
                 )
-                values = tuple(None if pd.isna(v) else v for v in values)
                 self.cursor.execute(
                     """INSERT INTO imdb_ratings (
                         const, your_rating, date_rated, title, url, title_type,
-                        imdb_rating, runtime_mins, year, num_votes, release_date
-                    ) VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)""",
+                        imdb_rating, runtime_mins, year, num_votes, release_date,
+                        date_rated_epoch, release_date_epoch
+                    ) VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)""",
                     (values),
                 )
                 movie_id = self.cursor.lastrowid
@@ -5,15 +5,78 @@ from pathlib import Path
 from sqlite3 import connect
 from os import path
 import pandas as pd
+from Code.moviestats.changes import create_change_log
+from Code.moviestats.helpers import date_to_epoch
 from Code.moviestats.imdb_fetcher import IMDbDataFetcher
+from Code.moviestats.memory import tracked
+from Code.moviestats.ratings_reader import (
+    BYTES_PER_ROW,
+    CHUNK_SIZE,
+    format_errors,
+    iter_ratings_chunks,
+    ratings_records,
+    read_ratings,
+    validate_ratings,
+)
+from Code.moviestats.sketches import RatingsSketches
+from Code.moviestats.storage import (
+    create_compact_indexes,
+    create_compact_ratings_table,
+    create_dictionary_tables,
+    create_link_table,
+    insert_titles,
+    update_genre_masks,
+)
+from Code.moviestats.watch_time import (
+    DEFAULT_EPISODES,
+    cache_series_episodes,
+    create_watch_time_tables,
+)
 
 
 DB_NAME = "imdb_ratings.db"
 RATINGS_FILE = Path(__file__).resolve().parent / "data/imdb_ratings.csv"
+DATE_EPOCH_COLUMNS = ["date_rated", "release_date"]
+# columns of imdb_ratings filled from a row of the ratings export
+TITLE_COLUMNS = [
+    "const",
+    "your_rating",
+    "date_rated",
+    "title",
+    "url",
+    "title_type",
+    "imdb_rating",
+    "runtime_mins",
+    "year",
+    "num_votes",
+    "release_date",
+    "date_rated_epoch",
+    "release_date_epoch",
+]
+# titles added per transaction, so that readers see ingestion progress
+COMMIT_EVERY = 50
+# rough size of a row of an export once parsed, typed and converted to a dict of values
+RECORD_BYTES = 1000
+
+
+def create_ratings_table(cursor: connect, compact: bool = True) -> None:
+    """Create a table to store IMDb ratings.
 
-
-def create_ratings_table(cursor: connect) -> None:
-    """Create a table to store IMDb ratings."""
+    Parameters
+    ----------
+    cursor : connect
+        The SQL cursor to use
+    compact : bool
+        If True, a new table gets the compact layout of storage.py. An existing table is kept
+    """
+    exists = cursor.execute(
+        """SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'imdb_ratings'"""
+    ).fetchone()
+    if compact and not exists:
+        create_dictionary_tables(cursor)
+        create_compact_ratings_table(cursor)
+        create_compact_indexes(cursor)
+        return
     cursor.execute(
         """CREATE TABLE IF NOT EXISTS imdb_ratings(
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -30,9 +93,71 @@ def create_ratings_table(cursor: connect) -> None:
             num_votes INTEGER,
             release_date TEXT,
             directors TEXT,
-            cast TEXT
+            cast TEXT,
+            date_rated_epoch INTEGER,
+            release_date_epoch INTEGER
+        )"""
+    )
+    add_date_epoch_columns(cursor)
+
+
+def add_date_epoch_columns(cursor: connect) -> None:
+    """Add the indexed integer date columns to the imdb_ratings table if they are missing.
+
+    The dates of the IMDb export are stored as TEXT. Their Unix timestamps are stored alongside
+    so that time-based queries can use an index instead of parsing strings. Databases created
+    before these columns existed are migrated and backfilled.
+
+    Parameters
+    ----------
+    cursor : connect
+        The SQL cursor to use
+    """
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(imdb_ratings)")}
+    for column in DATE_EPOCH_COLUMNS:
+        if f"{column}_epoch" not in columns:
+            cursor.execute(
+                f"""ALTER TABLE imdb_ratings ADD COLUMN {column}_epoch INTEGER"""
+            )
+        cursor.execute(
+            f"""UPDATE imdb_ratings
+            SET {column}_epoch = CAST(strftime('%s', {column}) AS INTEGER)
+            WHERE {column}_epoch IS NULL AND date({column}) IS NOT NULL"""
+        )
+        cursor.execute(
+            f"""CREATE INDEX IF NOT EXISTS idx_imdb_ratings_{column}_epoch
+            ON imdb_ratings({column}_epoch)"""
+        )
+
+
+def create_user_tables(cursor: connect) -> None:
+    """Create the tables storing the ratings of several user profiles.
+
+    The titles, their credits and their IMDb data are shared by all profiles in imdb_ratings.
+    Only the personal rating and rating date of each profile are stored in user_ratings, whose
+    rows are clustered by user so that the ratings of one profile are read contiguously.
+    """
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS users(
+            user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE
         )"""
     )
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS user_ratings(
+            user_id INTEGER NOT NULL,
+            const TEXT NOT NULL,
+            your_rating INTEGER,
+            date_rated TEXT,
+            date_rated_epoch INTEGER,
+            PRIMARY KEY(user_id, const),
+            FOREIGN KEY(user_id) REFERENCES users(user_id)
+        ) WITHOUT ROWID"""
+    )
+    cursor.execute(
+        """CREATE INDEX IF NOT EXISTS idx_user_ratings_date_rated_epoch
+        ON user_ratings(user_id, date_rated_epoch)"""
+    )
 
 
 def create_supplementary_table(cursor: connect, table_name: str, columns: list) -> None:
@@ -58,7 +183,7 @@ def create_supplementary_table(cursor: connect, table_name: str, columns: list)
 
 
 def create_movie_relations_table(
-    cursor: connect, table_name: str, columns: list
+    cursor: connect, table_name: str, columns: list, compact: bool = True
 ) -> None:
     """Create a table to store the relationships between movies and other elements.
 
@@ -70,9 +195,14 @@ def create_movie_relations_table(
         The name of the table to create
     columns : list
         The columns to create in the table (must be of length 2)
+    compact : bool
+        If True, the table is clustered on its links, see storage.create_link_table
     """
     if len(columns) != 2:
         raise ValueError("columns must be of length 2")
+    if compact:
+        create_link_table(cursor, table_name, columns)
+        return
     cursor.execute(
         f"""CREATE TABLE IF NOT EXISTS {table_name}(
             movie_id INTEGER,
@@ -84,31 +214,44 @@ def create_movie_relations_table(
     )
 
 
-def create_local_database(db_name: str = DB_NAME) -> None:
+def create_local_database(db_name: str = DB_NAME, compact: bool = True) -> None:
     """Create a local sqlite database to store IMDb ratings.
 
     Parameters
     ----------
     db_name : str
         The name of the database to create
+    compact : bool
+        If True, new tables get the compact layout of storage.py. Existing tables are kept,
+        see storage.migrate_to_compact to convert them
     """
     if path.exists(db_name):
         print("Database already exists")
     conn = connect(db_name)
     cursor = conn.cursor()
+    # readers see the last committed state instead of waiting for a writer, see replica.py
+    cursor.execute("PRAGMA journal_mode=WAL")
 
-    create_ratings_table(cursor)
+    create_ratings_table(cursor, compact)
+    create_user_tables(cursor)
 
     create_supplementary_table(cursor, "actors", ["actor_id", "name"])
-    create_movie_relations_table(cursor, "movie_actors", ["actor_id", "actors"])
+    create_movie_relations_table(
+        cursor, "movie_actors", ["actor_id", "actors"], compact
+    )
 
     create_supplementary_table(cursor, "directors", ["director_id", "name"])
     create_movie_relations_table(
-        cursor, "movie_directors", ["director_id", "directors"]
+        cursor, "movie_directors", ["director_id", "directors"], compact
     )
 
     create_supplementary_table(cursor, "genres", ["genre_id", "name"])
-    create_movie_relations_table(cursor, "movie_genres", ["genre_id", "genres"])
+    create_movie_relations_table(
+        cursor, "movie_genres", ["genre_id", "genres"], compact
+    )
+
+    create_watch_time_tables(cursor)
+    create_change_log(cursor)
 
     conn.commit()
     conn.close()
@@ -116,8 +259,8 @@ def create_local_database(db_name: str = DB_NAME) -> None:
 
 
 def add_actors_to_database(
-    row: pd.Series, cursor: connect, fetcher: IMDbDataFetcher, movie_id: int
-) -> None:
+    row: dict, cursor: connect, fetcher: IMDbDataFetcher, movie_id: int
+) -> list:
     """Add actors to the local sqlite database.
 
     Parameters
@@ -128,6 +271,11 @@ def add_actors_to_database(
         The IMDbDataFetcher object to use
     movie_id : int
         The id of the movie to link the actors to
+
+    Returns
+    ----------
+    list
+        The names of the added actors
     """
     actors = fetcher.get_full_cast_and_crew(row["Const"])
     for actor in actors:
@@ -143,18 +291,21 @@ def add_actors_to_database(
             ) VALUES (?,?)""",
             (movie_id, actor_id),
         )  # links the movie to the actors
+    return actors
 
 
-def add_genres_to_database(row: pd.Series, cursor: connect, movie_id: int) -> None:
+def add_genres_to_database(row: dict, cursor: connect, movie_id: int) -> None:
     """Add genres to the local sqlite database.
 
     Parameters
     ----------
     cursor : connect
         The SQL cursor to use
-    row : pd.Series
-        The row of the ratings dataframe to use
+    row : dict
+        The row of the ratings export to use, see ratings_reader.ratings_records
     """
+    if row["Genres"] is None:
+        return
     genres = row["Genres"].strip().split(",")  # strip() fixes whitespace issue
     for genre in genres:
         cursor.execute(
@@ -171,20 +322,25 @@ def add_genres_to_database(row: pd.Series, cursor: connect, movie_id: int) -> No
         )  # links the movie to the genres
 
 
-def add_directors_to_database(row: pd.Series, cursor: connect, movie_id: int) -> None:
+def add_directors_to_database(row: dict, cursor: connect, movie_id: int) -> list:
     """Add directors to the local sqlite database.
 
     Parameters
     ----------
-    row : pd.Series
-        The row containing movie information.
+    row : dict
+        The row of the ratings export, see ratings_reader.ratings_records.
     cursor : connect
         The SQL cursor to use.
     movie_id : int
         The id of the movie to link the directors to.
+
+    Returns
+    ----------
+    list
+        The names of the added directors.
     """
-    if pd.isna(row["Directors"]):
-        return
+    if row["Directors"] is None:
+        return []
     directors = row["Directors"].split(",")
     for director in directors:
         cursor.execute(
@@ -199,15 +355,95 @@ def add_directors_to_database(row: pd.Series, cursor: connect, movie_id: int) ->
             ) VALUES (?,?)""",
             (movie_id, director_id),
         )  # links the movie to the directors
+    return directors
+
 
+def add_title_to_database(
+    row: dict, cursor: connect, fetcher: IMDbDataFetcher, personal: bool = True
+) -> tuple:
+    """Add a title and its genres, directors and cast to the local sqlite database.
 
-def populate_database(csv_ratings: str = RATINGS_FILE) -> None:
+    The episode runtime of a series is also cached, see watch_time.cache_series_episodes.
+
+    Parameters
+    ----------
+    row : dict
+        The row of the ratings export to use, see ratings_reader.ratings_records
+    cursor : connect
+        The SQL cursor to use
+    fetcher : IMDbDataFetcher
+        The IMDbDataFetcher object to use
+    personal : bool
+        If False, the personal rating and rating date are left empty since they belong to a
+        user profile (see populate_user_ratings)
+
+    Returns
+    ----------
+    tuple
+        The id of the new title and the names of its actors and directors
+    """
+    movie_id = insert_titles(
+        cursor,
+        TITLE_COLUMNS,
+        [
+            (
+                row["Const"],
+                row["Your Rating"] if personal else None,
+                row["Date Rated"] if personal else None,
+                row["Title"],
+                row["URL"],
+                row["Title Type"],
+                row["IMDb Rating"],
+                row["Runtime (mins)"],
+                row["Year"],
+                row["Num Votes"],
+                row["Release Date"],
+                date_to_epoch(row["Date Rated"]) if personal else None,
+                date_to_epoch(row["Release Date"]),
+            ),
+        ],
+    )
+    actors = add_actors_to_database(row, cursor, fetcher, movie_id)
+    add_genres_to_database(row, cursor, movie_id)
+    update_genre_masks(cursor, movie_id)
+    directors = add_directors_to_database(row, cursor, movie_id)
+    if row["Title Type"] in DEFAULT_EPISODES:
+        cache_series_episodes(
+            row["Const"],
+            row["Runtime (mins)"],
+            cursor,
+            fetcher,
+        )
+    return movie_id, actors, directors
+
+
+def populate_database(
+    csv_ratings: str = RATINGS_FILE,
+    db_name: str = DB_NAME,
+    fetcher: IMDbDataFetcher = None,
+    sketches: RatingsSketches = None,
+    commit_every: int = COMMIT_EVERY,
+    engine: str = "c",
+    memory_budget=None,
+) -> None:
     """Populate the local sqlite database with IMDb ratings.
 
     Parameters:
     ----------
     csv_ratings : str, optional
         The filepath of the CSV file containing IMDb ratings. Default is RATINGS_FILE.
+    db_name : str, optional
+        The name of the database to populate. Default is DB_NAME.
+    fetcher : IMDbDataFetcher, optional
+        The object used to fetch cast and crew data. A new IMDbDataFetcher is created if None.
+    sketches : RatingsSketches, optional
+        The sketches to update with the new titles. They are saved with the new entries.
+    commit_every : int, optional
+        The number of titles added per transaction. Default is COMMIT_EVERY.
+    engine : str, optional
+        The CSV parser, c or pyarrow, see ratings_reader. Default is c.
+    memory_budget : MemoryBudget, optional
+        The budget sizing the chunks in which the export is streamed, see memory.py.
 
     Returns:
     -------
@@ -216,43 +452,46 @@ def populate_database(csv_ratings: str = RATINGS_FILE) -> None:
     Notes:
     ------
     This function will search for ratings that are not already in the database and add them.
+    Titles are committed in batches, so that a long enrichment never holds back the readers
+    of the database: they see the titles added up to the last batch. The export is validated
+    before the first title is added, and streamed in chunks of ratings_reader.CHUNK_SIZE rows,
+    or fewer to fit the memory budget.
     """
-    conn = connect(DB_NAME)
+    if commit_every < 1:
+        raise ValueError("commit_every must be a positive integer")
+    conn = connect(db_name)
     cursor = conn.cursor()
-    fetcher = IMDbDataFetcher()
-    ratings = pd.read_csv(csv_ratings)
+    fetcher = fetcher or IMDbDataFetcher()
     num_db_entries = cursor.execute("""SELECT COUNT(*) FROM imdb_ratings""").fetchone()[
         0
     ]
-    for _, row in ratings.iterrows():
-        cursor.execute(
-            """SELECT const FROM imdb_ratings WHERE const = ?""", (row["Const"],)
-        )
-        data = cursor.fetchone()
-        if not data:
+    added = 0
+    chunksize = (
+        CHUNK_SIZE if memory_budget is None else memory_budget.batch_rows(RECORD_BYTES)
+    )
+    for chunk in iter_ratings_chunks(csv_ratings, chunksize, engine):
+        for row in ratings_records(chunk):
             cursor.execute(
-                """INSERT INTO imdb_ratings (
-                    const, your_rating, date_rated, title, url, title_type,
-                    imdb_rating, runtime_mins, year, num_votes, release_date
-                ) VALUES (?,?,?,?,?,?,?,?,?,?,?)""",
-                (
-                    row["Const"],
-                    row["Your Rating"],
-                    row["Date Rated"],
-                    row["Title"],
-                    row["URL"],
-                    row["Title Type"],
-                    row["IMDb Rating"],
-                    row["Runtime (mins)"],
-                    row["Year"],
-                    row["Num Votes"],
-                    row["Release Date"],
-                ),
+                """SELECT const FROM imdb_ratings WHERE const = ?""", (row["Const"],)
             )
-            movie_id = cursor.lastrowid
-            add_actors_to_database(row, cursor, fetcher, movie_id)
-            add_genres_to_database(row, cursor, movie_id)
-            add_directors_to_database(row, cursor, movie_id)
+            data = cursor.fetchone()
+            if data:
+                continue
+            _, actors, directors = add_title_to_database(row, cursor, fetcher)
+            if sketches is not None:
+                sketches.add_title(
+                    actors,
+                    directors,
+                    None if row["Your Rating"] is None else float(row["Your Rating"]),
+                    row["IMDb Rating"],
+                )
+            added += 1
+            if added % commit_every == 0:
+                if sketches is not None:
+                    sketches.save(cursor)
+                conn.commit()
+    if sketches is not None:
+        sketches.save(cursor)
     conn.commit()
     if (
         cursor.execute("""SELECT COUNT(*) FROM imdb_ratings""").fetchone()[0]
@@ -264,6 +503,225 @@ def populate_database(csv_ratings: str = RATINGS_FILE) -> None:
     conn.close()
 
 
+def read_ratings_csv(csv_ratings: str, engine: str = "c") -> pd.DataFrame:
+    """Reads an IMDb ratings export. Module-level so that it can run in worker processes."""
+    return read_ratings(csv_ratings, engine)
+
+
+def populate_user_ratings(
+    csv_files: dict,
+    db_name: str = DB_NAME,
+    fetcher: IMDbDataFetcher = None,
+    max_workers: int = 4,
+    engine: str = "c",
+    memory_budget=None,
+) -> dict:
+    """Populate the local sqlite database with the IMDb ratings of several user profiles.
+
+    The CSV files are parsed concurrently in worker processes, then written by a single
+    connection. Titles that are not in the database yet are added once with their credits, so
+    a title rated by several users is only fetched from IMDb once.
+
+    If the parsed exports would not fit the memory budget, every export is validated first and
+    then streamed in chunks, one user after the other, and titles are looked up in the database
+    rather than in a set of every IMDb id. The database ends up the same.
+
+    Each user has their own sketches (see sketches.py), saved under their name and updated with
+    the titles they rate for the first time. A title rated again keeps its first rating in the
+    sketches, which cannot forget a value.
+
+    Parameters
+    ----------
+    csv_files : dict
+        Maps each user name to the filepath of their IMDb ratings export
+    db_name : str, optional
+        The name of the database to populate. Default is DB_NAME.
+    fetcher : IMDbDataFetcher, optional
+        The object used to fetch cast and crew data. A new IMDbDataFetcher is created if None.
+    max_workers : int, optional
+        The number of processes parsing the CSV files. Default is 4.
+    engine : str, optional
+        The CSV parser, c or pyarrow, see ratings_reader. Default is c.
+    memory_budget : MemoryBudget, optional
+        The budget of the parsed exports, see memory.py. Unlimited if None.
+
+    Returns
+    ----------
+    dict
+        Maps each user name to the number of their ratings that were added or updated
+    """
+    if max_workers < 1:
+        raise ValueError("max_workers must be a positive integer")
+    # the size of an export tells roughly how many rows it has
+    num_rows = sum(path.getsize(csv) for csv in csv_files.values()) // BYTES_PER_ROW
+    in_memory = memory_budget is None or memory_budget.fits(num_rows, RECORD_BYTES)
+    strategy = "memory" if in_memory else "external"
+    with tracked(memory_budget, "populate_user_ratings", strategy):
+        if in_memory:
+            return _populate_user_ratings_in_memory(
+                csv_files, db_name, fetcher, max_workers, engine
+            )
+        return _populate_user_ratings_streamed(
+            csv_files, db_name, fetcher, engine, memory_budget.batch_rows(RECORD_BYTES)
+        )
+
+
+def _title_credits(cursor, const: str) -> tuple:
+    """Returns the actors and directors of a stored title, and its IMDb rating."""
+    movie_id, imdb_rating = cursor.execute(
+        """SELECT id, imdb_rating FROM imdb_ratings WHERE const = ?""", (const,)
+    ).fetchone()
+    people = [
+        [
+            row[0]
+            for row in cursor.execute(
+                f"""SELECT name FROM movie_{table_name}
+                JOIN {table_name} USING ({column_id}) WHERE movie_id = ?""",
+                (movie_id,),
+            )
+        ]
+        for table_name, column_id in (
+            ("actors", "actor_id"),
+            ("directors", "director_id"),
+        )
+    ]
+    return *people, imdb_rating
+
+
+def _store_user_ratings(
+    cursor, name: str, rows: list, sketches: RatingsSketches
+) -> None:
+    """Adds or updates the ratings of a user from rows of their export.
+
+    The titles that the user had not rated yet are added to their sketches.
+    """
+    cursor.execute("""INSERT OR IGNORE INTO users (name) VALUES (?)""", (name,))
+    user_id = cursor.execute(
+        """SELECT user_id FROM users WHERE name = ?""", (name,)
+    ).fetchone()[0]
+    new_rows = [
+        row
+        for row in rows
+        if not cursor.execute(
+            """SELECT 1 FROM user_ratings WHERE user_id = ? AND const = ?""",
+            (user_id, row["Const"]),
+        ).fetchone()
+    ]
+    cursor.executemany(
+        """INSERT INTO user_ratings (
+            user_id, const, your_rating, date_rated, date_rated_epoch
+        ) VALUES (?,?,?,?,?)
+        ON CONFLICT(user_id, const) DO UPDATE SET
+            your_rating = excluded.your_rating,
+            date_rated = excluded.date_rated,
+            date_rated_epoch = excluded.date_rated_epoch""",
+        [
+            (
+                user_id,
+                row["Const"],
+                row["Your Rating"],
+                row["Date Rated"],
+                date_to_epoch(row["Date Rated"]),
+            )
+            for row in rows
+        ],
+    )
+    for row in new_rows:
+        actors, directors, imdb_rating = _title_credits(cursor, row["Const"])
+        sketches.add_title(
+            actors,
+            directors,
+            None if row["Your Rating"] is None else float(row["Your Rating"]),
+            imdb_rating,
+        )
+
+
+def _populate_user_ratings_in_memory(
+    csv_files: dict,
+    db_name: str,
+    fetcher: IMDbDataFetcher,
+    max_workers: int,
+    engine: str,
+) -> dict:
+    """Parses every export at once in worker processes, see populate_user_ratings."""
+    from concurrent.futures import ProcessPoolExecutor
+
+    names = list(csv_files)
+    with ProcessPoolExecutor(max_workers=min(max_workers, len(names) or 1)) as pool:
+        frames = dict(
+            zip(
+                names,
+                pool.map(read_ratings_csv, csv_files.values(), [engine] * len(names)),
+            )
+        )
+
+    conn = connect(db_name)
+    cursor = conn.cursor()
+    create_user_tables(cursor)
+    fetcher = fetcher or IMDbDataFetcher()
+    known_titles = {
+        row[0] for row in cursor.execute("""SELECT const FROM imdb_ratings""")
+    }
+    updated = {}
+    for name, ratings in frames.items():
+        sketches = RatingsSketches.load(cursor, name)
+        rows = ratings_records(ratings)
+        for row in rows:
+            if row["Const"] not in known_titles:
+                add_title_to_database(row, cursor, fetcher, personal=False)
+                known_titles.add(row["Const"])
+                if len(known_titles) % COMMIT_EVERY == 0:
+                    conn.commit()
+        _store_user_ratings(cursor, name, rows, sketches)
+        updated[name] = len(ratings)
+        sketches.save(cursor)
+        conn.commit()
+    conn.close()
+    return updated
+
+
+def _populate_user_ratings_streamed(
+    csv_files: dict,
+    db_name: str,
+    fetcher: IMDbDataFetcher,
+    engine: str,
+    chunksize: int,
+) -> dict:
+    """Streams the exports one after the other in chunks, see populate_user_ratings."""
+    # as when parsing every export at once, nothing is written if one of them is invalid
+    for csv in csv_files.values():
+        errors = validate_ratings(csv, chunksize, engine)
+        if errors:
+            raise ValueError(format_errors(csv, errors))
+
+    conn = connect(db_name)
+    cursor = conn.cursor()
+    create_user_tables(cursor)
+    fetcher = fetcher or IMDbDataFetcher()
+    updated, added = {}, 0
+    for name, csv in csv_files.items():
+        updated[name] = 0
+        sketches = RatingsSketches.load(cursor, name)
+        for chunk in iter_ratings_chunks(csv, chunksize, engine, validate=False):
+            rows = ratings_records(chunk)
+            for row in rows:
+                if not cursor.execute(
+                    """SELECT 1 FROM imdb_ratings WHERE const = ?""", (row["Const"],)
+                ).fetchone():
+                    add_title_to_database(row, cursor, fetcher, personal=False)
+                    added += 1
+                    if added % COMMIT_EVERY == 0:
+                        # the committed ratings of the user are those of the sketches
+                        sketches.save(cursor)
+                        conn.commit()
+            _store_user_ratings(cursor, name, rows, sketches)
+            updated[name] += len(rows)
+        sketches.save(cursor)
+        conn.commit()
+    conn.close()
+    return updated
+
+
 def select(params: list[str], table: str = "imdb_ratings") -> str:
     """Creates a basic SQL query structure
 
@@ -0,0 +1,270 @@
+"""This module inspects the query plans and latencies of the analyser queries.
+
+Diagnostics are opt-in: a RatingsAnalyser created with a QueryDiagnostics runs each of its
+queries through it. The plan of every distinct query is captured once with EXPLAIN QUERY PLAN
+(sqlite) or EXPLAIN (MySQL), each execution is timed up to its last row, and a query slower
+than the threshold is logged with its plan and parameters. Plans that scan a whole watched
+table (movie_actors and actors by default, the largest ones) are flagged, since every analyser
+query on people should reach them through an index.
+
+Plans can also be snapshotted per analyser method and compared with a saved snapshot, so that a
+schema change that silently stops using an index is caught (see benchmarks/query_plans.py).
+"""
+
+import logging
+import re
+import threading
+from collections import deque
+from time import perf_counter
+from typing import NamedTuple
+
+
+SLOW_QUERY_SECONDS = 0.1
+WATCHED_TABLES = ("movie_actors", "actors")
+HISTORY_SIZE = 1000  # number of profiled executions kept
+LOGGER = logging.getLogger("moviestats.diagnostics")
+# silent unless the application configures logging
+LOGGER.addHandler(logging.NullHandler())
+SQL_KEYWORDS = {"ON", "USING", "JOIN", "WHERE", "GROUP", "ORDER", "LIMIT", "LEFT"}
+SQL_KEYWORDS |= {"INNER", "CROSS", "NATURAL", "UNION", "HAVING", "AS"}
+
+
+class QueryProfile(NamedTuple):
+    """One execution of a query, with its plan and the watched tables it scans."""
+
+    query: str
+    params: tuple
+    seconds: float
+    plan: tuple  # one line per step, indented by depth
+    full_scans: tuple
+
+
+class FetchedRows:
+    """The rows of a profiled query, fetched at once but read like a cursor."""
+
+    def __init__(self, rows: list):
+        self.rows = rows
+        self.position = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.position >= len(self.rows):
+            raise StopIteration
+        self.position += 1
+        return self.rows[self.position - 1]
+
+    def fetchone(self):
+        return next(self, None)
+
+    def fetchmany(self, size: int = 1) -> list:
+        rows = self.rows[self.position : self.position + size]
+        self.position += len(rows)
+        return rows
+
+    def fetchall(self) -> list:
+        return self.fetchmany(len(self.rows))
+
+
+def explain_sqlite(cursor, query: str, params: tuple = ()) -> tuple:
+    """Returns the EXPLAIN QUERY PLAN steps of a sqlite query, indented by depth."""
+    depths, plan = {0: -1}, []
+    for step_id, parent, _, detail in cursor.execute(
+        f"EXPLAIN QUERY PLAN {query}", params
+    ).fetchall():
+        depths[step_id] = depths.get(parent, -1) + 1
+        plan.append("  " * depths[step_id] + detail)
+    return tuple(plan)
+
+
+def explain_mysql(cursor, query: str, params: tuple = ()) -> tuple:
+    """Returns the EXPLAIN rows of a MySQL query, one line per table access."""
+    cursor.execute(f"EXPLAIN {query}", params)
+    names = [column[0] for column in cursor.description]
+    return tuple(
+        " ".join(
+            f"{name}={value}" for name, value in zip(names, row) if value is not None
+        )
+        for row in cursor.fetchall()
+    )
+
+
+def table_aliases(query: str, tables: tuple) -> dict:
+    """Maps each name under which the given tables appear in a query to the table."""
+    aliases = {}
+    for table in tables:
+        aliases[table] = table
+        for alias in re.findall(
+            rf"\b{table}\s+(?:AS\s+)?([A-Za-z_]\w*)", query, flags=re.IGNORECASE
+        ):
+            if alias.upper() not in SQL_KEYWORDS:
+                aliases[alias] = table
+    return aliases
+
+
+def full_scans(query: str, plan: tuple, backend: str, tables: tuple) -> tuple:
+    """Returns the tables of the given ones that a plan reads in full.
+
+    A full scan is a SCAN step in sqlite, be it of the table or of one of its indexes, and an
+    access of type ALL or index in MySQL.
+    """
+    aliases = table_aliases(query, tables)
+    scanned = []
+    for step in plan:
+        if backend == "sqlite":
+            match = re.match(r"\s*SCAN (\w+)", step)
+            name = match and match.group(1)
+        else:
+            fields = dict(re.findall(r"(\w+)=(\S+)", step))
+            name = (
+                fields.get("table") if fields.get("type") in ("ALL", "index") else None
+            )
+        if name in aliases and aliases[name] not in scanned:
+            scanned.append(aliases[name])
+    return tuple(scanned)
+
+
+class QueryDiagnostics:
+    """Captures the plans and latencies of the queries run through it.
+
+    Parameters
+    ----------
+    threshold : float
+        The number of seconds above which a query is logged as slow
+    backend : str
+        sqlite or mysql, which decides how plans are captured
+    watched_tables : tuple
+        The tables whose full scans are flagged
+    """
+
+    def __init__(
+        self,
+        threshold: float = SLOW_QUERY_SECONDS,
+        backend: str = "sqlite",
+        watched_tables: tuple = WATCHED_TABLES,
+    ):
+        if threshold < 0:
+            raise ValueError("threshold must be non-negative")
+        if backend not in ("sqlite", "mysql"):
+            raise ValueError("backend must be sqlite or mysql")
+        self.threshold = threshold
+        self.backend = backend
+        self.watched_tables = tuple(watched_tables)
+        self.plans = {}  # query -> plan, captured once per distinct query
+        self.history = deque(maxlen=HISTORY_SIZE)
+        self.slow_queries = deque(maxlen=HISTORY_SIZE)
+        self.flagged = {}  # query -> the watched tables it scans
+        # analysers of several threads may share diagnostics
+        self._lock = threading.Lock()
+
+    def plan(self, cursor, query: str, params: tuple = ()) -> tuple:
+        """Returns the plan of a query, captured on its first execution."""
+        plan = self.plans.get(query)
+        if plan is None:
+            explain = explain_sqlite if self.backend == "sqlite" else explain_mysql
+            plan = explain(cursor, query, params)
+            scans = full_scans(query, plan, self.backend, self.watched_tables)
+            with self._lock:
+                self.plans[query] = plan
+                if scans:
+                    self.flagged[query] = scans
+            if scans:
+                LOGGER.warning(
+                    "full scan of %s:\n%s\n%s",
+                    ", ".join(scans),
+                    query.strip(),
+                    "\n".join(plan),
+                )
+        return plan
+
+    def execute(self, cursor, query: str, params: tuple = ()) -> FetchedRows:
+        """Runs a query, timing it until its last row is fetched.
+
+        Parameters
+        ----------
+        cursor : Cursor
+            The cursor to run the query with
+        query : str
+            The query
+        params : tuple
+            The parameters of the query
+
+        Returns
+        ----------
+        FetchedRows
+            The rows of the query, which can be read like those of a cursor
+        """
+        plan = self.plan(cursor, query, params)
+        start = perf_counter()
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+        profile = QueryProfile(
+            query,
+            tuple(params),
+            perf_counter() - start,
+            plan,
+            self.flagged.get(query, ()),
+        )
+        with self._lock:
+            self.history.append(profile)
+            if profile.seconds > self.threshold:
+                self.slow_queries.append(profile)
+        if profile.seconds > self.threshold:
+            LOGGER.warning(
+                "slow query (%.1f ms): %s\nparameters: %r\nplan:\n%s",
+                profile.seconds * 1000,
+                query.strip(),
+                profile.params,
+                "\n".join(plan),
+            )
+        return FetchedRows(rows)
+
+
+def snapshot_plans(analyser, operations: dict) -> dict:
+    """Captures the plans of the queries run by each analyser operation.
+
+    Parameters
+    ----------
+    analyser : RatingsAnalyser
+        An analyser created with a QueryDiagnostics
+    operations : dict
+        Maps each operation name to a function taking the analyser
+
+    Returns
+    ----------
+    dict
+        Maps each operation name to the plans of its queries, in execution order
+    """
+    snapshot = {}
+    for name, operation in operations.items():
+        analyser.diagnostics.history.clear()
+        operation(analyser)
+        snapshot[name] = [
+            list(profile.plan) for profile in analyser.diagnostics.history
+        ]
+    return snapshot
+
+
+def compare_plans(expected: dict, actual: dict) -> list:
+    """Lists the operations whose plans differ between two snapshots.
+
+    Returns
+    ----------
+    list[str]
+        One description per operation that is missing, new or planned differently
+    """
+    differences = []
+    for name in sorted(set(expected) | set(actual)):
+        if name not in actual:
+            differences.append(f"{name}: no longer snapshotted")
+        elif name not in expected:
+            differences.append(f"{name}: not in the saved snapshot")
+        elif expected[name] != actual[name]:
+            differences.append(
+                f"{name}: plan changed\n  expected:\n    "
+                + "\n    ".join(line for plan in expected[name] for line in plan)
+                + "\n  actual:\n    "
+                + "\n    ".join(line for plan in actual[name] for line in plan)
+            )
+    return differences
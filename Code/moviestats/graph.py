@@ -0,0 +1,511 @@
+"""This module analyses the collaboration network formed by titles and the people credited on them.
+
+The movie_actors, movie_directors and movie_musicians link tables form a bipartite graph between
+titles and people. It is stored as a compressed sparse row (CSR) adjacency: the neighbours of
+node v are indices[indptr[v]:indptr[v + 1]]. Titles are the first nodes, followed by the
+actors, directors and musicians, each kind occupying a contiguous range of nodes.
+
+The arrays are saved in the database and reloaded as long as the change log records no change
+of the link tables, so that the graph is only rebuilt after an ingestion.
+"""
+
+import json
+from typing import NamedTuple
+
+from sqlite3 import OperationalError
+
+import numpy as np
+
+from Code.moviestats.changes import latest_change
+from Code.moviestats.memory import (
+    array_to_bytes,
+    batch_rows,
+    bytes_to_array,
+    read_arrays,
+    tracked,
+)
+from Code.moviestats.ratings_analyser import POSITIVE_INT_ERR_MESSAGE, RatingsAnalyser
+from Code.moviestats.records import NameStats
+
+
+# kind -> (table, id column, link table); titles come first and link to every other kind
+NODE_KINDS = {
+    "title": ("imdb_ratings", "id", None),
+    "actor": ("actors", "actor_id", "movie_actors"),
+    "director": ("directors", "director_id", "movie_directors"),
+    "musician": ("musicians", "musician_id", "movie_musicians"),
+}
+DAMPING = 0.85
+PAGERANK_TOLERANCE = 1e-6  # L1 change of the ranks between two iterations
+PAGERANK_MAX_ITERATIONS = 100
+
+
+class SeparationPath(NamedTuple):
+    """The shortest chain of collaborations between two people."""
+
+    # number of titles on the path, e.g. 1 for people credited on the same title
+    degrees: int
+    # alternating person and title names, from the first person to the second
+    path: list
+
+
+class CentralPerson(NamedTuple):
+    """A person and their PageRank in the collaboration network."""
+
+    kind: str
+    name: str
+    score: float
+
+
+class CollaborationGraph:
+    """A CSR adjacency of the title-people graph, with path, centrality and taste queries.
+
+    Use CollaborationGraph.load to reuse the saved arrays when they are up to date.
+
+    Parameters
+    ----------
+    analyser : RatingsAnalyser
+        The analyser of the database, whose user scope applies to the rating-based queries
+    """
+
+    def __init__(self, analyser: RatingsAnalyser):
+        self.analyser = analyser
+        self.cursor = analyser.cursor
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.indices = np.empty(0, dtype=np.int32)
+        self.node_ids = {}  # kind -> sorted database ids of its nodes
+        self.offsets = {}  # kind -> first node of the kind
+        self._pagerank = None
+
+    def __len__(self) -> int:
+        return len(self.indptr) - 1
+
+    def fingerprint(self) -> str:
+        """Summarises the row counts, last ids and last changes of the graph's tables.
+
+        The version of the latest change catches updates and deletions that leave the row
+        counts and last ids unchanged. Link tables may be WITHOUT ROWID, so their last movie id
+        is used instead of a rowid.
+        """
+        tables = self._existing_kinds()
+        state = {}
+        for kind in tables:
+            table_name, column_id, link_table = NODE_KINDS[kind]
+            for name, column in ((table_name, column_id), (link_table, "movie_id")):
+                if name is not None:
+                    state[name] = self.cursor.execute(
+                        f"""SELECT COUNT(*), MAX({column}) FROM {name}"""
+                    ).fetchone()
+        state["changes"] = latest_change(self.cursor, list(state))
+        return json.dumps(state, sort_keys=True)
+
+    def _existing_kinds(self) -> list:
+        tables = {
+            row[0]
+            for row in self.cursor.execute(
+                """SELECT name FROM sqlite_master WHERE type = 'table'"""
+            )
+        }
+        return [
+            kind
+            for kind, (table_name, _, link_table) in NODE_KINDS.items()
+            if table_name in tables and (link_table is None or link_table in tables)
+        ]
+
+    def build(self) -> "CollaborationGraph":
+        """Builds the CSR arrays from the link tables of the database.
+
+        The links are read in batches sized by the memory budget of the analyser, if any.
+
+        Returns
+        ----------
+        CollaborationGraph
+            The graph itself
+        """
+        num_nodes = 0
+        for kind in self._existing_kinds():
+            table_name, column_id, _ = NODE_KINDS[kind]
+            self.node_ids[kind] = np.fromiter(
+                (
+                    row[0]
+                    for row in self.cursor.execute(
+                        f"""SELECT {column_id} FROM {table_name} ORDER BY {column_id}"""
+                    )
+                ),
+                dtype=np.int64,
+            )
+            self.offsets[kind] = num_nodes
+            num_nodes += len(self.node_ids[kind])
+
+        sources, targets = [], []
+        for kind in self.node_ids:
+            _, column_id, link_table = NODE_KINDS[kind]
+            if link_table is None:
+                continue
+            movie_ids, person_ids = read_arrays(
+                self.cursor.execute(
+                    f"""SELECT movie_id, {column_id} FROM {link_table}"""
+                ),
+                [np.int64, np.int64],
+                batch_rows(self.analyser.memory_budget),
+            )
+            titles = self.nodes_of("title", movie_ids)
+            people = self.nodes_of(kind, person_ids)
+            known = (titles >= 0) & (people >= 0)  # drops links to deleted rows
+            sources += [titles[known], people[known]]
+            targets += [people[known], titles[known]]
+
+        sources = np.concatenate(sources) if sources else np.empty(0, dtype=np.int64)
+        targets = np.concatenate(targets) if targets else np.empty(0, dtype=np.int64)
+        order = np.argsort(sources, kind="stable")
+        self.indices = targets[order].astype(np.int32)
+        self.indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=num_nodes), out=self.indptr[1:])
+        self._pagerank = None
+        return self
+
+    def nodes_of(self, kind: str, ids: np.ndarray) -> np.ndarray:
+        """Maps database ids of a kind to node numbers, -1 for ids that are not in the graph."""
+        kind_ids = self.node_ids[kind]
+        positions = np.searchsorted(kind_ids, ids)
+        found = positions < len(kind_ids)
+        found[found] = kind_ids[positions[found]] == ids[found]
+        return np.where(found, positions + self.offsets[kind], -1)
+
+    def kind_of(self, node: int) -> str:
+        """Returns the kind of a node."""
+        for kind in reversed(list(self.offsets)):
+            if node >= self.offsets[kind]:
+                return kind
+        raise ValueError(f"unknown node {node}")
+
+    def name_of(self, node: int) -> str:
+        """Returns the name of a person or the title of a title node."""
+        kind = self.kind_of(node)
+        table_name, column_id, _ = NODE_KINDS[kind]
+        column_name = "title" if kind == "title" else "name"
+        database_id = int(self.node_ids[kind][node - self.offsets[kind]])
+        return self.cursor.execute(
+            f"""SELECT {column_name} FROM {table_name} WHERE {column_id} = ?""",
+            (database_id,),
+        ).fetchone()[0]
+
+    def person_nodes(self, name: str) -> np.ndarray:
+        """Returns the nodes of every actor, director or musician with the given name."""
+        nodes = []
+        for kind in self.node_ids:
+            if kind == "title":
+                continue
+            table_name, column_id, _ = NODE_KINDS[kind]
+            ids = [
+                row[0]
+                for row in self.cursor.execute(
+                    f"""SELECT {column_id} FROM {table_name} WHERE name = ?""", (name,)
+                )
+            ]
+            if ids:
+                nodes.append(self.nodes_of(kind, np.array(ids, dtype=np.int64)))
+        nodes = np.concatenate(nodes) if nodes else np.empty(0, dtype=np.int64)
+        return nodes[nodes >= 0]
+
+    def neighbours(self, nodes: np.ndarray) -> tuple:
+        """Returns the neighbours of several nodes, and the node each of them was reached from."""
+        starts, ends = self.indptr[nodes], self.indptr[nodes + 1]
+        degrees = ends - starts
+        origins = np.repeat(nodes, degrees)
+        # position of each neighbour within the concatenated adjacency lists
+        positions = np.arange(degrees.sum()) - np.repeat(
+            np.cumsum(degrees) - degrees, degrees
+        )
+        return self.indices[np.repeat(starts, degrees) + positions], origins
+
+    def degrees_of_separation(self, person_a: str, person_b: str) -> SeparationPath:
+        """Finds the shortest chain of shared titles between two people.
+
+        A breadth-first search is run from both people at once, always expanding the smaller
+        frontier, until the two searches meet. Each expansion is vectorised over the frontier.
+
+        Parameters
+        ----------
+        person_a : str
+            The name of the first person
+        person_b : str
+            The name of the second person
+
+        Returns
+        ----------
+        SeparationPath
+            The number of titles on the chain and the chain itself, or None if the two people
+            are not connected
+        """
+        sources = [self.person_nodes(person_a), self.person_nodes(person_b)]
+        for name, nodes in zip((person_a, person_b), sources):
+            if not len(nodes):
+                raise ValueError(f"unknown person: {name}")
+        parents = [np.full(len(self), -2, dtype=np.int64) for _ in range(2)]
+        parents[0][sources[0]] = -1
+        parents[1][sources[1]] = -1
+        frontiers = list(sources)
+        meeting = np.intersect1d(sources[0], sources[1])
+        while not len(meeting) and len(frontiers[0]) and len(frontiers[1]):
+            side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+            reached, origins = self.neighbours(frontiers[side])
+            new = parents[side][reached] == -2
+            reached, first = np.unique(reached[new], return_index=True)
+            parents[side][reached] = origins[new][first]
+            frontiers[side] = reached
+            meeting = reached[parents[1 - side][reached] != -2]
+        if not len(meeting):
+            return None
+
+        node = int(meeting[0])
+        path = []
+        for side in (0, 1):
+            chain, current = [], int(parents[side][node])
+            while current >= 0:
+                chain.append(current)
+                current = int(parents[side][current])
+            path += chain[::-1] if side == 0 else chain
+            if side == 0:
+                path.append(node)
+        return SeparationPath(len(path) // 2, [self.name_of(n) for n in path])
+
+    def pagerank(self, personalisation: np.ndarray = None) -> np.ndarray:
+        """Computes the PageRank of every node by sparse power iteration.
+
+        Each iteration spreads the rank of every node evenly over its neighbours with a single
+        weighted bincount over the CSR arrays. The rank of nodes without links is spread like
+        the teleportation.
+
+        Parameters
+        ----------
+        personalisation : np.ndarray
+            The nodes to teleport to, for a PageRank centred on them. All nodes if None
+
+        Returns
+        ----------
+        np.ndarray
+            The rank of each node, summing to 1
+        """
+        num_nodes = len(self)
+        if not num_nodes:
+            return np.empty(0)
+        teleport = np.full(num_nodes, 1 / num_nodes)
+        if personalisation is not None:
+            teleport = np.zeros(num_nodes)
+            teleport[personalisation] = 1 / len(personalisation)
+        degrees = np.diff(self.indptr)
+        rows = np.repeat(np.arange(num_nodes), degrees)
+        dangling = degrees == 0
+        inverse_degrees = np.divide(
+            1.0, degrees, out=np.zeros(num_nodes), where=~dangling
+        )
+        rank = teleport.copy()
+        for _ in range(PAGERANK_MAX_ITERATIONS):
+            spread = np.bincount(
+                rows,
+                weights=(rank * inverse_degrees)[self.indices],
+                minlength=num_nodes,
+            )
+            new_rank = DAMPING * (spread + rank[dangling].sum() * teleport)
+            new_rank += (1 - DAMPING) * teleport
+            converged = np.abs(new_rank - rank).sum() < PAGERANK_TOLERANCE
+            rank = new_rank
+            if converged:
+                break
+        return rank
+
+    def get_most_central_people(
+        self, top_n: int = 10, kind: str = None, around: str = None
+    ) -> list:
+        """Gets the people with the highest PageRank in the collaboration network.
+
+        Parameters
+        ----------
+        top_n : int
+            the number of people to return
+        kind : str
+            actor, director or musician. All kinds if None
+        around : str
+            The name of a person. If given, the PageRank is personalised on them, which ranks
+            their closest collaborators first
+
+        Returns
+        ----------
+        list[CentralPerson]
+            The most central people, best first
+        """
+        if top_n < 1:
+            raise ValueError(POSITIVE_INT_ERR_MESSAGE)
+        people = [k for k in self.node_ids if k != "title"]
+        if kind is not None and kind not in people:
+            raise ValueError(f"kind must be one of {', '.join(people)}")
+        if around is None:
+            if self._pagerank is None:
+                self._pagerank = self.pagerank()
+            rank = self._pagerank
+        else:
+            sources = self.person_nodes(around)
+            if not len(sources):
+                raise ValueError(f"unknown person: {around}")
+            rank = self.pagerank(sources).copy()
+            rank[sources] = 0
+        kinds = [kind] if kind else people
+        candidates = np.concatenate(
+            [np.arange(len(self.node_ids[k])) + self.offsets[k] for k in kinds]
+            or [np.empty(0, dtype=np.int64)]
+        )
+        best = candidates[np.argsort(-rank[candidates], kind="stable")[:top_n]]
+        return [
+            CentralPerson(self.kind_of(node), self.name_of(node), float(rank[node]))
+            for node in best
+        ]
+
+    def get_directors_with_best_rated_regular_actors(
+        self, top_n: int = 10, min_titles: int = 2
+    ) -> list:
+        """Gets the directors whose regular actors you rate highly.
+
+        The regular actors of a director are those credited on at least min_titles of their
+        titles. Each actor is scored by the mean personal rating of all of their titles, and
+        each director by the mean score of their regular actors.
+
+        Parameters
+        ----------
+        top_n : int
+            the number of directors to return
+        min_titles : int
+            the number of titles of a director an actor must appear in to be a regular
+
+        Returns
+        ----------
+        list[NameStats]
+            The directors with their number of regular actors and the mean score of these actors
+        """
+        if top_n < 1:
+            raise ValueError(POSITIVE_INT_ERR_MESSAGE)
+        if "director" not in self.node_ids or "actor" not in self.node_ids:
+            return []
+        ratings = np.full(len(self.node_ids["title"]), np.nan)
+        ids, values = read_arrays(
+            self.analyser._execute(  # pylint: disable=protected-access
+                """SELECT id, your_rating FROM imdb_ratings WHERE your_rating IS NOT NULL"""
+            ),
+            [np.int64, np.float64],
+            batch_rows(self.analyser.memory_budget),
+        )
+        nodes = self.nodes_of("title", ids)
+        ratings[nodes[nodes >= 0]] = values[nodes >= 0]
+
+        actor_start = self.offsets["actor"]
+        actors = np.arange(len(self.node_ids["actor"])) + actor_start
+        titles, origins = self.neighbours(actors)
+        rated = ~np.isnan(ratings[titles])
+        counts = np.bincount(origins[rated] - actor_start, minlength=len(actors))
+        sums = np.bincount(
+            origins[rated] - actor_start,
+            weights=ratings[titles[rated]],
+            minlength=len(actors),
+        )
+        actor_scores = np.divide(
+            sums, counts, out=np.full(len(actors), np.nan), where=counts > 0
+        )
+
+        # (director, actor) pairs, once per title they share, two hops away in the graph
+        num_directors = len(self.node_ids["director"])
+        director_start = self.offsets["director"]
+        titles, directors = self.neighbours(np.arange(num_directors) + director_start)
+        people, _ = self.neighbours(titles)
+        directors = np.repeat(directors, np.diff(self.indptr)[titles])
+        is_actor = (people >= actor_start) & (people < actor_start + len(actors))
+        pairs = (directors[is_actor] - director_start) * len(actors) + (
+            people[is_actor] - actor_start
+        )
+        pairs, appearances = np.unique(pairs, return_counts=True)
+        regulars = pairs[appearances >= min_titles]
+        regular_directors, regular_actors = np.divmod(regulars, len(actors))
+        rated = ~np.isnan(actor_scores[regular_actors])
+        counts = np.bincount(regular_directors[rated], minlength=num_directors)
+        sums = np.bincount(
+            regular_directors[rated],
+            weights=actor_scores[regular_actors[rated]],
+            minlength=num_directors,
+        )
+        scores = np.divide(
+            sums, counts, out=np.full(num_directors, -np.inf), where=counts > 0
+        )
+        best = np.argsort(-scores, kind="stable")[:top_n]
+        return [
+            NameStats(
+                self.name_of(director + director_start),
+                int(counts[director]),
+                float(scores[director]),
+            )
+            for director in best
+            if counts[director]
+        ]
+
+    def save(self) -> None:
+        """Stores the CSR arrays and the fingerprint of the tables in the database."""
+        self.cursor.execute(
+            """CREATE TABLE IF NOT EXISTS collaboration_graph(
+                name TEXT PRIMARY KEY,
+                payload BLOB
+            )"""
+        )
+        arrays = {"indptr": self.indptr, "indices": self.indices}
+        arrays.update({f"ids_{kind}": ids for kind, ids in self.node_ids.items()})
+        self.cursor.execute("""DELETE FROM collaboration_graph""")
+        self.cursor.executemany(
+            """INSERT INTO collaboration_graph (name, payload) VALUES (?,?)""",
+            [(name, array_to_bytes(array)) for name, array in arrays.items()]
+            + [("fingerprint", self.fingerprint().encode())],
+        )
+        self.analyser.conn.commit()
+
+    @classmethod
+    def load(cls, analyser: RatingsAnalyser) -> "CollaborationGraph":
+        """Loads the saved graph, or builds and saves it if the link tables changed since.
+
+        Parameters
+        ----------
+        analyser : RatingsAnalyser
+            The analyser of the database
+
+        Returns
+        ----------
+        CollaborationGraph
+            The up to date graph
+        """
+        graph = cls(analyser)
+        saved = {}
+        if analyser.cursor.execute(
+            """SELECT name FROM sqlite_master
+            WHERE type = 'table' AND name = 'collaboration_graph'"""
+        ).fetchone():
+            saved = dict(
+                analyser.cursor.execute(
+                    """SELECT name, payload FROM collaboration_graph"""
+                ).fetchall()
+            )
+        if saved.get("fingerprint") != graph.fingerprint().encode():
+            with tracked(analyser.memory_budget, "graph.build", "chunked"):
+                graph.build()
+            try:
+                graph.save()
+            except OperationalError:  # read-only connection, the graph stays in memory
+                pass
+            return graph
+        arrays = {
+            name: bytes_to_array(payload)
+            for name, payload in saved.items()
+            if name != "fingerprint"
+        }
+        graph.indptr, graph.indices = arrays.pop("indptr"), arrays.pop("indices")
+        num_nodes = 0
+        for kind in NODE_KINDS:
+            if f"ids_{kind}" in arrays:
+                graph.node_ids[kind] = arrays[f"ids_{kind}"]
+                graph.offsets[kind] = num_nodes
+                num_nodes += len(graph.node_ids[kind])
+        return graph
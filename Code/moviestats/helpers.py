@@ -1,6 +1,8 @@
 """This module contains helper functions for the RatingsAnalyser class.
 """
 
+from calendar import timegm
+from datetime import date
 from functools import wraps
 from time import perf_counter
 
@@ -99,3 +101,24 @@ def compute_weighted_rating(v: int, R: float, C: float, m: int = 5) -> float:
     The weighted rating
     """
     return (v / (v + m)) * R + (m / (v + m)) * C
+
+
+def date_to_epoch(value) -> int:
+    """Converts an ISO date (as found in IMDb exports) to a Unix timestamp at midnight UTC.
+
+    Parameters
+    ----------
+    value : str
+        The date to convert, e.g. "2023-05-14"
+
+    Returns
+    ----------
+    int
+        The number of seconds since 1970-01-01, or None if value is missing or not a date
+    """
+    if not isinstance(value, str):
+        return None
+    try:
+        return timegm(date.fromisoformat(value.strip()).timetuple())
+    except ValueError:
+        return None
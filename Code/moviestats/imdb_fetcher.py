@@ -1,3 +1,5 @@
+import re
+
 from imdb.imdb import IMDb
 from Code.moviestats.helpers import timer
 
@@ -55,3 +57,21 @@ class IMDbDataFetcher:
             The list of music contributors of the title
         """
         return self.ia.full_cast_and_crew(movie_id).music_name
+
+    @timer
+    def get_episode_runtime(self, movie_id: str) -> int | None:
+        """Get the runtime of the episodes of a TV show by its IMDb ID.
+
+        Parameters
+        ----------
+        movie_id : str
+            The IMDb ID of the TV show
+
+        Returns
+        ----------
+        int | None
+            The runtime of an episode in minutes, None if IMDb does not list it
+        """
+        runtime = self.ia.technical_spec(movie_id).runtime
+        minutes = re.search(r"(\d+) min", runtime or "")
+        return int(minutes.group(1)) if minutes else None
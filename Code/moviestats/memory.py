@@ -0,0 +1,188 @@
+"""This module keeps analytics and ingestion within a memory budget.
+
+Budgets are opt-in: a MemoryBudget given to the analyser (and through it to the rating cube and
+the collaboration graph), to the collaborative recommender, to the sketches or to the ingestion
+sizes the batches in which they read rows, so that a join is never fetched into Python tuples
+at once. Operations that hold a whole join in Python dicts when it is small enough estimate its
+size first, and above the budget switch to an external strategy: they stream rows in an order
+that SQLite produces from an index or sorts in its temporary files, or look values up in the
+database rather than in a set. Both strategies give the same results.
+
+Each operation run under a budget is tracked: the strategy it chose, the peak memory it
+allocated (traced by tracemalloc when the budget traces) and the resident set size of the
+process are kept in the history of the budget and logged, and a warning is logged when the
+traced peak exceeded the budget.
+"""
+
+import logging
+import os
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from typing import NamedTuple
+
+
+BATCH_ROWS = 50_000  # rows fetched at once without a budget
+MIN_BATCH_ROWS = 1_000
+ROW_BYTES = 120  # rough size of a fetched row of a few small values, as a Python tuple
+HISTORY_SIZE = 1000  # number of tracked operations kept
+LOGGER = logging.getLogger("moviestats.memory")
+# silent unless the application configures logging
+LOGGER.addHandler(logging.NullHandler())
+
+
+class MemoryProfile(NamedTuple):
+    """One operation run under a memory budget."""
+
+    operation: str
+    strategy: str  # memory, chunked or external
+    peak_bytes: int  # traced by tracemalloc, 0 if the budget does not trace
+    rss_bytes: int  # resident set size of the process once the operation is done
+
+
+def rss_bytes() -> int:
+    """Returns the resident set size of the process, its peak where the current one is unknown."""
+    try:
+        with open("/proc/self/statm", encoding="ascii") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class MemoryBudget:
+    """The memory that an operation may use for the rows it processes.
+
+    Parameters
+    ----------
+    limit_bytes : int
+        The budget of a single operation, in bytes
+    trace : bool
+        If True, the peak memory allocated by each tracked operation is traced with tracemalloc,
+        which slows Python allocations down
+    """
+
+    def __init__(self, limit_bytes: int, trace: bool = False):
+        if limit_bytes < 1:
+            raise ValueError("limit_bytes must be a positive integer")
+        self.limit_bytes = limit_bytes
+        self.trace = trace
+        self.history = deque(maxlen=HISTORY_SIZE)
+
+    def fits(self, rows: int, row_bytes: int) -> bool:
+        """Tells whether rows of about row_bytes bytes each can be held at once."""
+        return rows * row_bytes <= self.limit_bytes
+
+    def batch_rows(self, row_bytes: int = ROW_BYTES) -> int:
+        """Returns the number of rows of about row_bytes bytes to process at once."""
+        return max(MIN_BATCH_ROWS, min(BATCH_ROWS, self.limit_bytes // row_bytes))
+
+    @contextmanager
+    def track(self, operation: str, strategy: str):
+        """Records the strategy and memory of the operation run within the context.
+
+        Operations should not be tracked within one another: the traced peak is reset when an
+        operation starts.
+        """
+        started = self.trace and not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        tracing = tracemalloc.is_tracing() and self.trace
+        if tracing:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+        try:
+            yield
+        finally:
+            peak = tracemalloc.get_traced_memory()[1] - before if tracing else 0
+            if started:
+                tracemalloc.stop()
+            profile = MemoryProfile(operation, strategy, peak, rss_bytes())
+            self.history.append(profile)
+            LOGGER.info(
+                "%s (%s): peak %.1f MiB, resident %.1f MiB",
+                operation,
+                strategy,
+                peak / 2**20,
+                profile.rss_bytes / 2**20,
+            )
+            if peak > self.limit_bytes:
+                LOGGER.warning(
+                    "%s (%s) allocated %.1f MiB, over its budget of %.1f MiB",
+                    operation,
+                    strategy,
+                    peak / 2**20,
+                    self.limit_bytes / 2**20,
+                )
+
+
+def batch_rows(budget: MemoryBudget, row_bytes: int = ROW_BYTES) -> int:
+    """Returns the number of rows to fetch at once, BATCH_ROWS without a budget."""
+    return BATCH_ROWS if budget is None else budget.batch_rows(row_bytes)
+
+
+def tracked(budget: MemoryBudget, operation: str, strategy: str):
+    """Tracks an operation under a budget, does nothing without one."""
+    if budget is None:
+        return nullcontext()
+    return budget.track(operation, strategy)
+
+
+def iter_batches(rows, size: int):
+    """Yields the rows of a cursor in lists of at most size rows."""
+    while batch := rows.fetchmany(size):
+        yield batch
+
+
+def array_to_bytes(array) -> bytes:
+    """Serialises a NumPy array in the .npy format, without pickling, to store it in a BLOB."""
+    import io
+
+    import numpy as np
+
+    buffer = io.BytesIO()
+    np.save(buffer, array, allow_pickle=False)
+    return buffer.getvalue()
+
+
+def bytes_to_array(payload: bytes):
+    """Reads back an array serialised by array_to_bytes."""
+    import io
+
+    import numpy as np
+
+    return np.load(io.BytesIO(payload), allow_pickle=False)
+
+
+def read_arrays(rows, dtypes: list, size: int = BATCH_ROWS) -> list:
+    """Reads the rows of a cursor into one array per column, size rows at a time.
+
+    Only one batch of rows is held as Python tuples at once, rather than every row as with
+    fetchall. NULLs become NaN in float columns.
+
+    Parameters
+    ----------
+    rows : Cursor
+        A cursor on the rows to read
+    dtypes : list
+        The dtype of each column
+    size : int
+        The number of rows fetched at once
+
+    Returns
+    ----------
+    list[np.ndarray]
+        The values of each column
+    """
+    # numpy is only imported by the readers of arrays, ingestion otherwise does without
+    import numpy as np
+
+    columns = [[] for _ in dtypes]
+    for batch in iter_batches(rows, size):
+        for column, values, dtype in zip(columns, zip(*batch), dtypes):
+            column.append(np.array(values, dtype=dtype))
+    return [
+        np.concatenate(column) if column else np.empty(0, dtype=dtype)
+        for column, dtype in zip(columns, dtypes)
+    ]
@@ -1,9 +1,48 @@
 """Utility functions for plotting data from the IMDb dataset.
 """
 
-from statistics import fmean
 import numpy as np
 import matplotlib.pyplot as plt
+from Code.moviestats.records import RatingDifference, TitleRatings, to_columns
+
+
+def get_rating_scatter_data(ratings: list) -> tuple:
+    """Prepare the arrays needed to draw the IMDb vs. personal rating scatter plot.
+
+    Parameters
+    ----------
+    ratings : list
+        list of TitleRatings records, as returned by RatingsAnalyser.get_ratings
+
+    Returns
+    ----------
+    tuple
+        The IMDb ratings, personal ratings and fitted regression line values
+    """
+    columns = to_columns(ratings, TitleRatings)
+    rated = ~np.isnan(columns["imdb_rating"]) & ~np.isnan(columns["your_rating"])
+    imdb_ratings = columns["imdb_rating"][rated]
+    personal_ratings = columns["your_rating"][rated].astype(np.float64)
+    slope, intercept = np.polyfit(imdb_ratings, personal_ratings, 1)
+    return imdb_ratings, personal_ratings, slope * imdb_ratings + intercept
+
+
+def get_rating_difference_data(rating_differences: list) -> tuple:
+    """Prepare the values needed to draw the rating difference distribution.
+
+    Parameters
+    ----------
+    rating_differences : list
+        list of RatingDifference records, as returned by RatingsAnalyser.get_rating_differences
+
+    Returns
+    ----------
+    tuple
+        The array of rating differences and their mean
+    """
+    differences = to_columns(rating_differences, RatingDifference)["difference"]
+    differences = differences[~np.isnan(differences)]
+    return differences, differences.mean()
 
 
 def plot_favourite_genre_ratings_histogram(top_genres: list) -> None:
@@ -60,13 +99,9 @@ def plot_rating_difference_scatter(ratings: list) -> None:
     Parameters
     ----------
     ratings : list
-        list of 3-tuples containing movie, IMDb rating and the personal rating
+        list of TitleRatings records, as returned by RatingsAnalyser.get_ratings
     """
-    imdb_ratings = np.array([movie[1] for movie in ratings])
-    personal_ratings = np.array([movie[2] for movie in ratings])
-    slope, intercept = np.polyfit(imdb_ratings, personal_ratings, 1)
-
-    reg_line = slope * imdb_ratings + intercept
+    imdb_ratings, personal_ratings, reg_line = get_rating_scatter_data(ratings)
 
     # Add regression line to scatter plot
     plt.scatter(imdb_ratings, personal_ratings)
@@ -84,16 +119,15 @@ def plot_rating_difference_distribution(rating_differences: list) -> None:
     Parameters
     ----------
     rating_differences : list
-        list of 2-tuples with movie and the rating difference
+        list of RatingDifference records
     """
-    rating_differences = [diff for _, diff in rating_differences]
+    rating_differences, rmean = get_rating_difference_data(rating_differences)
     plt.figure(figsize=(10, 6))
     plt.hist(rating_differences, bins=30, color="skyblue", edgecolor="black")
     plt.title("Distribution of Rating Differences (Your Rating - IMDb Rating)")
     plt.xlabel("Rating Difference")
     plt.ylabel("Frequency")
 
-    rmean = fmean(rating_differences)
     plt.axvline(rmean, color="red", linestyle="dashed", linewidth=1)
     plt.text(rmean, plt.ylim()[1] * 0.9, f"Mean: {rmean:.2f}", color="red")
     plt.grid(True)
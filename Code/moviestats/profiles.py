@@ -0,0 +1,430 @@
+"""This module maintains the career profile of every actor, director and musician.
+
+A profile summarises the rated titles of a person: their count, the mean personal rating and
+its gap to the IMDb rating, the best and worst rated titles, the years spanned and the current
+form, i.e. the rolling mean of the ROLLING_TITLES latest ratings. Profiles are computed for every
+person of a kind and every user at once, with window functions over the link tables: the
+filmography of each person is numbered by year and carries its rolling mean in career_titles,
+which is then grouped into career_profiles.
+
+Both tables are keyed by user, kind and person, so that a profile is one primary key lookup and
+the profiles of many names are read by a single query. They are kept up to date incrementally
+by consuming the change log (see changes.py): only the people credited on changed titles are
+recomputed. As for the watch time totals, queries never refresh the profiles themselves, so
+that they also run on read-only connections and replicas.
+"""
+
+import json
+from sqlite3 import OperationalError
+from typing import NamedTuple
+
+from Code.moviestats.changes import ChangeFeed, create_change_log
+from Code.moviestats.search import existing_tables
+from Code.moviestats.watch_time import LEGACY_USER_ID
+
+
+CONSUMER = "career_profiles"
+ROLLING_TITLES = 5
+# kind -> (table, id column, link table)
+PEOPLE_KINDS = {
+    "actor": ("actors", "actor_id", "movie_actors"),
+    "director": ("directors", "director_id", "movie_directors"),
+    "musician": ("musicians", "musician_id", "movie_musicians"),
+}
+# every personal rating of a title, user_id being LEGACY_USER_ID for those of imdb_ratings
+RATED = f"""SELECT {LEGACY_USER_ID} AS user_id, id, year, imdb_rating, your_rating
+    FROM imdb_ratings WHERE your_rating IS NOT NULL
+    UNION ALL
+    SELECT u.user_id, t.id, t.year, t.imdb_rating, u.your_rating
+    FROM user_ratings u JOIN imdb_ratings t ON t.const = u.const
+    WHERE u.your_rating IS NOT NULL"""
+# the filmography of each person in release order, {people} filtering the people to compute
+CAREER_TITLES = f"""INSERT INTO career_titles
+    SELECT '{{kind}}', rated.user_id, link.{{column_id}}, ROW_NUMBER() OVER career,
+    rated.id, rated.year, rated.your_rating, rated.imdb_rating,
+    AVG(rated.your_rating) OVER (career ROWS {ROLLING_TITLES - 1} PRECEDING)
+    FROM ({RATED}) AS rated
+    JOIN {{link_table}} AS link ON link.movie_id = rated.id
+    {{people}}
+    WINDOW career AS (
+        PARTITION BY rated.user_id, link.{{column_id}}
+        ORDER BY rated.year IS NULL, rated.year, rated.id
+    )"""
+# one group per filmography, read in primary key order; the best and worst titles are searched
+# among the titles of the filmography rated as such, and the latest title is numbered by the count
+CAREER_PROFILES = """INSERT INTO career_profiles
+    SELECT s.kind, s.user_id, people.name, s.person_id, s.titles, s.mean_rating, s.imdb_gap,
+    (
+        SELECT movie_id FROM career_titles AS c
+        WHERE c.kind = s.kind AND c.user_id = s.user_id AND c.person_id = s.person_id
+        AND c.your_rating = s.best_rating ORDER BY c.imdb_rating DESC, c.position LIMIT 1
+    ), s.best_rating,
+    (
+        SELECT movie_id FROM career_titles AS c
+        WHERE c.kind = s.kind AND c.user_id = s.user_id AND c.person_id = s.person_id
+        AND c.your_rating = s.worst_rating ORDER BY c.imdb_rating, c.position LIMIT 1
+    ), s.worst_rating, s.first_year, s.last_year, latest.rolling_rating
+    FROM (
+        SELECT kind, user_id, person_id, COUNT(*) AS titles, AVG(your_rating) AS mean_rating,
+        AVG(your_rating - imdb_rating) AS imdb_gap, MAX(your_rating) AS best_rating,
+        MIN(your_rating) AS worst_rating, MIN(year) AS first_year, MAX(year) AS last_year
+        FROM career_titles WHERE kind = '{kind}' {people} GROUP BY user_id, person_id
+    ) AS s
+    JOIN career_titles AS latest ON latest.kind = s.kind AND latest.user_id = s.user_id
+    AND latest.person_id = s.person_id AND latest.position = s.titles
+    JOIN {table_name} AS people ON people.{column_id} = s.person_id"""
+PROFILE_COLUMNS = """p.name, p.titles, p.mean_rating, p.imdb_gap, best.title, p.best_rating,
+    worst.title, p.worst_rating, p.first_year, p.last_year, p.rolling_rating"""
+
+
+class CareerProfile(NamedTuple):
+    """The rated titles of a person, summarised."""
+
+    name: str
+    titles: int
+    mean_rating: float
+    # mean of your_rating - imdb_rating, over the titles having an IMDb rating
+    imdb_gap: float
+    best_title: str
+    best_rating: int
+    worst_title: str
+    worst_rating: int
+    first_year: int
+    last_year: int
+    # mean of the ROLLING_TITLES latest ratings
+    rolling_rating: float
+
+
+class CareerTitle(NamedTuple):
+    """A title of a filmography, with the rolling mean rating of the career up to it."""
+
+    title: str
+    year: int
+    your_rating: int
+    imdb_rating: float
+    rolling_rating: float
+
+
+def create_profile_tables(cursor) -> None:
+    """Creates the filmography and profile tables.
+
+    Parameters
+    ----------
+    cursor : Cursor
+        The SQL cursor to use
+    """
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS career_titles(
+            kind TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            person_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            movie_id INTEGER NOT NULL,
+            year INTEGER,
+            your_rating INTEGER,
+            imdb_rating REAL,
+            rolling_rating REAL,
+            PRIMARY KEY(kind, user_id, person_id, position)
+        ) WITHOUT ROWID"""
+    )
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS career_profiles(
+            kind TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            person_id INTEGER NOT NULL,
+            titles INTEGER NOT NULL,
+            mean_rating REAL,
+            imdb_gap REAL,
+            best_movie_id INTEGER,
+            best_rating INTEGER,
+            worst_movie_id INTEGER,
+            worst_rating INTEGER,
+            first_year INTEGER,
+            last_year INTEGER,
+            rolling_rating REAL,
+            PRIMARY KEY(kind, user_id, name)
+        ) WITHOUT ROWID"""
+    )
+    cursor.execute(
+        """CREATE INDEX IF NOT EXISTS idx_career_profiles_person
+        ON career_profiles(kind, person_id)"""
+    )
+
+
+class CareerProfiles:
+    """A class to answer career profile queries from incrementally maintained tables.
+
+    Parameters
+    ----------
+    db_name : str
+        The name of the database
+    user : str
+        The user profile whose ratings are summarised. The ratings of imdb_ratings if None
+    read_only : bool
+        Whether to open the database read-only, e.g. a replica. Only queries are then possible
+    """
+
+    def __init__(
+        self,
+        db_name: str = "imdb_ratings.db",
+        user: str = None,
+        read_only: bool = False,
+    ):
+        self.feed = ChangeFeed(db_name, read_only)
+        self.conn = self.feed.conn
+        self.cursor = self.conn.cursor()
+        if not read_only:
+            create_profile_tables(self.cursor)
+            create_change_log(self.cursor)
+            self.conn.commit()
+        tables = existing_tables(self.cursor)
+        self.kinds = {
+            kind: spec
+            for kind, spec in PEOPLE_KINDS.items()
+            if {spec[0], spec[2]} <= tables
+        }
+        self.user_id = LEGACY_USER_ID
+        if user is not None:
+            row = self.cursor.execute(
+                """SELECT user_id FROM users WHERE name = ?""", (user,)
+            ).fetchone()
+            if row is None:
+                raise ValueError(f"unknown user: {user}")
+            self.user_id = row[0]
+
+    def _source_tables(self) -> list:
+        tables = ["imdb_ratings", "user_ratings"]
+        for table_name, _, link_table in self.kinds.values():
+            tables += [table_name, link_table]
+        return tables
+
+    def _compute(self, kind: str, people: str = None) -> None:
+        """Computes the filmographies and profiles of the people selected by a subquery.
+
+        The previous filmographies and profiles of these people are replaced. All the people of
+        the kind are computed if people is None, in which case the tables must have been emptied.
+        """
+        table_name, column_id, link_table = self.kinds[kind]
+        if people is not None:
+            # the filmographies of a person are spread over one key range per user
+            self.cursor.execute(
+                f"""DELETE FROM career_titles WHERE kind = ?
+                AND user_id IN (SELECT {LEGACY_USER_ID} UNION ALL SELECT user_id FROM users)
+                AND person_id IN ({people})""",
+                (kind,),
+            )
+            self.cursor.execute(
+                f"""DELETE FROM career_profiles WHERE kind = ? AND person_id IN ({people})""",
+                (kind,),
+            )
+        self.cursor.execute(
+            CAREER_TITLES.format(
+                kind=kind,
+                column_id=column_id,
+                link_table=link_table,
+                people=(
+                    "" if people is None else f"WHERE link.{column_id} IN ({people})"
+                ),
+            )
+        )
+        self.cursor.execute(
+            CAREER_PROFILES.format(
+                kind=kind,
+                table_name=table_name,
+                column_id=column_id,
+                people="" if people is None else f"AND person_id IN ({people})",
+            )
+        )
+
+    def rebuild(self) -> None:
+        """Recomputes every profile from scratch."""
+        version = self.feed.latest_version()
+        self.cursor.execute("""DELETE FROM career_titles""")
+        self.cursor.execute("""DELETE FROM career_profiles""")
+        for kind in self.kinds:
+            self._compute(kind)
+        self.feed.acknowledge(CONSUMER, version)
+
+    def refresh(self) -> int:
+        """Updates the profiles of the people credited on the titles changed since the last refresh.
+
+        The first refresh, and any refresh following a bulk load, rebuilds the profiles.
+
+        Returns
+        ----------
+        int
+            The number of changes processed
+        """
+        if not self.feed.has_consumer(CONSUMER):
+            self.rebuild()
+            return 0
+        changes = self.feed.pull(CONSUMER, self._source_tables())
+        if not changes:
+            return 0
+        if any(change.op == "load" for change in changes):
+            self.rebuild()
+            return len(changes)
+        links = {link_table: kind for kind, (_, _, link_table) in self.kinds.items()}
+        names = {table_name: kind for kind, (table_name, _, _) in self.kinds.items()}
+        consts, movie_ids, people = set(), set(), set()
+        for change in changes:
+            if change.table_name in links:
+                movie_id, person_id = change.key.split(":")
+                movie_ids.add(int(movie_id))
+                people.add((links[change.table_name], int(person_id)))
+            elif change.table_name in names:
+                people.add((names[change.table_name], int(change.key)))
+            else:
+                consts.add(change.key.split(":")[-1])
+        self.cursor.execute(
+            """CREATE TEMP TABLE IF NOT EXISTS career_changed(
+                kind TEXT, person_id INTEGER, PRIMARY KEY(kind, person_id)
+            )"""
+        )
+        self.cursor.execute("""DELETE FROM temp.career_changed""")
+        self.cursor.executemany(
+            """INSERT OR IGNORE INTO temp.career_changed VALUES (?, ?)""", people
+        )
+        movie_ids.update(
+            row[0]
+            for const in consts
+            for row in self.cursor.execute(
+                """SELECT id FROM imdb_ratings WHERE const = ?""", (const,)
+            )
+        )
+        for kind, (_, column_id, link_table) in self.kinds.items():
+            self.cursor.executemany(
+                f"""INSERT OR IGNORE INTO temp.career_changed
+                SELECT '{kind}', {column_id} FROM {link_table} WHERE movie_id = ?""",
+                [(movie_id,) for movie_id in movie_ids],
+            )
+            self._compute(
+                kind,
+                f"""SELECT person_id FROM temp.career_changed WHERE kind = '{kind}'""",
+            )
+        self.feed.acknowledge(CONSUMER, changes[-1].version)
+        return len(changes)
+
+    def _check_kind(self, kind: str) -> None:
+        if kind not in self.kinds:
+            raise ValueError(f"kind must be one of {', '.join(self.kinds)}")
+        try:
+            refreshed = self.feed.has_consumer(CONSUMER)
+        except OperationalError:  # database created before the change log
+            refreshed = False
+        if not refreshed:
+            raise ValueError(
+                "career profiles are not computed yet, run the refresh subcommand"
+            )
+
+    def get_profile(self, name: str, kind: str = "actor") -> CareerProfile:
+        """Gets the career profile of a person.
+
+        Parameters
+        ----------
+        name : str
+            The name of the person
+        kind : str
+            actor, director or musician
+
+        Returns
+        ----------
+        CareerProfile
+            The profile of the person, None if they have no rated title
+        """
+        profiles = self.get_profiles([name], kind)
+        return profiles[0] if profiles else None
+
+    def get_profiles(self, names: list, kind: str = "actor") -> list:
+        """Gets the career profiles of many people with a single query.
+
+        Parameters
+        ----------
+        names : list
+            The names of the people
+        kind : str
+            actor, director or musician
+
+        Returns
+        ----------
+        list[CareerProfile]
+            The profiles of the people having rated titles, in the order of names
+        """
+        self._check_kind(kind)
+        profiles = {
+            row[0]: CareerProfile._make(row)
+            for row in self.cursor.execute(
+                f"""SELECT {PROFILE_COLUMNS} FROM career_profiles AS p
+                JOIN imdb_ratings AS best ON best.id = p.best_movie_id
+                JOIN imdb_ratings AS worst ON worst.id = p.worst_movie_id
+                WHERE p.user_id = ? AND p.kind = ?
+                AND p.name IN (SELECT value FROM json_each(?))""",
+                (self.user_id, kind, json.dumps(list(names))),
+            )
+        }
+        return [profiles[name] for name in dict.fromkeys(names) if name in profiles]
+
+    def get_top_profiles(
+        self, kind: str = "actor", top_n: int = 10, min_titles: int = 3
+    ) -> list:
+        """Gets the profiles of the people with the best mean rating.
+
+        Parameters
+        ----------
+        kind : str
+            actor, director or musician
+        top_n : int
+            the number of profiles to return
+        min_titles : int
+            the number of rated titles a person needs to be ranked
+
+        Returns
+        ----------
+        list[CareerProfile]
+            The profiles, best mean rating first
+        """
+        self._check_kind(kind)
+        return [
+            CareerProfile._make(row)
+            for row in self.cursor.execute(
+                f"""SELECT {PROFILE_COLUMNS} FROM career_profiles AS p
+                JOIN imdb_ratings AS best ON best.id = p.best_movie_id
+                JOIN imdb_ratings AS worst ON worst.id = p.worst_movie_id
+                WHERE p.user_id = ? AND p.kind = ? AND p.titles >= ?
+                ORDER BY p.mean_rating DESC, p.titles DESC LIMIT ?""",
+                (self.user_id, kind, min_titles, top_n),
+            )
+        ]
+
+    def get_filmography(self, name: str, kind: str = "actor") -> list:
+        """Gets the rated titles of a person in release order.
+
+        Parameters
+        ----------
+        name : str
+            The name of the person
+        kind : str
+            actor, director or musician
+
+        Returns
+        ----------
+        list[CareerTitle]
+            The rated titles, oldest first, with the rolling mean rating up to each
+        """
+        self._check_kind(kind)
+        return list(
+            map(
+                CareerTitle._make,
+                self.cursor.execute(
+                    """SELECT t.title, c.year, c.your_rating, c.imdb_rating, c.rolling_rating
+                    FROM career_profiles AS p
+                    JOIN career_titles AS c ON c.user_id = p.user_id AND c.kind = p.kind
+                    AND c.person_id = p.person_id
+                    JOIN imdb_ratings AS t ON t.id = c.movie_id
+                    WHERE p.user_id = ? AND p.kind = ? AND p.name = ?
+                    ORDER BY c.position""",
+                    (self.user_id, kind, name),
+                ),
+            )
+        )
@@ -0,0 +1,409 @@
+"""This module provides an in-memory rating cube over genres, decade, title type and rating band.
+
+Every rated title falls in one cell of the cube, keyed by its set of genres, its release decade,
+its title type and the band of its personal rating. Each cell holds the count, sum and sum of
+squares of the ratings of its titles, so that the mean and standard deviation of any slice or
+roll-up of the cube are computed from the cells rather than from the titles.
+
+Genre sets are bitmasks, genres whose names only differ by surrounding whitespace sharing a bit
+as in storage.update_genre_masks, so that slicing on genres is a vectorised mask test. The cube
+is built in a single pass: the rated titles of the analyser scope and their genre links are read
+once and NumPy groups them into cells. It is then refreshed incrementally from the change log
+(see changes.py): only the titles changed since the last refresh are moved from their old cell to
+their new one. Bulk loads, genre changes and title deletions rebuild the cube instead, as do
+databases without a change log once PRAGMA data_version tells that another connection wrote.
+Rows are read in batches sized by the memory budget of the analyser, if any.
+"""
+
+from sqlite3 import OperationalError
+from typing import NamedTuple
+
+import numpy as np
+
+from Code.moviestats.memory import batch_rows, iter_batches, read_arrays, tracked
+from Code.moviestats.ratings_analyser import RatingsAnalyser
+from Code.moviestats.storage import MAX_GENRE_BITS
+
+
+DIMENSIONS = ["genres", "decade", "title_type", "band"]
+# band -> highest personal rating of the band, the lowest being 1
+RATING_BANDS = {"1-4": 4, "5-6": 6, "7-8": 8, "9-10": 10}
+UNKNOWN_DECADE = -1
+UNKNOWN_TYPE = "unknown"
+SOURCE_TABLES = ["imdb_ratings", "user_ratings", "movie_genres", "genres"]
+# roll-ups with at most that many possible groups per selected cell are grouped with a
+# bincount over every possible group rather than a sort
+MAX_DENSE_GROUPS_PER_CELL = 8
+# dimension -> (offset, bits) of its code in the integer key of a cell
+KEY_LAYOUT = {
+    "band": (0, 2),
+    "decade": (2, 10),
+    "title_type": (12, 12),
+    "genres": (24, 39),
+}
+
+
+class CubeCell(NamedTuple):
+    """An aggregate of the cube. Dimensions rolled up are None."""
+
+    genres: tuple
+    decade: int
+    title_type: str
+    band: str
+    count: int
+    mean_rating: float
+    std_rating: float
+
+
+def decade_code(decade: int) -> int:
+    """Returns the code of a decade in the cube, 0 being the unknown decade."""
+    return 0 if decade == UNKNOWN_DECADE else decade // 10 + 1
+
+
+def cell_keys(codes: dict) -> np.ndarray:
+    """Packs the codes of each dimension into the integer keys of cells, see KEY_LAYOUT."""
+    keys = 0
+    for dimension, (offset, _) in KEY_LAYOUT.items():
+        keys = keys | codes[dimension] << offset
+    return keys
+
+
+class RatingCube:
+    """Count, sum and sum of squares of personal ratings by genre set, decade, type and band.
+
+    Parameters
+    ----------
+    analyser : RatingsAnalyser
+        The analyser whose (possibly user scoped) ratings are aggregated. Its connection may be
+        read-only
+    """
+
+    def __init__(self, analyser: RatingsAnalyser):
+        self.analyser = analyser
+        self.rebuild()
+
+    def _read_version(self):
+        """Returns the version of the latest change, None without a change log."""
+        try:
+            return self.analyser.cursor.execute(
+                """SELECT COALESCE(MAX(version), 0) FROM changes"""
+            ).fetchone()[0]
+        except OperationalError:  # database created before the change log
+            return None
+
+    def _read_data_version(self) -> int:
+        return self.analyser.cursor.execute("PRAGMA data_version").fetchone()[0]
+
+    def _code_genre_sets(self, masks: np.ndarray) -> np.ndarray:
+        """Returns the code of each genre set mask, coding the new ones."""
+        distinct, inverse = np.unique(masks, return_inverse=True)
+        new = [mask for mask in distinct.tolist() if mask not in self._genre_sets]
+        for mask in new:
+            self._genre_sets[mask] = len(self._genre_sets)
+            self._genre_set_names.append(
+                tuple(
+                    sorted(
+                        name
+                        for bit, name in enumerate(self._genre_names)
+                        if mask >> bit & 1
+                    )
+                )
+            )
+        if new:
+            self._set_masks = np.append(self._set_masks, np.array(new, dtype=np.int64))
+        return np.array(
+            [self._genre_sets[mask] for mask in distinct.tolist()], dtype=np.int64
+        )[inverse.ravel()]
+
+    def _read_titles(self, ids: list = None) -> tuple:
+        """Reads rated titles, all of them if ids is None, and computes the keys of their cells.
+
+        Returns
+        ----------
+        tuple
+            The sorted ids of the titles, the integer key of their cell and their rating
+        """
+        titles, links, params = "", "", ()
+        if ids is not None:
+            titles = "AND id IN (SELECT value FROM json_each(?))"
+            links = "WHERE movie_id IN (SELECT value FROM json_each(?))"
+            params = (f"[{','.join(map(str, ids))}]",)
+        size = batch_rows(self.analyser.memory_budget)
+        title_ids, years, types, ratings = read_arrays(
+            self.analyser._execute(  # pylint: disable=protected-access
+                f"""SELECT id, year, title_type, your_rating FROM imdb_ratings
+                WHERE your_rating IS NOT NULL {titles} ORDER BY id""",
+                params,
+            ),
+            [np.int64, np.float64, object, np.float64],
+            size,
+        )
+
+        # the genre set of each title is the union of the bits of its genres
+        masks = np.zeros(len(title_ids), dtype=np.int64)
+        for pairs in iter_batches(
+            self.analyser.cursor.execute(
+                f"""SELECT movie_id, genre_id FROM movie_genres {links}""", params
+            ),
+            size,
+        ):
+            movie_ids, genre_ids = np.array(pairs, dtype=np.int64).T
+            positions = np.searchsorted(title_ids, movie_ids)
+            rated = positions < len(title_ids)
+            rated[rated] = title_ids[positions[rated]] == movie_ids[rated]
+            np.bitwise_or.at(
+                masks,
+                positions[rated],
+                np.array(
+                    [self._genre_masks.get(genre, 0) for genre in genre_ids[rated]],
+                    dtype=np.int64,
+                ),
+            )
+
+        codes = {
+            "genres": self._code_genre_sets(masks),
+            "decade": np.where(np.isnan(years), 0, years // 10 + 1).astype(np.int64),
+            "title_type": np.array(
+                [
+                    self._types.setdefault(kind or UNKNOWN_TYPE, len(self._types))
+                    for kind in types
+                ],
+                dtype=np.int64,
+            ),
+            "band": np.digitize(ratings, list(RATING_BANDS.values()), right=True),
+        }
+        return title_ids, cell_keys(codes), ratings
+
+    def _add(self, keys: np.ndarray, ratings: np.ndarray) -> np.ndarray:
+        """Adds ratings to the cells of the given keys, creating cells as needed.
+
+        Returns
+        ----------
+        np.ndarray
+            The cell of each rating
+        """
+        distinct, inverse = np.unique(keys, return_inverse=True)
+        cells = np.array(
+            [
+                self._cell_index.setdefault(key, len(self._cell_index))
+                for key in distinct.tolist()
+            ],
+            dtype=np.int64,
+        )[inverse.ravel()]
+        grow = len(self._cell_index) - len(self._counts)
+        if grow > 0:
+            self._keys = np.append(self._keys, np.zeros(grow, dtype=np.int64))
+            self._keys[cells] = keys
+            self._counts = np.append(self._counts, np.zeros(grow))
+            self._sums = np.append(self._sums, np.zeros(grow))
+            self._squares = np.append(self._squares, np.zeros(grow))
+            self._codes = {
+                dimension: self._keys >> offset & (1 << bits) - 1
+                for dimension, (offset, bits) in KEY_LAYOUT.items()
+            }
+        self._update(cells, ratings, 1)
+        return cells
+
+    def _update(self, cells: np.ndarray, ratings: np.ndarray, sign: int) -> None:
+        """Adds (sign 1) or removes (sign -1) ratings from their cells."""
+        size = len(self._counts)
+        self._counts += sign * np.bincount(cells, minlength=size)
+        self._sums += sign * np.bincount(cells, ratings, minlength=size)
+        self._squares += sign * np.bincount(cells, ratings**2, minlength=size)
+
+    def rebuild(self) -> None:
+        """Recomputes the cube from every rated title of the analyser scope."""
+        self.version = self._read_version()
+        self._data_version = self._read_data_version()
+        bits, self._genre_masks = {}, {}
+        for genre_id, name in self.analyser.cursor.execute(
+            """SELECT genre_id, TRIM(name) FROM genres ORDER BY genre_id"""
+        ):
+            bit = bits.setdefault(name, len(bits))
+            if bit < MAX_GENRE_BITS:
+                self._genre_masks[genre_id] = 1 << bit
+        self._genre_names = list(bits)[:MAX_GENRE_BITS]
+        self._genre_sets, self._genre_set_names, self._types = {}, [], {}
+        self._set_masks = np.empty(0, dtype=np.int64)
+        self._cell_index, self._codes = {}, {}
+        self._keys = np.empty(0, dtype=np.int64)
+        self._counts, self._sums, self._squares = np.empty(0), np.empty(0), np.empty(0)
+        with tracked(self.analyser.memory_budget, "rating_cube.rebuild", "chunked"):
+            self._ids, keys, self._ratings = self._read_titles()
+            self._cells = self._add(keys, self._ratings)
+
+    def refresh(self) -> int:
+        """Moves the titles changed since the last refresh to their new cells.
+
+        Returns
+        ----------
+        int
+            The number of changes processed, 0 without a change log
+        """
+        version = self._read_version()
+        if version is None:
+            if self._read_data_version() != self._data_version:
+                self.rebuild()
+            return 0
+        changes = self.analyser.cursor.execute(
+            f"""SELECT table_name, key, op FROM changes WHERE version > ?
+            AND table_name IN ({','.join('?' * len(SOURCE_TABLES))})""",
+            (self.version, *SOURCE_TABLES),
+        ).fetchall()
+        self.version = version
+        if not changes:
+            return 0
+        # deleted titles cannot be found from their IMDb id any more
+        if any(
+            op == "load"
+            or table == "genres"
+            or (table, op) == ("imdb_ratings", "delete")
+            for table, _, op in changes
+        ):
+            self.rebuild()
+            return len(changes)
+
+        consts, changed = set(), set()
+        for table, key, _ in changes:
+            if table == "movie_genres":
+                changed.add(int(key.split(":")[0]))
+            else:
+                consts.add(key.split(":")[-1])
+        changed.update(
+            row[0]
+            for const in consts
+            for row in self.analyser.cursor.execute(
+                """SELECT id FROM main.imdb_ratings WHERE const = ?""", (const,)
+            )
+        )
+        stale = np.isin(self._ids, np.array(list(changed), dtype=np.int64))
+        self._update(self._cells[stale], self._ratings[stale], -1)
+        ids, keys, ratings = self._read_titles(sorted(changed))
+        ids = np.concatenate([self._ids[~stale], ids])
+        cells = np.concatenate([self._cells[~stale], self._add(keys, ratings)])
+        ratings = np.concatenate([self._ratings[~stale], ratings])
+        order = np.argsort(ids, kind="stable")
+        self._ids, self._cells, self._ratings = ids[order], cells[order], ratings[order]
+        return len(changes)
+
+    def _select(self, genres, exact_genres, decades, title_types, bands) -> np.ndarray:
+        """Returns whether each cell is in the slice, see aggregate."""
+        selected = self._counts > 0
+        if genres is not None:
+            names = {genre.strip() for genre in genres}
+            if names - set(self._genre_names):
+                return np.zeros_like(selected)
+            mask = sum(1 << self._genre_names.index(name) for name in names)
+            if exact_genres:
+                matching = self._set_masks == mask
+            else:
+                matching = (self._set_masks & mask) == mask
+            selected &= matching[self._codes["genres"]]
+        if decades is not None:
+            codes = [decade_code(decade) for decade in decades]
+            selected &= np.isin(self._codes["decade"], codes)
+        if title_types is not None:
+            codes = [self._types.get(kind, -1) for kind in title_types]
+            selected &= np.isin(self._codes["title_type"], codes)
+        if bands is not None:
+            unknown = set(bands) - set(RATING_BANDS)
+            if unknown:
+                raise ValueError(f"bands must be among {', '.join(RATING_BANDS)}")
+            codes = [list(RATING_BANDS).index(band) for band in bands]
+            selected &= np.isin(self._codes["band"], codes)
+        return selected
+
+    def aggregate(
+        self,
+        by: list = (),
+        genres: list = None,
+        exact_genres: bool = False,
+        decades: list = None,
+        title_types: list = None,
+        bands: list = None,
+    ) -> list:
+        """Slices the cube and rolls it up to the given dimensions.
+
+        Parameters
+        ----------
+        by : list
+            The dimensions to keep, among genres, decade, title_type and band. The others are
+            rolled up. Everything is rolled up into a single cell if empty
+        genres : list
+            The genres the titles must all have, whatever their other genres unless exact_genres
+        exact_genres : bool
+            If True, the titles must have exactly the given genres
+        decades : list
+            The release decades to keep, e.g. [1990], UNKNOWN_DECADE for titles without a year
+        title_types : list
+            The title types to keep, e.g. ["tvSeries", "tvMiniSeries"]
+        bands : list
+            The rating bands to keep, among the keys of RATING_BANDS
+
+        Returns
+        ----------
+        list[CubeCell]
+            One aggregate per combination of the kept dimensions, sorted by their values
+        """
+        if set(by) - set(DIMENSIONS):
+            raise ValueError(f"dimensions must be among {', '.join(DIMENSIONS)}")
+        if not len(self._counts):
+            return []
+        selected = self._select(genres, exact_genres, decades, title_types, bands)
+
+        # the kept codes of each selected cell, as one mixed-radix group number
+        groups = np.zeros(np.count_nonzero(selected), dtype=np.int64)
+        lowest, radices = [], []
+        for dimension in by:
+            codes = self._codes[dimension][selected]
+            lowest.append(int(codes.min()) if len(codes) else 0)
+            radices.append(int(codes.max()) - lowest[-1] + 1 if len(codes) else 1)
+            groups = groups * radices[-1] + codes - lowest[-1]
+        weights = [
+            self._counts[selected],
+            self._sums[selected],
+            self._squares[selected],
+        ]
+        if np.prod(radices, dtype=np.float64) <= MAX_DENSE_GROUPS_PER_CELL * len(
+            groups
+        ):
+            totals = [np.bincount(groups, w, minlength=1) for w in weights]
+            distinct = np.flatnonzero(totals[0])
+            totals = [total[distinct] for total in totals]
+        else:
+            distinct, inverse = np.unique(groups, return_inverse=True)
+            totals = [np.bincount(inverse.ravel(), w) for w in weights]
+
+        counts, sums, squares = totals
+        means = sums / counts
+        stds = np.sqrt(np.maximum(squares / counts - means**2, 0.0))
+        # each kept dimension decoded for every group, the rolled up ones being None
+        values = dict.fromkeys(DIMENSIONS, [None] * len(distinct))
+        for dimension, low, radix in zip(reversed(by), lowest[::-1], radices[::-1]):
+            distinct, codes = np.divmod(distinct, radix)
+            values[dimension] = (codes + low).tolist()
+        decoded = {
+            "genres": self._genre_set_names,
+            "title_type": list(self._types),
+            "band": list(RATING_BANDS),
+        }
+        for dimension, table in decoded.items():
+            if dimension in by:
+                values[dimension] = [table[code] for code in values[dimension]]
+        if "decade" in by:
+            values["decade"] = [
+                (code - 1) * 10 if code else UNKNOWN_DECADE for code in values["decade"]
+            ]
+        cells = list(
+            map(
+                CubeCell,
+                *(values[dimension] for dimension in DIMENSIONS),
+                np.rint(counts).astype(np.int64).tolist(),
+                means.tolist(),
+                stds.tolist(),
+            )
+        )
+        # codes follow the order titles were read in, not the order of the values
+        return sorted(
+            cells, key=lambda cell: [getattr(cell, dimension) for dimension in by]
+        )
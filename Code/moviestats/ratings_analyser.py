@@ -1,24 +1,91 @@
 """This module provides functions to analyze IMDb ratings data.
 """
 
+from pathlib import Path
 from sqlite3 import connect
+from Code.moviestats.records import (
+    NameRating,
+    NameStats,
+    RatingDifference,
+    TitleGenres,
+    TitleRating,
+    TitleRatings,
+)
 
 
 POSITIVE_INT_ERR_MESSAGE = "top_n must be a positive integer"
+# shadows imdb_ratings with the titles rated by one user, carrying that user's ratings
+USER_SCOPE = """WITH imdb_ratings AS (
+    SELECT t.id, t.const, u.your_rating, u.date_rated, t.title, t.url, t.title_type,
+    t.imdb_rating, t.runtime_mins, t.year, t.genres, t.num_votes, t.release_date,
+    t.directors, t.cast, u.date_rated_epoch, t.release_date_epoch
+    FROM user_ratings u JOIN main.imdb_ratings t ON t.const = u.const
+    WHERE u.user_id = {user_id}
+) """
 
 
 class RatingsAnalyser:
-    """A class to analyse IMDb ratings data."""
-
-    def __init__(self, db_name: str = "data/imdb_ratings.db"):
-        self.conn = connect(db_name)
+    """A class to analyse IMDb ratings data.
+
+    Without a user, the ratings stored in imdb_ratings are analysed. With a user, every query
+    is scoped to the ratings of that profile (see db_functions.populate_user_ratings).
+    """
+
+    def __init__(
+        self,
+        db_name: str = "data/imdb_ratings.db",
+        read_only: bool = False,
+        user: str = None,
+        diagnostics=None,
+        memory_budget=None,
+    ):
+        self.db_name = db_name
+        self.user = user
+        # an optional diagnostics.QueryDiagnostics profiling every query
+        self.diagnostics = diagnostics
+        # an optional memory.MemoryBudget of the analytics processing rows in Python
+        self.memory_budget = memory_budget
+        if read_only:
+            # read-only connections may be handed over to worker threads
+            self.conn = connect(
+                f"{Path(db_name).resolve().as_uri()}?mode=ro",
+                uri=True,
+                check_same_thread=False,
+            )
+        else:
+            self.conn = connect(db_name)
         self.cursor = self.conn.cursor()
+        self._scope = ""
+        self._cube = None
+        if user is not None:
+            row = self.cursor.execute(
+                """SELECT user_id FROM users WHERE name = ?""", (user,)
+            ).fetchone()
+            if row is None:
+                raise ValueError(f"unknown user: {user}")
+            self._scope = USER_SCOPE.format(user_id=int(row[0]))
 
     def __del__(self):
         self.conn.close()
 
     def __len__(self) -> int:
-        return self.cursor.execute("SELECT COUNT(*) FROM imdb_ratings").fetchone()[0]
+        return self._execute("SELECT COUNT(*) FROM imdb_ratings").fetchone()[0]
+
+    def _execute(self, query: str, params: tuple = ()):
+        """Runs a query within the scope of the user, if any, and returns the cursor.
+
+        The scope is a CTE named imdb_ratings, so queries refer to imdb_ratings whether they are
+        scoped or not. It is inlined by sqlite and reads the user_ratings partition of the user
+        through its primary key. With diagnostics, the query is profiled and its rows are fetched
+        at once.
+        """
+        if self.diagnostics is not None:
+            return self.diagnostics.execute(self.cursor, self._scope + query, params)
+        return self.cursor.execute(self._scope + query, params)
+
+    def _fetch(self, record_type: type, query: str, params: tuple = ()) -> list:
+        """Runs a query and wraps each of its rows into a record of the given type."""
+        return list(map(record_type._make, self._execute(query, params)))
 
     def get_top_ratings(self, top_n: int = 10) -> list:
         """Gets the top_n personally highest-rated movies
@@ -30,28 +97,30 @@ class RatingsAnalyser:
 
         Returns
         ----------
-        list
+        list[TitleRating]
             The top_n movies
         """
         if top_n < 1:
             raise ValueError(POSITIVE_INT_ERR_MESSAGE)
-        return self.cursor.execute(
+        return self._fetch(
+            TitleRating,
             f"""SELECT title, your_rating FROM imdb_ratings 
-            ORDER BY your_rating DESC LIMIT {top_n}"""
-        ).fetchall()
+            ORDER BY your_rating DESC LIMIT {top_n}""",
+        )
 
     def get_movies_per_rating(self) -> list:
         """Gets the list of movies and/or TV shows for each rating.
 
         Returns
         ----------
-        list
+        list[TitleRating]
             The list of movies and/or TV shows for each rating
         """
-        return self.cursor.execute(
+        return self._fetch(
+            TitleRating,
             """SELECT title, your_rating FROM imdb_ratings 
-            GROUP BY your_rating ORDER BY your_rating DESC"""
-        ).fetchall()
+            GROUP BY your_rating ORDER BY your_rating DESC""",
+        )
 
     def get_total_movie_watching_time(self, days: bool = False) -> float:
         """Get the total watching time in hours/days. Filter is done on movies only.
@@ -66,11 +135,11 @@ class RatingsAnalyser:
         float
             The total watching time
         """
-        movies = self.cursor.execute(
-            """SELECT runtime_mins FROM imdb_ratings 
+        # TOTAL ignores NULL runtimes and returns 0.0 when there is no movie
+        total_time = self._execute(
+            """SELECT TOTAL(runtime_mins) FROM imdb_ratings
             WHERE title_type = 'movie' """
-        ).fetchall()
-        total_time = sum(movie[0] for movie in movies)
+        ).fetchone()[0]
         return total_time / 60 / (24 if days else 1)
 
     def get_ratings(self) -> list:
@@ -78,24 +147,26 @@ class RatingsAnalyser:
 
         Returns
         ----------
-        list
+        list[TitleRatings]
             The list of ratings
         """
-        return self.cursor.execute(
-            """SELECT title, your_rating, imdb_rating FROM imdb_ratings"""
-        ).fetchall()
+        return self._fetch(
+            TitleRatings,
+            """SELECT title, your_rating, imdb_rating FROM imdb_ratings""",
+        )
 
     def get_rating_differences(self) -> list:
         """Calculates the differences between personal ratings and IMDb ratings.
 
         Returns
         ----------
-        list
+        list[RatingDifference]
             The list of rating differences
         """
-        return self.cursor.execute(
-            """SELECT title, your_rating - imdb_rating FROM imdb_ratings"""
-        ).fetchall()
+        return self._fetch(
+            RatingDifference,
+            """SELECT title, your_rating - imdb_rating FROM imdb_ratings""",
+        )
 
     def get_mean_rating(self) -> float:
         """Computes the mean rating across the entire dataset.
@@ -105,7 +176,7 @@ class RatingsAnalyser:
         float
             The mean rating
         """
-        return self.cursor.execute(
+        return self._execute(
             """SELECT AVG(your_rating) FROM imdb_ratings"""
         ).fetchone()[0]
 
@@ -114,15 +185,16 @@ class RatingsAnalyser:
 
         Returns
         ----------
-        list
+        list[NameRating]
             The average rating for each genre
         """
-        return self.cursor.execute(
+        return self._fetch(
+            NameRating,
             """SELECT TRIM(genres.name), AVG(ratings.your_rating) FROM imdb_ratings AS ratings
             JOIN movie_genres ON ratings.id = movie_genres.movie_id
             JOIN genres ON movie_genres.genre_id = genres.genre_id
-            GROUP BY TRIM(genres.name) ORDER BY AVG(ratings.your_rating) DESC"""
-        ).fetchall()
+            GROUP BY TRIM(genres.name) ORDER BY AVG(ratings.your_rating) DESC""",
+        )
 
     def get_title_genre_ratings(self, is_movie: bool = True) -> list:
         """Gets the mean personal rating and list of corresponding genres for each movie or TV show
@@ -134,7 +206,7 @@ class RatingsAnalyser:
 
         Returns
         ----------
-        list
+        list[TitleGenres]
             The mean rating and list of genres for each movie or TV show
         """
         type_filter = (
@@ -142,14 +214,35 @@ class RatingsAnalyser:
             if is_movie
             else "(title_type='tvSeries' OR title_type='tvMiniSeries')"
         )
-        return self.cursor.execute(
+        return self._fetch(
+            TitleGenres,
             f"""SELECT title, GROUP_CONCAT(genres.name), your_rating FROM imdb_ratings AS ratings
             JOIN movie_genres ON ratings.id = movie_genres.movie_id
             JOIN genres ON movie_genres.genre_id = genres.genre_id
-            WHERE {type_filter} GROUP BY title ORDER BY title"""
-        ).fetchall()
+            WHERE {type_filter} GROUP BY title ORDER BY title""",
+        )
+
+    def get_rating_cube(self):
+        """Gets the rating cube of the analysed ratings, built on first use.
+
+        The cube is kept with the analyser and refreshed from the change log on every call, so
+        that only the titles changed since the previous call are read again.
+
+        Returns
+        ----------
+        RatingCube
+            The counts, sums and sums of squares of the ratings by genres, decade, type and band
+        """
+        # numpy is only imported by the commands that need the cube
+        from Code.moviestats.rating_cube import RatingCube
+
+        if self._cube is None:
+            self._cube = RatingCube(self)
+        else:
+            self._cube.refresh()
+        return self._cube
 
-    def get_mean_rating_for_highest_directors(self, top_n: int = 10):
+    def get_mean_rating_for_highest_directors(self, top_n: int = 10) -> list:
         """Gets the mean personal rating for the top_n highest-rated directors
 
         Parameters
@@ -159,19 +252,20 @@ class RatingsAnalyser:
 
         Returns
         ----------
-        list
+        list[NameRating]
             The mean rating for each director
         """
         if top_n < 1:
             raise ValueError(POSITIVE_INT_ERR_MESSAGE)
-        return self.cursor.execute(
+        return self._fetch(
+            NameRating,
             f"""SELECT directors.name, AVG(ratings.your_rating) FROM imdb_ratings AS ratings
             JOIN movie_directors ON ratings.id = movie_directors.movie_id
             JOIN directors ON movie_directors.director_id = directors.director_id
-            GROUP BY directors.name ORDER BY AVG(your_rating) DESC LIMIT {top_n}"""
-        ).fetchall()
+            GROUP BY directors.name ORDER BY AVG(your_rating) DESC LIMIT {top_n}""",
+        )
 
-    def get_stats_for_most_frequent_directors(self, top_n: int = 10):
+    def get_stats_for_most_frequent_directors(self, top_n: int = 10) -> list:
         """Gets the mean personal rating and count for the top_n directors with the most rated movies
 
         Parameters
@@ -181,18 +275,19 @@ class RatingsAnalyser:
 
         Returns
         ----------
-        list
+        list[NameStats]
             The mean rating for each director
         """
         if top_n < 1:
             raise ValueError(POSITIVE_INT_ERR_MESSAGE)
-        return self.cursor.execute(
+        return self._fetch(
+            NameStats,
             f"""SELECT directors.name, COUNT(ratings.id), AVG(ratings.your_rating)
             FROM imdb_ratings AS ratings
             JOIN movie_directors ON ratings.id = movie_directors.movie_id
             JOIN directors ON movie_directors.director_id = directors.director_id
-            GROUP BY directors.name ORDER BY COUNT(ratings.id) DESC LIMIT {top_n}"""
-        ).fetchall()
+            GROUP BY directors.name ORDER BY COUNT(ratings.id) DESC LIMIT {top_n}""",
+        )
 
     def get_mean_rating_for_highest_actors(self, top_n: int = 10) -> list:
         """Gets the mean personal rating for the top_n highest-rated actors
@@ -204,17 +299,18 @@ class RatingsAnalyser:
 
         Returns
         ----------
-        list
+        list[NameRating]
             The mean rating for each actor
         """
         if top_n < 1:
             raise ValueError(POSITIVE_INT_ERR_MESSAGE)
-        return self.cursor.execute(
+        return self._fetch(
+            NameRating,
             f"""SELECT actors.name, AVG(ratings.your_rating) FROM imdb_ratings AS ratings
             JOIN movie_actors ON ratings.id = movie_actors.movie_id
             JOIN actors ON movie_actors.actor_id = actors.actor_id
-            GROUP BY actors.name ORDER BY AVG(your_rating) DESC LIMIT {top_n}"""
-        ).fetchall()
+            GROUP BY actors.name ORDER BY AVG(your_rating) DESC LIMIT {top_n}""",
+        )
 
     def get_stats_for_most_frequent_actors(self, top_n: int = 10) -> list:
         """Gets the mean personal rating and count for the top_n actors with the most rated movies
@@ -226,18 +322,19 @@ class RatingsAnalyser:
 
         Returns
         ----------
-        list
+        list[NameStats]
             The mean rating and movie count for each actor
         """
         if top_n < 1:
             raise ValueError(POSITIVE_INT_ERR_MESSAGE)
-        return self.cursor.execute(
+        return self._fetch(
+            NameStats,
             f"""SELECT actors.name, COUNT(ratings.id), AVG(ratings.your_rating)
             FROM imdb_ratings AS ratings
             JOIN movie_actors ON ratings.id = movie_actors.movie_id
             JOIN actors ON movie_actors.actor_id = actors.actor_id
-            GROUP BY actors.name ORDER BY COUNT(ratings.id) DESC LIMIT {top_n}"""
-        ).fetchall()
+            GROUP BY actors.name ORDER BY COUNT(ratings.id) DESC LIMIT {top_n}""",
+        )
 
     def get_movie_list_for(self, actor_name: str) -> list:
         """Gets the list of movies and/or TV shows for a given actor.
@@ -249,13 +346,39 @@ class RatingsAnalyser:
 
         Returns
         ----------
-        list
+        list[TitleRating]
             The list of movies and/or TV shows for the actor
         """
-        return self.cursor.execute(
+        return self._fetch(
+            TitleRating,
             """SELECT title, your_rating FROM imdb_ratings
             JOIN movie_actors ON imdb_ratings.id = movie_actors.movie_id
             JOIN actors ON movie_actors.actor_id = actors.actor_id
             WHERE actors.name = ?""",
             (actor_name,),
-        ).fetchall()
+        )
+
+    def run_report(
+        self, queries: dict, max_workers: int = 4, timeout: float = None
+    ) -> list:
+        """Runs several analyser queries concurrently on read-only connections to the database.
+
+        Parameters
+        ----------
+        queries : dict
+            Maps each report entry name to a function taking a RatingsAnalyser
+        max_workers : int
+            The number of connections, and thus of queries running at the same time
+        timeout : float
+            The number of seconds after which unfinished queries are cancelled
+
+        Returns
+        ----------
+        list
+            One ReportEntry per query, in the order of queries
+        """
+        from Code.moviestats.report import run_report
+
+        return run_report(
+            self.db_name, queries, max_workers, timeout, self.user, self.diagnostics
+        )
@@ -0,0 +1,286 @@
+"""This module reads IMDb ratings exports with an explicit schema, in bounded memory.
+
+The export is streamed in chunks of CHUNK_SIZE rows, parsed either by the C parser of pandas or
+by the multithreaded parser of pyarrow. Every column is first read as text, then converted to the
+type of RATINGS_SCHEMA: nullable integers, dates, categoricals for the repetitive text columns.
+Both engines therefore give the same frames, and every value that does not fit the schema is
+reported with its record number (see validate_ratings) before anything is written to a database.
+Records are numbered from the header, which is record 1. They match line numbers unless a quoted
+field, such as a title, holds a line break, which neither parser reports.
+"""
+
+from typing import NamedTuple
+
+import pandas as pd
+
+
+# column -> type of its values, "date" being a datetime64 column parsed from YYYY-MM-DD
+RATINGS_SCHEMA = {
+    "Const": "string",
+    "Your Rating": "Int8",
+    "Date Rated": "date",
+    "Title": "string",
+    "Original Title": "string",
+    "URL": "string",
+    "Title Type": "category",
+    "IMDb Rating": "float64",
+    "Runtime (mins)": "Int32",
+    "Year": "Int16",
+    "Genres": "category",
+    "Num Votes": "Int64",
+    "Release Date": "date",
+    "Directors": "category",
+}
+OPTIONAL_COLUMNS = {"Original Title"}  # only in recent exports
+REQUIRED_VALUES = ["Const", "Title"]
+# column -> smallest and largest valid values, None if unbounded
+VALUE_RANGES = {
+    "Your Rating": (1, 10),
+    "IMDb Rating": (0, 10),
+    "Runtime (mins)": (0, None),
+    "Year": (1800, 9999),
+    "Num Votes": (0, None),
+}
+CONST_PATTERN = r"tt(\d{7}|[1-9]\d{7,})"  # as printed by storage.GENERATED_COLUMNS
+CHUNK_SIZE = 50_000
+ENGINES = ["c", "pyarrow"]
+BYTES_PER_ROW = 160  # rough size of an exported row, to size the blocks of pyarrow
+MAX_REPORTED_ERRORS = 20
+
+
+class RowError(NamedTuple):
+    """A value of the export that does not fit the schema."""
+
+    record: int  # 1 is the header, see the module docstring
+    column: str
+    value: str
+    message: str
+
+
+def read_header(csv_ratings: str) -> list:
+    """Returns the columns of an export that are in RATINGS_SCHEMA, checking none is missing."""
+    header = list(pd.read_csv(csv_ratings, nrows=0).columns)
+    missing = set(RATINGS_SCHEMA) - OPTIONAL_COLUMNS - set(header)
+    if missing:
+        raise ValueError(
+            f"{csv_ratings} is missing the columns {', '.join(sorted(missing))}"
+        )
+    return [column for column in header if column in RATINGS_SCHEMA]
+
+
+def iter_text_chunks(csv_ratings: str, chunksize: int = CHUNK_SIZE, engine: str = "c"):
+    """Streams an export as frames of text columns, empty fields being missing values.
+
+    Only empty fields are missing: a title such as "NA" or "None" is kept as is.
+
+    Yields
+    ----------
+    pd.DataFrame
+        The next rows, indexed by their record number in the file
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"engine must be one of {', '.join(ENGINES)}")
+    if chunksize < 1:
+        raise ValueError("chunksize must be a positive integer")
+    columns = read_header(csv_ratings)
+    record = 2
+    if engine == "pyarrow":
+        import pyarrow as pa
+        from pyarrow import csv
+
+        chunks = (
+            batch.to_pandas()
+            for batch in csv.open_csv(
+                csv_ratings,
+                read_options=csv.ReadOptions(block_size=chunksize * BYTES_PER_ROW),
+                convert_options=csv.ConvertOptions(
+                    include_columns=columns,
+                    column_types={column: pa.string() for column in columns},
+                    null_values=[""],
+                    strings_can_be_null=True,
+                ),
+            )
+        )
+    else:
+        chunks = pd.read_csv(
+            csv_ratings,
+            usecols=columns,
+            dtype=str,
+            keep_default_na=False,
+            na_values=[""],
+            chunksize=chunksize,
+        )
+    for chunk in chunks:
+        chunk.index = pd.RangeIndex(record, record + len(chunk))
+        record += len(chunk)
+        yield chunk
+
+
+def convert_chunk(text: pd.DataFrame) -> tuple:
+    """Converts a frame of text columns to the types of RATINGS_SCHEMA.
+
+    Parameters
+    ----------
+    text : pd.DataFrame
+        Rows of the export read as text, indexed by record number, see iter_text_chunks
+
+    Returns
+    ----------
+    tuple
+        The typed frame, in which invalid values are missing, and the list of RowError
+    """
+    typed, errors = {}, []
+
+    def report(invalid: pd.Series, column: str, message: str) -> None:
+        errors.extend(
+            RowError(record, column, None if pd.isna(value) else value, message)
+            for record, value in text[column][invalid].items()
+        )
+
+    for column in text.columns:
+        values = text[column]
+        kind = RATINGS_SCHEMA[column]
+        if kind == "date":
+            dates = pd.to_datetime(values, format="%Y-%m-%d", errors="coerce")
+            report(values.notna() & dates.isna(), column, "not a YYYY-MM-DD date")
+            typed[column] = dates
+        elif kind in ("string", "category"):
+            typed[column] = values.astype(kind)
+        else:
+            try:
+                numbers = values.astype("float64")
+            except ValueError:  # only chunks with invalid values take the slower path
+                numbers = pd.to_numeric(values.str.strip(), errors="coerce")
+            invalid = values.notna() & numbers.isna()
+            if kind != "float64":
+                invalid |= numbers.notna() & (numbers % 1 != 0)
+            report(
+                invalid,
+                column,
+                "not a number" if kind == "float64" else "not an integer",
+            )
+            lowest, highest = VALUE_RANGES.get(column, (None, None))
+            out_of_range = pd.Series(False, index=values.index)
+            if lowest is not None:
+                out_of_range |= numbers < lowest
+            if highest is not None:
+                out_of_range |= numbers > highest
+            out_of_range &= ~invalid
+            report(out_of_range, column, f"not between {lowest} and {highest}")
+            typed[column] = numbers.mask(invalid | out_of_range).astype(kind)
+
+    for column in REQUIRED_VALUES:
+        report(text[column].isna(), column, "missing")
+    consts = text["Const"]
+    report(
+        consts.notna() & ~consts.str.fullmatch(CONST_PATTERN).fillna(False),
+        "Const",
+        "not an IMDb id such as tt0111161",
+    )
+    errors.sort(key=lambda error: error.record)
+    return pd.DataFrame(typed, index=text.index), errors
+
+
+def validate_ratings(
+    csv_ratings: str, chunksize: int = CHUNK_SIZE, engine: str = "c"
+) -> list:
+    """Checks every row of an export against RATINGS_SCHEMA, in bounded memory.
+
+    Parameters
+    ----------
+    csv_ratings : str
+        The filepath of the export
+    chunksize : int
+        The number of rows parsed at once
+    engine : str
+        c or pyarrow
+
+    Returns
+    ----------
+    list[RowError]
+        The invalid values, by record number. Empty if the export is valid
+    """
+    errors = []
+    for text in iter_text_chunks(csv_ratings, chunksize, engine):
+        errors.extend(convert_chunk(text)[1])
+    return errors
+
+
+def format_errors(csv_ratings: str, errors: list) -> str:
+    """Describes the first MAX_REPORTED_ERRORS invalid values of an export."""
+    lines = [
+        f"record {error.record}, {error.column} {error.value!r}: {error.message}"
+        for error in errors[:MAX_REPORTED_ERRORS]
+    ]
+    if len(errors) > MAX_REPORTED_ERRORS:
+        lines.append(f"... and {len(errors) - MAX_REPORTED_ERRORS} more")
+    return f"{len(errors)} invalid values in {csv_ratings}:\n" + "\n".join(lines)
+
+
+def iter_ratings_chunks(
+    csv_ratings: str,
+    chunksize: int = CHUNK_SIZE,
+    engine: str = "c",
+    validate: bool = True,
+):
+    """Streams an export as typed frames.
+
+    Parameters
+    ----------
+    csv_ratings : str
+        The filepath of the export
+    chunksize : int
+        The number of rows parsed at once
+    engine : str
+        c or pyarrow
+    validate : bool
+        If True, the whole export is validated before the first frame is yielded, and a
+        ValueError lists its invalid values. Otherwise, invalid values are missing
+
+    Yields
+    ----------
+    pd.DataFrame
+        The next rows, typed as in RATINGS_SCHEMA and indexed by record number
+    """
+    if validate:
+        errors = validate_ratings(csv_ratings, chunksize, engine)
+        if errors:
+            raise ValueError(format_errors(csv_ratings, errors))
+    for text in iter_text_chunks(csv_ratings, chunksize, engine):
+        yield convert_chunk(text)[0]
+
+
+def read_ratings(csv_ratings: str, engine: str = "c") -> pd.DataFrame:
+    """Reads a whole export as a typed frame, raising a ValueError if it has invalid values."""
+    frames, errors = [], []
+    for text in iter_text_chunks(csv_ratings, CHUNK_SIZE, engine):
+        frame, chunk_errors = convert_chunk(text)
+        frames.append(frame)
+        errors.extend(chunk_errors)
+    if errors:
+        raise ValueError(format_errors(csv_ratings, errors))
+    ratings = pd.concat(frames)
+    # the categories of the chunks differ, so that concatenating them gives plain objects
+    for column, kind in RATINGS_SCHEMA.items():
+        if kind == "category" and column in ratings:
+            ratings[column] = ratings[column].astype("category")
+    return ratings
+
+
+def ratings_records(ratings: pd.DataFrame) -> list:
+    """Converts typed ratings to rows of Python values that sqlite and MySQL can bind.
+
+    Missing values become None and dates become YYYY-MM-DD strings, as stored in the database.
+
+    Returns
+    ----------
+    list[dict]
+        One dict per row, keyed by the columns of the export
+    """
+    columns = {}
+    for column, values in ratings.items():
+        if RATINGS_SCHEMA.get(column) == "date":
+            values = values.dt.strftime("%Y-%m-%d")
+        values = values.astype(object)
+        columns[column] = values.where(values.notna(), None).tolist()
+    return [dict(zip(columns, row)) for row in zip(*columns.values())]
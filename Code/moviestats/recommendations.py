@@ -1,34 +1,37 @@
 """A module to provide simple movie recommendations based on IMDb ratings data.
 """
 
-from collections import defaultdict
 from Code.moviestats.helpers import compute_weighted_rating
+from Code.moviestats.records import GenreCombination
 from Code.moviestats.ratings_analyser import RatingsAnalyser
 
 
 def get_movie_genre_combination_ratings(analyser: RatingsAnalyser) -> list:
     """Gets useful metrics for each distinct movie genre combination.
 
+    The ratings of each combination are read from the rating cube of the analyser (see
+    rating_cube.py), so that repeated calls only read the titles changed in between.
+
     Parameters
     ----------
     analyser: The RatingsAnalyser object to use
 
     Returns
     ----------
-    The # of times and the average rating for each genre combination
+    The weighted average rating of each genre combination, as GenreCombination records
     """
-    genre_combinations = defaultdict(list)
-
-    for _, genres, rating in analyser.get_title_genre_ratings():
-        genre_combinations[tuple(sorted(genres.split(",")))].append(rating)
-
-    genre_combinations_avg_ratings = {
-        comb: compute_weighted_rating(
-            len(ratings), sum(ratings) / len(ratings), analyser.get_mean_rating()
+    cube = analyser.get_rating_cube()
+    overall = cube.aggregate()
+    if not overall:
+        return []
+    mean_rating = overall[0].mean_rating
+
+    combinations = [
+        GenreCombination(
+            cell.genres,
+            compute_weighted_rating(cell.count, cell.mean_rating, mean_rating),
         )
-        for comb, ratings in genre_combinations.items()
-    }
-
-    return sorted(
-        genre_combinations_avg_ratings.items(), key=lambda x: x[1], reverse=True
-    )
+        for cell in cube.aggregate(by=["genres"], title_types=["movie"])
+        if cell.genres
+    ]
+    return sorted(combinations, key=lambda x: x.weighted_rating, reverse=True)
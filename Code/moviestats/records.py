@@ -0,0 +1,102 @@
+"""This module defines the record types returned by the RatingsAnalyser methods.
+
+Records are NamedTuples: they take no more memory than the plain tuples they replace, can still
+be unpacked and indexed like them, and give every field a name. Large results can be turned into
+one NumPy array per field with to_columns.
+"""
+
+from typing import NamedTuple
+
+
+class TitleRating(NamedTuple):
+    """A title and its personal rating."""
+
+    title: str
+    your_rating: int
+
+
+class TitleRatings(NamedTuple):
+    """A title with its personal and IMDb ratings."""
+
+    title: str
+    your_rating: int
+    imdb_rating: float
+
+
+class RatingDifference(NamedTuple):
+    """A title and the difference between its personal and IMDb ratings."""
+
+    title: str
+    difference: float
+
+
+class TitleGenres(NamedTuple):
+    """A title, its comma-separated genres and its personal rating."""
+
+    title: str
+    genres: str
+    your_rating: int
+
+
+class NameRating(NamedTuple):
+    """A genre or person and the mean personal rating of their titles."""
+
+    name: str
+    average_rating: float
+
+
+class NameStats(NamedTuple):
+    """A person, their number of rated titles and the mean personal rating of these titles."""
+
+    name: str
+    count: int
+    average_rating: float
+
+
+class GenreCombination(NamedTuple):
+    """A sorted combination of genres and its weighted mean personal rating."""
+
+    genres: tuple
+    weighted_rating: float
+
+
+def to_columns(records: list, record_type: type = None) -> dict:
+    """Converts a list of records into one NumPy array per field.
+
+    The rows are transposed with zip, so no per-row attribute access happens in Python.
+    Numeric fields become float or int arrays (float when they contain NULLs, stored as NaN),
+    other fields become object arrays.
+
+    Parameters
+    ----------
+    records : list
+        The records to convert, all of the same type
+    record_type : type
+        The type of the records. Required when records is empty
+
+    Returns
+    ----------
+    dict
+        Maps each field name to the array of its values
+    """
+    import numpy as np
+
+    record_type = record_type or type(records[0])
+    columns = zip(*records) if records else [()] * len(record_type._fields)
+    arrays = {}
+    for field, values in zip(record_type._fields, columns):
+        field_type = record_type.__annotations__[field]
+        if field_type is int and None not in values:
+            arrays[field] = np.array(values, dtype=np.int64)
+        elif field_type in (int, float):
+            arrays[field] = np.array(values, dtype=np.float64)
+        else:
+            arrays[field] = np.fromiter(values, dtype=object, count=len(values))
+    return arrays
+
+
+class TimeSeries(NamedTuple):
+    """Values aggregated per calendar period, as parallel NumPy arrays."""
+
+    periods: object  # numpy datetime64 array, one entry per period
+    values: object  # numpy float array
@@ -0,0 +1,117 @@
+"""This module keeps read replicas of the ratings database for analytics during ingestion.
+
+The working database is in WAL mode and ingestion commits its titles in batches, so readers of
+the working database see the last committed batch and never wait for the writer. For a full
+isolation from the writer (and from its checkpoints), a replica is a consistent copy of the
+working database made with the sqlite online backup API in a single read transaction. It is
+written to a temporary file that atomically replaces the replica, so a reader opening the
+replica always gets a complete snapshot, and a reader that has it open keeps its snapshot until
+it reopens the file.
+
+The identity of the replica file changes with every swap, which is how the API server notices
+that it must reopen its connections (see file_identity).
+"""
+
+import os
+import threading
+from pathlib import Path
+from sqlite3 import connect
+from time import perf_counter
+
+
+REFRESH_INTERVAL = 60.0  # seconds between two replica refreshes during an ingestion
+
+
+def file_identity(path: str) -> tuple:
+    """Returns the device and inode of a file, which change when the file is replaced."""
+    stat = os.stat(path)
+    return stat.st_dev, stat.st_ino
+
+
+def create_replica(db_name: str, replica_name: str) -> float:
+    """Copies a consistent snapshot of a database and atomically swaps it in as the replica.
+
+    Parameters
+    ----------
+    db_name : str
+        The name of the working database
+    replica_name : str
+        The name of the replica to create or replace
+
+    Returns
+    ----------
+    float
+        The time taken by the copy, in seconds
+    """
+    start = perf_counter()
+    replica = Path(replica_name).resolve()
+    temporary = replica.with_name(f".{replica.name}.{os.getpid()}.tmp")
+    temporary.unlink(missing_ok=True)
+    source = connect(db_name)
+    target = connect(temporary)
+    try:
+        # a single step copies every page within one read transaction: a consistent snapshot
+        source.backup(target)
+        # the replica is read-only and has no writer to run concurrently with
+        target.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        target.close()
+        source.close()
+    os.replace(temporary, replica)
+    return perf_counter() - start
+
+
+class ReplicaRefresher:
+    """Refreshes a replica periodically from a background thread, e.g. during an ingestion.
+
+    Used as a context manager, it creates the replica on entry and refreshes it a last time on
+    exit, so that the replica ends up identical to the working database.
+
+    Parameters
+    ----------
+    db_name : str
+        The name of the working database
+    replica_name : str
+        The name of the replica
+    interval : float
+        The number of seconds between two refreshes
+    """
+
+    def __init__(
+        self, db_name: str, replica_name: str, interval: float = REFRESH_INTERVAL
+    ):
+        if interval <= 0:
+            raise ValueError("interval must be positive")
+        self.db_name = db_name
+        self.replica_name = replica_name
+        self.interval = interval
+        self.refreshes = 0
+        self.error = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="replica-refresher", daemon=True
+        )
+
+    def refresh(self) -> float:
+        """Refreshes the replica now and returns the time taken, in seconds."""
+        elapsed = create_replica(self.db_name, self.replica_name)
+        self.refreshes += 1
+        return elapsed
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.refresh()
+            except Exception as e:  # pylint: disable=broad-except
+                self.error = e  # kept for the caller, the next refresh may succeed
+
+    def __enter__(self) -> "ReplicaRefresher":
+        self.refresh()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stop.set()
+        self._thread.join()
+        if exc_info[0] is None:
+            self.refresh()
@@ -0,0 +1,178 @@
+"""This module runs independent RatingsAnalyser queries concurrently.
+
+Each worker thread owns a read-only sqlite connection to the database. sqlite releases the GIL
+while a statement runs, so the wall time of a report gets close to that of its slowest query
+instead of the sum of all of them.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from sqlite3 import OperationalError
+from time import perf_counter
+from typing import NamedTuple
+
+from Code.moviestats.ratings_analyser import RatingsAnalyser
+
+
+DEFAULT_REPORT = {
+    "top_ratings": lambda a: a.get_top_ratings(10),
+    "average_rating_by_genre": lambda a: a.get_average_rating_by_genre(),
+    "highest_directors": lambda a: a.get_mean_rating_for_highest_directors(10),
+    "most_frequent_directors": lambda a: a.get_stats_for_most_frequent_directors(10),
+    "highest_actors": lambda a: a.get_mean_rating_for_highest_actors(10),
+    "most_frequent_actors": lambda a: a.get_stats_for_most_frequent_actors(10),
+    "rating_differences": lambda a: a.get_rating_differences(),
+    "mean_rating": lambda a: a.get_mean_rating(),
+    "movie_watching_time": lambda a: a.get_total_movie_watching_time(),
+}
+
+
+class ReportEntry(NamedTuple):
+    """The outcome of one report query."""
+
+    name: str
+    result: object
+    elapsed: float
+    error: Exception = None
+    cancelled: bool = False
+
+
+class ReportRunner:
+    """A pool of read-only RatingsAnalyser connections that runs report queries concurrently.
+
+    The pool can be reused for several reports and must be closed once done.
+    """
+
+    def __init__(
+        self,
+        db_name: str,
+        max_workers: int = 4,
+        user: str = None,
+        diagnostics=None,
+    ):
+        if max_workers < 1:
+            raise ValueError("max_workers must be a positive integer")
+        self.db_name = db_name
+        self.user = user
+        self.diagnostics = diagnostics  # shared by the analysers of every worker
+        self._local = threading.local()
+        self._analysers = []
+        self._running = {}  # maps the name of each running query to its analyser
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="report"
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _analyser(self) -> RatingsAnalyser:
+        """Returns the analyser of the calling worker thread, opening it on first use."""
+        if not hasattr(self._local, "analyser"):
+            self._local.analyser = RatingsAnalyser(
+                self.db_name,
+                read_only=True,
+                user=self.user,
+                diagnostics=self.diagnostics,
+            )
+            with self._lock:
+                self._analysers.append(self._local.analyser)
+        return self._local.analyser
+
+    def _run_query(self, name: str, query) -> ReportEntry:
+        """Runs a single query on the analyser of the calling worker thread."""
+        if self._cancelled.is_set():
+            return ReportEntry(name, None, 0.0, cancelled=True)
+        analyser = self._analyser()
+        with self._lock:
+            self._running[name] = analyser
+        start = perf_counter()
+        try:
+            return ReportEntry(name, query(analyser), perf_counter() - start)
+        except OperationalError as e:
+            if self._cancelled.is_set():  # raised by Connection.interrupt()
+                return ReportEntry(name, None, perf_counter() - start, cancelled=True)
+            return ReportEntry(name, None, perf_counter() - start, error=e)
+        except Exception as e:  # pylint: disable=broad-except
+            return ReportEntry(name, None, perf_counter() - start, error=e)
+        finally:
+            with self._lock:
+                self._running.pop(name, None)
+
+    def cancel(self) -> None:
+        """Cancels the queries that did not start yet and interrupts the running ones."""
+        self._cancelled.set()
+        with self._lock:
+            for analyser in self._running.values():
+                analyser.conn.interrupt()
+
+    def run(self, queries: dict, timeout: float = None) -> list:
+        """Runs the queries concurrently and collects their results.
+
+        Parameters
+        ----------
+        queries : dict
+            Maps each report entry name to a function taking a RatingsAnalyser
+        timeout : float
+            The number of seconds after which unfinished queries are cancelled
+
+        Returns
+        ----------
+        list
+            One ReportEntry per query, in the order of queries
+        """
+        self._cancelled.clear()
+        futures = {
+            name: self._executor.submit(self._run_query, name, query)
+            for name, query in queries.items()
+        }
+        _, not_done = wait(futures.values(), timeout=timeout)
+        if not_done:
+            self.cancel()
+            wait(not_done)
+        return [future.result() for future in futures.values()]
+
+    def close(self) -> None:
+        """Waits for the workers to stop and closes their connections."""
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        for analyser in self._analysers:
+            analyser.conn.close()
+        self._analysers.clear()
+
+
+def run_report(
+    db_name: str,
+    queries: dict,
+    max_workers: int = 4,
+    timeout: float = None,
+    user: str = None,
+    diagnostics=None,
+) -> list:
+    """Runs the queries concurrently on a fresh pool of read-only connections.
+
+    Parameters
+    ----------
+    db_name : str
+        The name of the database to query
+    queries : dict
+        Maps each report entry name to a function taking a RatingsAnalyser
+    max_workers : int
+        The number of connections, and thus of queries running at the same time
+    timeout : float
+        The number of seconds after which unfinished queries are cancelled
+    user : str
+        The user profile to scope the queries to. The ratings of imdb_ratings if None
+    diagnostics : QueryDiagnostics
+        Profiles the queries of every connection if given
+
+    Returns
+    ----------
+    list
+        One ReportEntry per query, in the order of queries
+    """
+    with ReportRunner(db_name, max_workers, user, diagnostics) as runner:
+        return runner.run(queries, timeout)
@@ -0,0 +1,296 @@
+"""This module provides full-text, prefix and typo-tolerant search over people and titles.
+
+Two sqlite FTS5 indexes are kept side by side:
+    - search_words tokenizes names into words and indexes their prefixes, which answers
+      "freeman" or "morg" style queries and autocompletion;
+    - search_trigrams indexes every 3-character sequence of the names, which lets names
+      that share most of their trigrams with a misspelled query be found.
+Triggers keep both indexes in sync with the actors, directors, musicians and imdb_ratings
+tables once they are built. A database that was never indexed is indexed on its first search.
+"""
+
+import re
+from difflib import SequenceMatcher
+from sqlite3 import connect
+from typing import NamedTuple
+
+
+SEARCHABLE_TABLES = {
+    "actor": ("actors", "actor_id", "name"),
+    "director": ("directors", "director_id", "name"),
+    "musician": ("musicians", "musician_id", "name"),
+    "title": ("imdb_ratings", "id", "title"),
+}
+INDEX_TABLES = {
+    "search_words": "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3 4'",
+    "search_trigrams": "tokenize = 'trigram'",
+}
+FUZZY_CANDIDATES = 50
+FUZZY_TRIGRAMS = 8  # only the rarest trigrams of a query are looked up
+AUTOCOMPLETE_CANDIDATES = 500
+WORD_PATTERN = re.compile(r"\w+")
+
+
+class SearchResult(NamedTuple):
+    """A ranked search hit."""
+
+    kind: str
+    entry_id: int
+    name: str
+    score: float
+
+
+def existing_tables(cursor) -> set:
+    """Returns the names of the tables of the database."""
+    return {
+        row[0]
+        for row in cursor.execute(
+            """SELECT name FROM sqlite_master WHERE type = 'table'"""
+        ).fetchall()
+    }
+
+
+def text_trigrams(text: str) -> set:
+    """Returns the 3-character sequences of a text."""
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+class SearchIndex:
+    """A class to build and query the search indexes of a local sqlite database."""
+
+    def __init__(self, db_name: str = "imdb_ratings.db"):
+        self.conn = connect(db_name)
+        self.cursor = self.conn.cursor()
+        self._built = False
+
+    def __del__(self):
+        self.conn.close()
+
+    def build(self) -> None:
+        """(Re)creates the search indexes from the current content of the database.
+
+        The triggers created alongside keep the indexes up to date with later insertions,
+        updates and deletions.
+        """
+        tables = existing_tables(self.cursor)
+        for index_table, options in INDEX_TABLES.items():
+            self.cursor.execute(f"""DROP TABLE IF EXISTS {index_table}""")
+            self.cursor.execute(
+                f"""CREATE VIRTUAL TABLE {index_table} USING fts5(
+                    name, kind UNINDEXED, entry_id UNINDEXED, {options}
+                )"""
+            )
+        self.cursor.execute(
+            """CREATE VIRTUAL TABLE IF NOT EXISTS search_trigrams_vocab
+            USING fts5vocab(search_trigrams, 'row')"""
+        )
+        for kind, (table_name, column_id, column_name) in SEARCHABLE_TABLES.items():
+            if table_name not in tables:
+                continue
+            for index_table in INDEX_TABLES:
+                self.cursor.execute(
+                    f"""INSERT INTO {index_table} (name, kind, entry_id)
+                    SELECT {column_name}, '{kind}', {column_id} FROM {table_name}
+                    WHERE {column_name} IS NOT NULL"""
+                )
+            self.create_triggers(kind)
+        self.conn.commit()
+
+    def ensure_built(self) -> None:
+        """Builds the search indexes if the database was never indexed."""
+        if not self._built and "search_words" not in existing_tables(self.cursor):
+            self.build()
+        self._built = True
+
+    def create_triggers(self, kind: str) -> None:
+        """Creates the triggers that mirror changes of a searchable table into the indexes.
+
+        Parameters
+        ----------
+        kind : str
+            The kind of entries to keep in sync, one of SEARCHABLE_TABLES
+        """
+        table_name, column_id, column_name = SEARCHABLE_TABLES[kind]
+        insert = " ".join(
+            f"""INSERT INTO {index_table} (name, kind, entry_id)
+            SELECT NEW.{column_name}, '{kind}', NEW.{column_id}
+            WHERE NEW.{column_name} IS NOT NULL;"""
+            for index_table in INDEX_TABLES
+        )
+        delete = " ".join(
+            f"""DELETE FROM {index_table}
+            WHERE kind = '{kind}' AND entry_id = OLD.{column_id};"""
+            for index_table in INDEX_TABLES
+        )
+        for event, body in (
+            ("INSERT", insert),
+            ("DELETE", delete),
+            (f"UPDATE OF {column_name}", delete + insert),
+        ):
+            trigger_name = f"{table_name}_search_{event.split()[0].lower()}"
+            self.cursor.execute(f"""DROP TRIGGER IF EXISTS {trigger_name}""")
+            self.cursor.execute(
+                f"""CREATE TRIGGER {trigger_name} AFTER {event} ON {table_name}
+                BEGIN {body} END"""
+            )
+
+    def _kind_filter(self, kinds: list) -> tuple:
+        """Returns the SQL condition and parameters restricting hits to the given kinds."""
+        if not kinds:
+            return "", ()
+        tables = existing_tables(self.cursor)
+        available = [
+            kind
+            for kind, (table_name, _, _) in SEARCHABLE_TABLES.items()
+            if table_name in tables
+        ]
+        if not set(kinds) <= set(available):
+            raise ValueError(f"kind must be one of {', '.join(available)}")
+        return f"AND kind IN ({','.join('?' * len(kinds))})", tuple(kinds)
+
+    def search(self, query: str, kinds: list = None, limit: int = 10) -> list:
+        """Finds the entries whose name contains words starting with every word of the query.
+
+        "freeman", "morgan freeman" and "morg free" all match "Morgan Freeman". Falls back to
+        fuzzy_search when nothing matches, so that misspelled queries still return hits.
+
+        Parameters
+        ----------
+        query : str
+            The words to look for, in any order and case
+        kinds : list
+            The kinds of entries to return (actor, director, musician, title). All if None
+        limit : int
+            The maximum number of hits to return
+
+        Returns
+        ----------
+        list
+            SearchResult hits, best first
+        """
+        words = WORD_PATTERN.findall(query)
+        if not words:
+            return []
+        self.ensure_built()
+        kind_filter, params = self._kind_filter(kinds)
+        match = " ".join(f'"{word}"*' for word in words)
+        hits = self.cursor.execute(
+            f"""SELECT kind, entry_id, name, -rank FROM search_words
+            WHERE search_words MATCH ? {kind_filter} ORDER BY rank LIMIT ?""",
+            (match, *params, limit),
+        ).fetchall()
+        if not hits:
+            return self.fuzzy_search(query, kinds, limit)
+        return [SearchResult(*hit) for hit in hits]
+
+    def autocomplete(self, prefix: str, kinds: list = None, limit: int = 10) -> list:
+        """Suggests names for a partially typed query.
+
+        Every word is matched as a prefix. Among the first AUTOCOMPLETE_CANDIDATES matches,
+        shorter names come first since they are the most likely completions; capping the
+        candidates keeps one or two letter prefixes fast on large tables. A name shared by
+        several entries, e.g. a person who is both actor and director, is suggested once.
+
+        Parameters
+        ----------
+        prefix : str
+            The partially typed query
+        kinds : list
+            The kinds of entries to return (actor, director, musician, title). All if None
+        limit : int
+            The maximum number of suggestions to return
+
+        Returns
+        ----------
+        list
+            The distinct suggested names
+        """
+        words = WORD_PATTERN.findall(prefix)
+        if not words:
+            return []
+        self.ensure_built()
+        kind_filter, params = self._kind_filter(kinds)
+        match = " ".join(f'"{word}"*' for word in words)
+        return [
+            row[0]
+            for row in self.cursor.execute(
+                f"""SELECT DISTINCT name FROM (
+                    SELECT name FROM search_words
+                    WHERE search_words MATCH ? {kind_filter} LIMIT ?
+                ) ORDER BY length(name), name LIMIT ?""",
+                (match, *params, AUTOCOMPLETE_CANDIDATES, limit),
+            ).fetchall()
+        ]
+
+    def fuzzy_search(self, query: str, kinds: list = None, limit: int = 10) -> list:
+        """Finds the entries whose name is closest to a possibly misspelled query.
+
+        Candidates sharing one of the FUZZY_TRIGRAMS rarest trigrams of the query are fetched
+        from the trigram index, then re-ranked by their similarity ratio with the query.
+        Trigrams broken by a typo do not exist in the index and are simply ignored. As a
+        transposition ("alcie") breaks every trigram of a short word, the FUZZY_TRIGRAMS rarest
+        trigrams of the query with two adjacent letters swapped are looked up as well.
+
+        Parameters
+        ----------
+        query : str
+            The name to look for
+        kinds : list
+            The kinds of entries to return (actor, director, musician, title). All if None
+        limit : int
+            The maximum number of hits to return
+
+        Returns
+        ----------
+        list
+            SearchResult hits, best first, scored between 0 and 1
+        """
+        normalised = " ".join(WORD_PATTERN.findall(query.lower()))
+        trigrams = text_trigrams(normalised)
+        if not trigrams:
+            return []
+        self.ensure_built()
+        swapped = set().union(
+            *(
+                text_trigrams(
+                    normalised[:i]
+                    + normalised[i + 1]
+                    + normalised[i]
+                    + normalised[i + 2 :]
+                )
+                for i in range(len(normalised) - 1)
+            )
+        )
+        swapped -= trigrams
+        lookups = []
+        for terms in (trigrams, swapped):
+            if not terms:
+                continue
+            lookups.extend(
+                row[0]
+                for row in self.cursor.execute(
+                    f"""SELECT term FROM search_trigrams_vocab
+                    WHERE term IN ({','.join('?' * len(terms))})
+                    ORDER BY doc LIMIT {FUZZY_TRIGRAMS}""",
+                    tuple(terms),
+                )
+            )
+        if not lookups:
+            return []
+        kind_filter, params = self._kind_filter(kinds)
+        match = " OR ".join(f'"{trigram}"' for trigram in lookups)
+        candidates = self.cursor.execute(
+            f"""SELECT kind, entry_id, name FROM search_trigrams
+            WHERE search_trigrams MATCH ? {kind_filter} ORDER BY rank LIMIT ?""",
+            (match, *params, max(FUZZY_CANDIDATES, limit)),
+        ).fetchall()
+        hits = [
+            SearchResult(
+                kind,
+                entry_id,
+                name,
+                SequenceMatcher(None, normalised, name.lower()).ratio(),
+            )
+            for kind, entry_id, name in candidates
+        ]
+        return sorted(hits, key=lambda hit: -hit.score)[:limit]
@@ -0,0 +1,379 @@
+"""This module serves the RatingsAnalyser statistics as a local JSON API.
+
+The server is a long-running asyncio process, so the database connections, the imported modules
+and the results of previous queries stay warm between dashboard refreshes. It only relies on the
+standard library:
+    - requests are parsed and answered on the event loop, with HTTP/1.1 keep-alive;
+    - the blocking sqlite queries run on a bounded pool of worker threads, each owning a
+      read-only RatingsAnalyser, and WatchTime for the watch time endpoints, per user profile;
+    - results are cached until the database is modified by another connection, which sqlite
+      reports through PRAGMA data_version, and concurrent requests for the same uncached
+      result wait for a single computation of it;
+    - when the database is a read replica (see replica.py) that gets swapped for a newer
+      snapshot, the cache is emptied and the workers reopen their connections on the new file.
+
+Endpoints are GET requests whose query string holds the parameters, e.g.
+    /top?n=10, /actors?n=5&user=alice, /movies?actor=Morgan%20Freeman, /watch-time-by?by=genre
+"""
+
+import asyncio
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from sqlite3 import connect
+from urllib.parse import parse_qs, urlsplit
+
+from Code.moviestats.ratings_analyser import RatingsAnalyser
+from Code.moviestats.recommendations import get_movie_genre_combination_ratings
+from Code.moviestats.replica import file_identity
+from Code.moviestats.watch_time import WatchTime
+
+
+class MissingParameter(Exception):
+    """Raised when a request lacks a parameter its endpoint needs."""
+
+
+def _top(params: dict) -> int:
+    return int(params.get("n", 10))
+
+
+def _required(params: dict, name: str) -> str:
+    if name not in params:
+        raise MissingParameter(name)
+    return params[name]
+
+
+ENDPOINTS = {
+    "/top": lambda a, p: a.get_top_ratings(_top(p)),
+    "/per-rating": lambda a, p: a.get_movies_per_rating(),
+    "/ratings": lambda a, p: a.get_ratings(),
+    "/differences": lambda a, p: a.get_rating_differences(),
+    "/mean-rating": lambda a, p: a.get_mean_rating(),
+    "/watch-time": lambda w, p: w.get_total_watching_time(
+        p.get("days") in ("1", "true")
+    ),
+    "/watch-time-by": lambda w, p: w.get_watching_time_by(
+        p.get("by", "type"), p.get("days") in ("1", "true")
+    ),
+    "/genres": lambda a, p: a.get_average_rating_by_genre(),
+    "/title-genres": lambda a, p: a.get_title_genre_ratings(p.get("movies") != "0"),
+    "/directors": lambda a, p: a.get_mean_rating_for_highest_directors(_top(p)),
+    "/frequent-directors": lambda a, p: a.get_stats_for_most_frequent_directors(
+        _top(p)
+    ),
+    "/actors": lambda a, p: a.get_mean_rating_for_highest_actors(_top(p)),
+    "/frequent-actors": lambda a, p: a.get_stats_for_most_frequent_actors(_top(p)),
+    "/movies": lambda a, p: a.get_movie_list_for(_required(p, "actor")),
+    "/recommendations": lambda a, p: get_movie_genre_combination_ratings(a)[: _top(p)],
+}
+# endpoints answered by a WatchTime rather than a RatingsAnalyser
+WATCH_TIME_ENDPOINTS = {"/watch-time", "/watch-time-by"}
+CACHE_SIZE = 256
+MAX_REQUEST_LINE = 8192
+STATUS_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+def to_json(result) -> object:
+    """Converts a query result into JSON-serialisable values, records becoming objects."""
+    if isinstance(result, list):
+        return [to_json(item) for item in result]
+    if hasattr(result, "_asdict"):
+        return {field: to_json(value) for field, value in result._asdict().items()}
+    return result
+
+
+class ResultCache:
+    """A thread-safe LRU cache of serialised results, emptied when the database changes.
+
+    A dedicated read-only connection polls PRAGMA data_version, which changes whenever another
+    connection commits to the database, e.g. during an ingestion. The database file itself is
+    replaced when it is a replica: generation counts these swaps. get returns the state of the
+    database it checked, and put drops a result computed on a state that has changed since.
+    """
+
+    def __init__(self, db_name: str, size: int = CACHE_SIZE):
+        self.db_name = db_name
+        self.size = size
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._open()
+        self.hits = 0
+        self.misses = 0
+
+    def _open(self) -> None:
+        self._identity = file_identity(self.db_name)
+        self._conn = connect(
+            f"{Path(self.db_name).resolve().as_uri()}?mode=ro",
+            uri=True,
+            check_same_thread=False,
+        )
+        self._data_version = self._read_data_version()
+
+    def _read_data_version(self) -> int:
+        return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _check_database(self) -> tuple:
+        """Empties the cache if the database changed, then returns its current state.
+
+        Must be called with the lock held.
+        """
+        if file_identity(self.db_name) != self._identity:
+            self._conn.close()
+            self._open()
+            self._entries.clear()
+            self.generation += 1
+        data_version = self._read_data_version()
+        if data_version != self._data_version:
+            self._entries.clear()
+            self._data_version = data_version
+        return self.generation, self._data_version
+
+    def get(self, key: tuple) -> tuple:
+        """Looks key up.
+
+        Returns
+        ----------
+        tuple
+            The cached body of key, None if it is missing or stale, and the state of the
+            database, to give to put along with the body once computed
+        """
+        with self._lock:
+            state = self._check_database()
+            body = self._entries.get(key)
+            if body is None:
+                self.misses += 1
+                return None, state
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return body, state
+
+    def put(self, key: tuple, body: bytes, state: tuple) -> None:
+        """Stores the body of key, evicting the least recently used entry if full.
+
+        The body is dropped if the database changed since get returned state, as it may have
+        been computed on the previous data.
+        """
+        with self._lock:
+            if self._check_database() != state:
+                return
+            self._entries[key] = body
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def close(self) -> None:
+        """Closes the connection used to detect database changes."""
+        self._conn.close()
+
+
+class StatsServer:
+    """An asyncio HTTP server answering ENDPOINTS queries with JSON.
+
+    Parameters
+    ----------
+    db_name : str
+        The name of the sqlite database to serve
+    max_workers : int
+        The number of threads, and thus of sqlite queries running at the same time
+    max_pending : int
+        The number of requests that may wait for a worker. Requests beyond it are answered
+        with 503 instead of queueing without bound
+    """
+
+    def __init__(self, db_name: str, max_workers: int = 4, max_pending: int = 64):
+        if max_workers < 1:
+            raise ValueError("max_workers must be a positive integer")
+        self.db_name = db_name
+        self.cache = ResultCache(db_name)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="server"
+        )
+        self._slots = asyncio.Semaphore(max_workers + max_pending)
+        self._inflight = {}  # maps the queries being computed to their future response
+        self._local = threading.local()
+        self._analysers = []
+        self._lock = threading.Lock()
+        self._server = None
+
+    def _analyser(self, user: str, cls: type = RatingsAnalyser) -> object:
+        """Returns the analyser of the calling worker thread for user, opening it if needed.
+
+        The analysers of the thread are reopened when the database file has been swapped.
+        cls is RatingsAnalyser or WatchTime, both opened read-only.
+        """
+        if getattr(self._local, "generation", None) != self.cache.generation:
+            for analyser in getattr(self._local, "analysers", {}).values():
+                with self._lock:
+                    self._analysers.remove(analyser)
+                analyser.conn.close()
+            self._local.analysers = {}
+            self._local.generation = self.cache.generation
+        if (cls, user) not in self._local.analysers:
+            analyser = cls(self.db_name, read_only=True, user=user)
+            self._local.analysers[cls, user] = analyser
+            with self._lock:
+                self._analysers.append(analyser)
+        return self._local.analysers[cls, user]
+
+    def _query(self, path: str, params: dict) -> bytes:
+        """Runs an endpoint query on a worker thread and serialises its result."""
+        cls = WatchTime if path in WATCH_TIME_ENDPOINTS else RatingsAnalyser
+        result = ENDPOINTS[path](self._analyser(params.get("user"), cls), params)
+        return json.dumps(to_json(result)).encode()
+
+    async def answer(self, target: str) -> tuple:
+        """Computes the response to a request target.
+
+        Parameters
+        ----------
+        target : str
+            The path and query string of the request
+
+        Returns
+        ----------
+        tuple
+            The HTTP status code and the JSON body
+        """
+        url = urlsplit(target)
+        if url.path not in ENDPOINTS:
+            return 404, json.dumps({"error": f"unknown endpoint {url.path}"}).encode()
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        key = (url.path, tuple(sorted(params.items())))
+        body, state = self.cache.get(key)
+        if body is not None:
+            return 200, body
+        if key in self._inflight:  # the same query is already running, share its result
+            return await asyncio.shield(self._inflight[key])
+        if self._slots.locked():
+            return 503, b'{"error": "too many pending requests"}'
+        loop = asyncio.get_running_loop()
+        self._inflight[key] = response = loop.create_future()
+        async with self._slots:
+            try:
+                body = await loop.run_in_executor(
+                    self._executor, self._query, url.path, params
+                )
+                self.cache.put(key, body, state)
+                response.set_result((200, body))
+            except MissingParameter as e:
+                error = {"error": f"missing parameter {e.args[0]}"}
+                response.set_result((400, json.dumps(error).encode()))
+            except ValueError as e:
+                response.set_result((400, json.dumps({"error": str(e)}).encode()))
+            except Exception as e:  # pylint: disable=broad-except
+                response.set_result((500, json.dumps({"error": str(e)}).encode()))
+            finally:
+                del self._inflight[key]
+                if not response.done():  # cancelled while the query was running
+                    response.cancel()
+        return response.result()
+
+    async def handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """Answers the requests of one client connection until it is closed."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip().lower()
+                parts = request_line.decode("latin-1").split()
+                if len(parts) != 3 or len(request_line) > MAX_REQUEST_LINE:
+                    status, body = 400, b'{"error": "malformed request"}'
+                elif parts[0] != "GET":
+                    status, body = 405, b'{"error": "only GET is supported"}'
+                else:
+                    status, body = await self.answer(parts[1])
+                keep_alive = (
+                    len(parts) == 3
+                    and parts[2] == "HTTP/1.1"
+                    and headers.get("connection") != "close"
+                )
+                writer.write(
+                    f"HTTP/1.1 {status} {STATUS_REASONS[status]}\r\n"
+                    "Content-Type: application/json\r\n"
+                    f"Content-Length: {len(body)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+                    "\r\n".encode() + body
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8000) -> None:
+        """Starts listening. Use port 0 to pick a free port, then read self.port."""
+        self._server = await asyncio.start_server(self.handle, host, port)
+
+    @property
+    def port(self) -> int:
+        """The port the server listens on."""
+        return self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self, host: str = "127.0.0.1", port: int = 8000) -> None:
+        """Starts the server and answers requests until it is cancelled."""
+        await self.start(host, port)
+        print(f"Serving {self.db_name} on http://{host}:{self.port}")
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def stop(self) -> None:
+        """Stops listening, then closes the worker threads and their connections."""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        self._executor.shutdown(wait=True)
+        for analyser in self._analysers:
+            analyser.conn.close()
+        self._analysers.clear()
+        self.cache.close()
+
+
+def serve(
+    db_name: str, host: str = "127.0.0.1", port: int = 8000, max_workers: int = 4
+) -> None:
+    """Runs the JSON API until interrupted.
+
+    Parameters
+    ----------
+    db_name : str
+        The name of the sqlite database to serve
+    host : str
+        The interface to listen on
+    port : int
+        The port to listen on
+    max_workers : int
+        The number of threads running sqlite queries
+    """
+    server = StatsServer(db_name, max_workers)
+
+    async def run() -> None:
+        try:
+            await server.serve_forever(host, port)
+        finally:
+            await server.stop()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,608 @@
+"""This module provides streaming sketches for approximate statistics over large rating sets.
+
+Sketches have a fixed size whatever the number of ratings they summarise, are updated one title
+at a time during ingestion, and can be merged, so that the sketches of several users or shards
+summarise their union. Each sketch documents the error bound of its answers.
+"""
+
+import heapq
+from hashlib import blake2b
+from itertools import groupby
+from math import ceil, e, log
+from operator import itemgetter
+
+import numpy as np
+
+from Code.moviestats.memory import array_to_bytes, bytes_to_array, tracked
+from Code.moviestats.records import NameStats
+
+
+# a name held in the credit lists of from_database, with its list slot
+CREDIT_BYTES = 100
+
+
+def hash64(key: str, salt: bytes = b"") -> int:
+    """Returns a well mixed 64-bit hash of key."""
+    return int.from_bytes(
+        blake2b(key.encode("utf-8"), digest_size=8, salt=salt).digest(), "little"
+    )
+
+
+class CountMinSketch:
+    """Approximate occurrence counts of arbitrary keys.
+
+    With width = ceil(e / epsilon) and depth = ceil(ln(1 / delta)), an estimate is never below
+    the true count, and exceeds it by more than epsilon * total with probability at most delta.
+    """
+
+    def __init__(self, epsilon: float = 0.001, delta: float = 0.01):
+        self.width = ceil(e / epsilon)
+        self.depth = ceil(log(1 / delta))
+        self.table = [[0] * self.width for _ in range(self.depth)]
+        self.total = 0
+
+    def _columns(self, key: str):
+        """Yields the column of key in each row, using double hashing."""
+        h = hash64(key)
+        h1, h2 = h & 0xFFFFFFFF, h >> 32
+        for row in range(self.depth):
+            yield (h1 + row * h2) % self.width
+
+    def add(self, key: str, count: int = 1) -> None:
+        """Counts count more occurrences of key."""
+        for row, column in zip(self.table, self._columns(key)):
+            row[column] += count
+        self.total += count
+
+    def estimate(self, key: str) -> int:
+        """Returns the estimated number of occurrences of key."""
+        return min(row[column] for row, column in zip(self.table, self._columns(key)))
+
+    def to_arrays(self) -> dict:
+        """Returns the counters of the sketch, see RatingsSketches.save."""
+        return {"table": np.array(self.table, dtype=np.int64), "total": self.total}
+
+    @classmethod
+    def from_arrays(cls, arrays: dict) -> "CountMinSketch":
+        """Rebuilds a sketch from the counters returned by to_arrays."""
+        sketch = cls.__new__(cls)
+        sketch.depth, sketch.width = arrays["table"].shape
+        sketch.table = arrays["table"].tolist()
+        sketch.total = int(arrays["total"])
+        return sketch
+
+    def merge(self, other: "CountMinSketch") -> None:
+        """Adds the counts of a sketch built with the same epsilon and delta."""
+        if (self.width, self.depth) != (other.width, other.depth):
+            raise ValueError("Count-Min sketches must have the same dimensions")
+        for row, other_row in zip(self.table, other.table):
+            for column, count in enumerate(other_row):
+                row[column] += count
+        self.total += other.total
+
+
+class SpaceSaving:
+    """The capacity most frequent keys of a stream, with their approximate counts.
+
+    Every key occurring more than total / capacity times is monitored. A monitored count
+    overestimates the true count by at most its error, itself at most total / capacity. The sum
+    and number of the values (e.g. ratings) seen since a key became monitored are kept
+    alongside, so that an approximate mean value can be given for heavy hitters. Occurrences
+    without a value (e.g. unrated titles) are counted but left out of the mean.
+    """
+
+    def __init__(self, capacity: int = 1000):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.value_sums = {}
+        self.value_counts = {}
+        self.total = 0
+        self._heap = []  # (count, key) entries, some of which are outdated
+
+    def _min_key(self) -> str:
+        """Returns the monitored key with the smallest count, dropping outdated heap entries."""
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(count, key) for key, count in self.counts.items()]
+            heapq.heapify(self._heap)
+        while True:
+            count, key = self._heap[0]
+            if self.counts.get(key) == count:
+                return key
+            heapq.heappop(self._heap)
+
+    def add(self, key: str, value: float = None, count: int = 1) -> None:
+        """Counts count more occurrences of key, each with the given value if not None."""
+        self.total += count
+        if key not in self.counts and len(self.counts) >= self.capacity:
+            evicted = self._min_key()
+            floor = self.counts.pop(evicted)
+            del (
+                self.errors[evicted],
+                self.value_sums[evicted],
+                self.value_counts[evicted],
+            )
+            self.counts[key], self.errors[key] = floor, floor
+            self.value_sums[key], self.value_counts[key] = 0.0, 0
+        elif key not in self.counts:
+            self.counts[key], self.errors[key] = 0, 0
+            self.value_sums[key], self.value_counts[key] = 0.0, 0
+        self.counts[key] += count
+        if value is not None:
+            self.value_sums[key] += value * count
+            self.value_counts[key] += count
+        heapq.heappush(self._heap, (self.counts[key], key))
+
+    def top(self, top_n: int) -> list:
+        """Returns the top_n keys with the highest counts.
+
+        Returns
+        ----------
+        list
+            3-tuples of key, estimated count and mean value since the key is monitored, None if
+            no value was seen since
+        """
+        keys = heapq.nlargest(top_n, self.counts, key=self.counts.get)
+        return [
+            (
+                key,
+                self.counts[key],
+                (
+                    self.value_sums[key] / self.value_counts[key]
+                    if self.value_counts[key]
+                    else None
+                ),
+            )
+            for key in keys
+        ]
+
+    def to_arrays(self) -> dict:
+        """Returns the monitored keys and their counters, see RatingsSketches.save."""
+        keys = list(self.counts)
+        return {
+            "capacity": self.capacity,
+            "total": self.total,
+            "keys": np.array(keys, dtype=str),
+            "counts": np.array([self.counts[key] for key in keys], dtype=np.int64),
+            "errors": np.array([self.errors[key] for key in keys], dtype=np.int64),
+            "value_sums": np.array([self.value_sums[key] for key in keys]),
+            "value_counts": np.array(
+                [self.value_counts[key] for key in keys], dtype=np.int64
+            ),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays: dict) -> "SpaceSaving":
+        """Rebuilds a summary from the counters returned by to_arrays."""
+        summary = cls(int(arrays["capacity"]))
+        summary.total = int(arrays["total"])
+        keys = arrays["keys"].tolist()
+        for name in ("counts", "errors", "value_sums", "value_counts"):
+            setattr(summary, name, dict(zip(keys, arrays[name].tolist())))
+        summary._heap = [(count, key) for key, count in summary.counts.items()]
+        heapq.heapify(summary._heap)
+        return summary
+
+    def merge(self, other: "SpaceSaving") -> None:
+        """Merges the summary of another stream into this one.
+
+        Keys monitored by only one summary are credited with the smallest count of the other
+        one when it is full, which keeps the total / capacity error bound of the union.
+        """
+        floor = min(self.counts.values()) if len(self.counts) >= self.capacity else 0
+        other_floor = (
+            min(other.counts.values()) if len(other.counts) >= other.capacity else 0
+        )
+        merged = {}
+        for key in self.counts.keys() | other.counts.keys():
+            count = self.counts.get(key, floor) + other.counts.get(key, other_floor)
+            error = self.errors.get(key, floor) + other.errors.get(key, other_floor)
+            value_sum = self.value_sums.get(key, 0.0) + other.value_sums.get(key, 0.0)
+            value_count = self.value_counts.get(key, 0) + other.value_counts.get(key, 0)
+            merged[key] = (count, error, value_sum, value_count)
+        kept = heapq.nlargest(self.capacity, merged, key=lambda k: merged[k][0])
+        self.counts = {key: merged[key][0] for key in kept}
+        self.errors = {key: merged[key][1] for key in kept}
+        self.value_sums = {key: merged[key][2] for key in kept}
+        self.value_counts = {key: merged[key][3] for key in kept}
+        self.total += other.total
+        self._heap = [(count, key) for key, count in self.counts.items()]
+        heapq.heapify(self._heap)
+
+
+class TDigest:
+    """Approximate quantiles of a stream of numbers (merging t-digest).
+
+    A centroid around quantile q holds at most 4 * count * q * (1 - q) / compression values,
+    so the rank error of an estimate is about 2 * q * (1 - q) / compression: 0.5% of the values
+    around the median and much less at the tails, with the default compression of 100.
+    """
+
+    def __init__(self, compression: int = 100):
+        self.compression = compression
+        self.centroids = []  # sorted (mean, weight) pairs
+        self.buffer = []
+        self.count = 0
+
+    def add(self, value: float, weight: float = 1.0) -> None:
+        """Adds a value to the digest."""
+        self.buffer.append((value, weight))
+        self.count += weight
+        if len(self.buffer) >= 10 * self.compression:
+            self._compress()
+
+    def _compress(self) -> None:
+        """Merges the buffered values into the centroids."""
+        points = sorted(self.centroids + self.buffer)
+        self.buffer = []
+        if not points:
+            return
+        total = sum(weight for _, weight in points)
+        merged = [list(points[0])]
+        cumulated = 0.0
+        for mean, weight in points[1:]:
+            last = merged[-1]
+            q = (cumulated + last[1] + weight / 2) / total
+            # the k1 scale function lets centroids grow in the middle and stay small at the tails
+            limit = 4 * total * q * (1 - q) / self.compression
+            if last[1] + weight <= max(limit, 1.0):
+                last[0] += (mean - last[0]) * weight / (last[1] + weight)
+                last[1] += weight
+            else:
+                cumulated += last[1]
+                merged.append([mean, weight])
+        self.centroids = [tuple(centroid) for centroid in merged]
+
+    def quantile(self, q: float) -> float:
+        """Returns the estimated q-quantile of the values, or None if the digest is empty."""
+        if not 0 <= q <= 1:
+            raise ValueError("q must be between 0 and 1")
+        self._compress()
+        if not self.centroids:
+            return None
+        target = q * self.count
+        cumulated = 0.0
+        previous_mean, previous_mid = self.centroids[0][0], 0.0
+        for mean, weight in self.centroids:
+            mid = cumulated + weight / 2
+            if target <= mid:
+                if mid == previous_mid:
+                    return mean
+                ratio = (target - previous_mid) / (mid - previous_mid)
+                return previous_mean + ratio * (mean - previous_mean)
+            cumulated += weight
+            previous_mean, previous_mid = mean, mid
+        return self.centroids[-1][0]
+
+    def to_arrays(self) -> dict:
+        """Returns the centroids and buffered values, see RatingsSketches.save."""
+        return {
+            "compression": self.compression,
+            "count": self.count,
+            "centroids": np.array(self.centroids, dtype=np.float64).reshape(-1, 2),
+            "buffer": np.array(self.buffer, dtype=np.float64).reshape(-1, 2),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays: dict) -> "TDigest":
+        """Rebuilds a digest from the centroids and values returned by to_arrays."""
+        digest = cls(int(arrays["compression"]))
+        digest.count = float(arrays["count"])
+        digest.centroids = [tuple(pair) for pair in arrays["centroids"].tolist()]
+        digest.buffer = [tuple(pair) for pair in arrays["buffer"].tolist()]
+        return digest
+
+    def merge(self, other: "TDigest") -> None:
+        """Adds the values summarised by another digest."""
+        self.buffer.extend(other.centroids + other.buffer)
+        self.count += other.count
+        self._compress()
+
+
+class HyperLogLog:
+    """Approximate number of distinct keys of a stream.
+
+    With 2**precision registers, the relative standard error is 1.04 / sqrt(2**precision),
+    i.e. 0.81% with the default precision of 14 (16 KiB of registers).
+    """
+
+    def __init__(self, precision: int = 14):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, key: str) -> None:
+        """Adds a key to the set."""
+        h = hash64(key, b"hll")
+        index = h >> (64 - self.precision)
+        remaining = h & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - remaining.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def estimate(self) -> int:
+        """Returns the estimated number of distinct keys added."""
+        m = len(self.registers)
+        raw = (0.7213 / (1 + 1.079 / m)) * m * m / sum(2.0**-r for r in self.registers)
+        zeros = self.registers.count(0)
+        if raw <= 2.5 * m and zeros:
+            return round(m * log(m / zeros))  # linear counting is better for small sets
+        return round(raw)
+
+    def to_arrays(self) -> dict:
+        """Returns the registers of the sketch, see RatingsSketches.save."""
+        return {"registers": np.frombuffer(bytes(self.registers), dtype=np.uint8)}
+
+    @classmethod
+    def from_arrays(cls, arrays: dict) -> "HyperLogLog":
+        """Rebuilds a sketch from the registers returned by to_arrays."""
+        sketch = cls(len(arrays["registers"]).bit_length() - 1)
+        sketch.registers = bytearray(arrays["registers"].tobytes())
+        return sketch
+
+    def merge(self, other: "HyperLogLog") -> None:
+        """Adds the keys of another set built with the same precision."""
+        if self.precision != other.precision:
+            raise ValueError("HyperLogLog sketches must have the same precision")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+
+# attribute of RatingsSketches -> class of the sketch
+SKETCHES = {
+    "frequent_actors": SpaceSaving,
+    "frequent_directors": SpaceSaving,
+    "actor_counts": CountMinSketch,
+    "director_counts": CountMinSketch,
+    "distinct_actors": HyperLogLog,
+    "distinct_directors": HyperLogLog,
+    "rating_differences": TDigest,
+}
+
+
+class RatingsSketches:
+    """The set of sketches maintained for a ratings store.
+
+    Parameters
+    ----------
+    name : str
+        The name under which the sketches are saved, e.g. a user or shard name
+    """
+
+    def __init__(self, name: str = "default", capacity: int = 1000):
+        self.name = name
+        self.titles = 0
+        self.frequent_actors = SpaceSaving(capacity)
+        self.frequent_directors = SpaceSaving(capacity)
+        self.actor_counts = CountMinSketch()
+        self.director_counts = CountMinSketch()
+        self.distinct_actors = HyperLogLog()
+        self.distinct_directors = HyperLogLog()
+        self.rating_differences = TDigest()
+
+    def add_title(
+        self, actors: list, directors: list, your_rating: float, imdb_rating: float
+    ) -> None:
+        """Updates every sketch with a newly rated title.
+
+        Parameters
+        ----------
+        actors : list
+            The names of the actors of the title
+        directors : list
+            The names of the directors of the title
+        your_rating : float
+            The personal rating of the title
+        imdb_rating : float
+            The IMDb rating of the title, None if unknown
+        """
+        self.titles += 1
+        for people, frequent, counts, distinct in (
+            (actors, self.frequent_actors, self.actor_counts, self.distinct_actors),
+            (
+                directors,
+                self.frequent_directors,
+                self.director_counts,
+                self.distinct_directors,
+            ),
+        ):
+            for person in people:
+                frequent.add(person, your_rating)
+                counts.add(person)
+                distinct.add(person)
+        if your_rating is not None and imdb_rating is not None:
+            self.rating_differences.add(your_rating - imdb_rating)
+
+    def merge(self, other: "RatingsSketches") -> None:
+        """Adds the titles summarised by the sketches of another user or shard."""
+        self.titles += other.titles
+        for attribute in SKETCHES:
+            getattr(self, attribute).merge(getattr(other, attribute))
+
+    def get_stats_for_most_frequent_actors(self, top_n: int = 10) -> list:
+        """Approximates RatingsAnalyser.get_stats_for_most_frequent_actors.
+
+        Counts may be overestimated by up to (number of actor credits) / capacity.
+        """
+        return [NameStats(*entry) for entry in self.frequent_actors.top(top_n)]
+
+    def get_stats_for_most_frequent_directors(self, top_n: int = 10) -> list:
+        """Approximates RatingsAnalyser.get_stats_for_most_frequent_directors.
+
+        Counts may be overestimated by up to (number of director credits) / capacity.
+        """
+        return [NameStats(*entry) for entry in self.frequent_directors.top(top_n)]
+
+    def get_rating_difference_quantiles(self, quantiles: list) -> list:
+        """Approximates the given quantiles of your_rating - imdb_rating."""
+        return [self.rating_differences.quantile(q) for q in quantiles]
+
+    def get_distinct_people_counts(self) -> dict:
+        """Approximates the number of distinct actors and directors (0.81% standard error)."""
+        return {
+            "actors": self.distinct_actors.estimate(),
+            "directors": self.distinct_directors.estimate(),
+        }
+
+    def save(self, cursor) -> None:
+        """Stores the sketches in the sketch_arrays table of the database, under their name.
+
+        Each counter of each sketch is stored as a .npy array, so that loading sketches never
+        runs code from the database and does not depend on the attributes of the classes.
+        """
+        cursor.execute(
+            """CREATE TABLE IF NOT EXISTS sketch_arrays(
+                name TEXT,
+                part TEXT,
+                payload BLOB,
+                PRIMARY KEY (name, part)
+            )"""
+        )
+        parts = [("titles", self.titles)]
+        for attribute in SKETCHES:
+            parts.extend(
+                (f"{attribute}.{key}", value)
+                for key, value in getattr(self, attribute).to_arrays().items()
+            )
+        cursor.execute("""DELETE FROM sketch_arrays WHERE name = ?""", (self.name,))
+        cursor.executemany(
+            """INSERT INTO sketch_arrays (name, part, payload) VALUES (?,?,?)""",
+            [
+                (self.name, part, array_to_bytes(np.asarray(value)))
+                for part, value in parts
+            ],
+        )
+
+    @staticmethod
+    def saved_names(cursor) -> list:
+        """Returns the names of the sketches saved in the database."""
+        if not cursor.execute(
+            """SELECT name FROM sqlite_master
+            WHERE type = 'table' AND name = 'sketch_arrays'"""
+        ).fetchone():
+            return []
+        return [
+            row[0]
+            for row in cursor.execute(
+                """SELECT DISTINCT name FROM sketch_arrays ORDER BY name"""
+            )
+        ]
+
+    @classmethod
+    def load(cls, cursor, name: str = "default") -> "RatingsSketches":
+        """Loads the sketches saved under name, or returns empty ones if there are none."""
+        if name not in cls.saved_names(cursor):
+            return cls(name)
+        arrays = {}
+        for part, payload in cursor.execute(
+            """SELECT part, payload FROM sketch_arrays WHERE name = ?""", (name,)
+        ):
+            attribute, _, key = part.partition(".")
+            arrays.setdefault(attribute, {})[key] = bytes_to_array(payload)
+        sketches = cls(name)
+        sketches.titles = int(arrays.pop("titles")[""])
+        for attribute, sketch_class in SKETCHES.items():
+            setattr(sketches, attribute, sketch_class.from_arrays(arrays[attribute]))
+        return sketches
+
+    @classmethod
+    def load_merged(cls, cursor, name: str = "merged") -> "RatingsSketches":
+        """Loads and merges every saved sketch, e.g. those of every user profile."""
+        merged = cls(name)
+        for saved in cls.saved_names(cursor):
+            merged.merge(cls.load(cursor, saved))
+        return merged
+
+    @classmethod
+    def from_database(
+        cls, cursor, name: str = "default", memory_budget=None, user: str = None
+    ) -> "RatingsSketches":
+        """Builds the sketches of an already populated database in a single streaming pass.
+
+        The credits of every title are held in per-title lists if they fit the memory budget.
+        Otherwise, the titles and their credits are read in title order and merged one title at
+        a time, SQLite sorting the credits through the link table indexes. Both give the same
+        sketches.
+
+        Parameters
+        ----------
+        cursor : Cursor
+            The cursor of the database to summarise
+        name : str
+            The name of the sketches
+        memory_budget : MemoryBudget
+            The budget of the credit lists, see memory.py. Unlimited if None
+        user : str
+            If given, the sketches summarise the titles rated by this user profile
+
+        Returns
+        ----------
+        RatingsSketches
+            The sketches of every title of the database, or of the user
+        """
+        sketches = cls(name)
+        queries = [
+            f"""SELECT movie_id, name FROM movie_{table_name}
+            JOIN {table_name} USING ({column_id}) ORDER BY movie_id"""
+            for table_name, column_id in (
+                ("actors", "actor_id"),
+                ("directors", "director_id"),
+            )
+        ]
+        titles = """SELECT id, your_rating, imdb_rating FROM imdb_ratings ORDER BY id"""
+        params = ()
+        if user is not None:
+            titles, params = (
+                """SELECT imdb_ratings.id, user_ratings.your_rating, imdb_ratings.imdb_rating
+                FROM user_ratings JOIN users USING (user_id)
+                JOIN imdb_ratings ON imdb_ratings.const = user_ratings.const
+                WHERE users.name = ? ORDER BY imdb_ratings.id""",
+                (user,),
+            )
+        num_credits = sum(
+            cursor.execute(f"""SELECT COUNT(*) FROM movie_{table_name}""").fetchone()[0]
+            for table_name in ("actors", "directors")
+        )
+        in_memory = memory_budget is None or memory_budget.fits(
+            num_credits, CREDIT_BYTES
+        )
+        strategy = "memory" if in_memory else "external"
+        with tracked(memory_budget, "sketches.from_database", strategy):
+            if in_memory:
+                credits = []
+                for query in queries:
+                    credits.append({})
+                    for movie_id, person in cursor.execute(query):
+                        credits[-1].setdefault(movie_id, []).append(person)
+                for movie_id, your_rating, imdb_rating in cursor.execute(
+                    titles, params
+                ).fetchall():
+                    sketches.add_title(
+                        credits[0].get(movie_id, []),
+                        credits[1].get(movie_id, []),
+                        your_rating,
+                        imdb_rating,
+                    )
+                return sketches
+
+            # one cursor per query, as the three of them are read together
+            connection = cursor.connection
+            streams = [
+                (
+                    (movie_id, [person for _, person in rows])
+                    for movie_id, rows in groupby(
+                        connection.execute(query), key=itemgetter(0)
+                    )
+                )
+                for query in queries
+            ]
+            current = [next(stream, None) for stream in streams]
+            for movie_id, your_rating, imdb_rating in connection.execute(
+                titles, params
+            ):
+                people = []
+                for i, stream in enumerate(streams):
+                    while current[i] is not None and current[i][0] < movie_id:
+                        current[i] = next(stream, None)
+                    found = current[i] is not None and current[i][0] == movie_id
+                    people.append(current[i][1] if found else [])
+                sketches.add_title(*people, your_rating, imdb_rating)
+        return sketches
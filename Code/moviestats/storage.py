@@ -0,0 +1,465 @@
+"""This module defines the compact on-disk layout of the ratings database and migrates to it.
+
+Compared to the original layout:
+    - imdb_ratings stores the number of the IMDb id (imdb_id, 111161 for tt0111161) and the id
+      of its title type in the title_types dictionary (type_id). const, title_type, url and the
+      TEXT dates are virtual generated columns computed from these and from the date epochs,
+      so they take no space and every query reading them is unchanged. A unique index on const
+      keeps lookups and joins by IMDb id indexed. Title types missing from the dictionary are
+      added as titles come, see add_title_types;
+    - genre_mask sets the bit of each genre of the title, numbered in the genre_bits dictionary
+      (genre ids are not dense enough to be bits themselves), so that titles can be filtered on
+      genres without joining movie_genres, see mask_of_genres;
+    - the link tables are WITHOUT ROWID tables clustered on (movie_id, person_id), with a
+      reverse covering index on (person_id, movie_id), instead of rowid tables whose UNIQUE
+      index stored every link a second time. movie_genres has no reverse index: the analyser
+      queries join every genre of the titles, which scans the table in title order, and
+      filtering on a few genres is left to genre_mask rather than to a genre order index.
+
+Titles are inserted with insert_titles, which adapts the columns of the export to the layout of
+the database, so both layouts can be written to. migrate_to_compact converts a database in place.
+"""
+
+import os
+from sqlite3 import connect
+
+from Code.moviestats.changes import create_change_log, drop_change_triggers, record_load
+from Code.moviestats.search import SearchIndex, existing_tables
+
+
+# title types of the dictionary when it is created, numbered from 1; others are added on demand
+TITLE_TYPES = [
+    "movie",
+    "tvSeries",
+    "tvMiniSeries",
+    "tvMovie",
+    "tvEpisode",
+    "tvSpecial",
+    "tvShort",
+    "short",
+    "video",
+    "videoGame",
+    "musicVideo",
+    "podcastSeries",
+    "podcastEpisode",
+]
+LINK_TABLES = {
+    "movie_actors": ("actor_id", "actors"),
+    "movie_directors": ("director_id", "directors"),
+    "movie_genres": ("genre_id", "genres"),
+    "movie_musicians": ("musician_id", "musicians"),
+}
+# columns of the original layout computed from the stored ones in the compact layout
+GENERATED_COLUMNS = {
+    "const": "printf('tt%07d', imdb_id)",
+    "title_type": None,  # decodes type_id with the title_types dictionary, see add_title_types
+    "url": "'https://www.imdb.com/title/' || printf('tt%07d', imdb_id) || '/'",
+    "date_rated": "date(date_rated_epoch, 'unixepoch')",
+    "release_date": "date(release_date_epoch, 'unixepoch')",
+}
+# stored columns replacing const and title_type, with the SQL expression encoding them
+ENCODED_COLUMNS = {
+    "const": ("imdb_id", "CAST(substr(?, 3) AS INTEGER)"),
+    "title_type": ("type_id", "(SELECT type_id FROM title_types WHERE name = ?)"),
+}
+UNINDEXED_LINK_TABLES = {"movie_genres"}
+MAX_GENRE_BITS = 63  # bits of a positive sqlite integer
+
+
+def create_dictionary_tables(cursor) -> None:
+    """Creates the dictionaries of title types, numbered from 1 in TITLE_TYPES order, and of
+    genre bits, filled as genres get their first title."""
+    cursor.execute(
+        f"""CREATE TABLE IF NOT EXISTS genre_bits(
+            genre_id INTEGER PRIMARY KEY REFERENCES genres(genre_id),
+            bit INTEGER NOT NULL CHECK (bit BETWEEN 0 AND {MAX_GENRE_BITS - 1})
+        )"""
+    )
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS title_types(
+            type_id INTEGER PRIMARY KEY,
+            name TEXT UNIQUE
+        )"""
+    )
+    cursor.executemany(
+        """INSERT OR IGNORE INTO title_types (type_id, name) VALUES (?,?)""",
+        enumerate(TITLE_TYPES, 1),
+    )
+
+
+def title_type_expression(cursor) -> str:
+    """Returns the expression of the title_type column, mapping each type_id to its name."""
+    cases = []
+    for type_id, name in cursor.execute(
+        """SELECT type_id, name FROM title_types ORDER BY type_id"""
+    ):
+        quoted = name.replace("'", "''")
+        cases.append(f"WHEN {type_id} THEN '{quoted}'")
+    return f"CASE type_id {' '.join(cases)} END"
+
+
+def add_title_types(cursor, names: set) -> None:
+    """Adds the title types missing from the title_types dictionary.
+
+    SQLite does not allow subqueries in generated columns, so title_type cannot look the
+    dictionary up: it is redefined with the new types instead. A virtual column is not stored,
+    so dropping and adding it does not rewrite the table.
+
+    Parameters
+    ----------
+    cursor : Cursor
+        The SQL cursor to use
+    names : set
+        The names of the title types, None for titles without one
+    """
+    known = {row[0] for row in cursor.execute("""SELECT name FROM title_types""")}
+    new = sorted(set(names) - known - {None})
+    if not new:
+        return
+    cursor.executemany(
+        """INSERT INTO title_types (name) VALUES (?)""", [(name,) for name in new]
+    )
+    if is_compact_layout(cursor):
+        cursor.execute("""ALTER TABLE imdb_ratings DROP COLUMN title_type""")
+        cursor.execute(
+            f"""ALTER TABLE imdb_ratings ADD COLUMN title_type TEXT
+            GENERATED ALWAYS AS ({title_type_expression(cursor)}) VIRTUAL"""
+        )
+
+
+def create_compact_ratings_table(cursor, table_name: str = "imdb_ratings") -> None:
+    """Creates a ratings table with the compact layout.
+
+    Parameters
+    ----------
+    cursor : Cursor
+        The SQL cursor to use
+    table_name : str
+        The name of the table, which differs from imdb_ratings during a migration
+    """
+    generated = ",\n".join(
+        f"{column} TEXT GENERATED ALWAYS AS "
+        f"({expression or title_type_expression(cursor)}) VIRTUAL"
+        for column, expression in GENERATED_COLUMNS.items()
+    )
+    cursor.execute(
+        f"""CREATE TABLE IF NOT EXISTS {table_name}(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            imdb_id INTEGER NOT NULL,
+            type_id INTEGER REFERENCES title_types(type_id),
+            your_rating INTEGER,
+            title TEXT,
+            imdb_rating REAL,
+            runtime_mins INTEGER,
+            year INTEGER,
+            genres TEXT,
+            num_votes INTEGER,
+            directors TEXT,
+            cast TEXT,
+            date_rated_epoch INTEGER,
+            release_date_epoch INTEGER,
+            genre_mask INTEGER,
+            {generated}
+        )"""
+    )
+
+
+def create_compact_indexes(cursor) -> None:
+    """Creates the indexes of the compact imdb_ratings table."""
+    cursor.execute(
+        """CREATE UNIQUE INDEX IF NOT EXISTS idx_imdb_ratings_const
+        ON imdb_ratings(const)"""
+    )
+    for column in ("date_rated_epoch", "release_date_epoch"):
+        cursor.execute(
+            f"""CREATE INDEX IF NOT EXISTS idx_imdb_ratings_{column}
+            ON imdb_ratings({column})"""
+        )
+
+
+def create_link_table(cursor, table_name: str, columns: list) -> None:
+    """Creates a WITHOUT ROWID link table and, unless in UNINDEXED_LINK_TABLES, its reverse
+    covering index.
+
+    Parameters
+    ----------
+    cursor : Cursor
+        The SQL cursor to use
+    table_name : str
+        The name of the table to create
+    columns : list
+        The id column of the linked entries and the table holding them
+    """
+    column_id, target = columns
+    cursor.execute(
+        f"""CREATE TABLE IF NOT EXISTS {table_name}(
+            movie_id INTEGER NOT NULL,
+            {column_id} INTEGER NOT NULL,
+            PRIMARY KEY(movie_id, {column_id}),
+            FOREIGN KEY(movie_id) REFERENCES imdb_ratings(id),
+            FOREIGN KEY({column_id}) REFERENCES {target}({column_id})
+        ) WITHOUT ROWID"""
+    )
+    if table_name in UNINDEXED_LINK_TABLES:
+        return
+    cursor.execute(
+        f"""CREATE INDEX IF NOT EXISTS idx_{table_name}_{column_id}
+        ON {table_name}({column_id}, movie_id)"""
+    )
+
+
+def table_columns(cursor, table_name: str) -> list:
+    """Returns the columns of a table, generated ones included."""
+    return [
+        row[1]
+        for row in cursor.execute(f"PRAGMA table_xinfo({table_name})")
+        if row[6] != 1  # hidden columns of virtual tables
+    ]
+
+
+def is_compact_layout(cursor) -> bool:
+    """Returns whether the imdb_ratings table of the database has the compact layout."""
+    return "imdb_id" in table_columns(cursor, "imdb_ratings")
+
+
+def insert_titles(cursor, columns: list, rows: list) -> int:
+    """Inserts titles given with the columns of the original layout, whatever the layout.
+
+    In the compact layout, const and title_type are encoded into imdb_id and type_id, and the
+    other generated columns are left out: url is derived from const and the TEXT dates from
+    their epochs, which must therefore be among the columns.
+
+    Parameters
+    ----------
+    cursor : Cursor
+        The SQL cursor to use
+    columns : list
+        The names of the inserted columns, e.g. const, title, title_type, date_rated_epoch
+    rows : list
+        The values of the titles, in the order of columns
+
+    Returns
+    ----------
+    int
+        The id of the last inserted title
+    """
+    targets, expressions, kept = [], [], []
+    compact = is_compact_layout(cursor)
+    for i, column in enumerate(columns):
+        if not compact:
+            targets.append(column)
+            expressions.append("?")
+        elif column in ENCODED_COLUMNS:
+            target, expression = ENCODED_COLUMNS[column]
+            targets.append(target)
+            expressions.append(expression)
+        elif column in GENERATED_COLUMNS:
+            continue
+        else:
+            targets.append(column)
+            expressions.append("?")
+        kept.append(i)
+    if compact and "const" in columns:
+        position = columns.index("const")
+        for row in rows:
+            const = row[position]
+            digits = (const or "")[2:]
+            if not digits.isdigit() or f"tt{int(digits):07d}" != const:
+                raise ValueError(f"{const!r} is not an IMDb id of the form tt0000000")
+    if compact and "title_type" in columns:
+        position = columns.index("title_type")
+        add_title_types(cursor, {row[position] for row in rows})
+    query = f"""INSERT INTO imdb_ratings ({', '.join(f'"{c}"' for c in targets)})
+        VALUES ({', '.join(expressions)})"""
+    rows = [tuple(row[i] for i in kept) for row in rows]
+    if len(rows) == 1:
+        cursor.execute(query, rows[0])
+    else:
+        cursor.executemany(query, rows)
+    return cursor.lastrowid
+
+
+def update_genre_masks(cursor, movie_id: int = None) -> None:
+    """Recomputes the genre_mask of a title, or of every title if movie_id is None.
+
+    Genres without a bit first get one: genres whose names only differ by surrounding
+    whitespace share a bit, and new names get the next free bit. Only the first MAX_GENRE_BITS
+    names get a bit (IMDb has less than 30). Does nothing in the original layout, which has no
+    genre_mask column.
+    """
+    if not is_compact_layout(cursor):
+        return
+    bits = dict(
+        cursor.execute(
+            """SELECT TRIM(genres.name), bit FROM genre_bits
+            JOIN genres ON genre_bits.genre_id = genres.genre_id"""
+        ).fetchall()
+    )
+    new_genres = cursor.execute(
+        """SELECT genre_id, TRIM(name) FROM genres
+        WHERE genre_id NOT IN (SELECT genre_id FROM genre_bits) ORDER BY genre_id"""
+    ).fetchall()
+    for genre_id, name in new_genres:
+        bit = bits.setdefault(name, len(bits))
+        if bit < MAX_GENRE_BITS:
+            cursor.execute(
+                """INSERT INTO genre_bits (genre_id, bit) VALUES (?,?)""",
+                (genre_id, bit),
+            )
+    # a title may have two genres sharing a bit, so only its distinct bits are summed
+    cursor.execute(
+        f"""UPDATE imdb_ratings SET genre_mask = (
+            SELECT COALESCE(SUM(DISTINCT 1 << bit), 0) FROM movie_genres
+            JOIN genre_bits ON movie_genres.genre_id = genre_bits.genre_id
+            WHERE movie_genres.movie_id = imdb_ratings.id
+        ) {'' if movie_id is None else 'WHERE id = ?'}""",
+        () if movie_id is None else (movie_id,),
+    )
+
+
+def mask_of_genres(cursor, genres: list) -> int:
+    """Returns the mask of the titles having all the given genres, None if one has no bit.
+
+    Titles having the genres are those WHERE genre_mask & mask = mask.
+
+    Parameters
+    ----------
+    cursor : Cursor
+        The SQL cursor to use
+    genres : list
+        The names of the genres
+
+    Returns
+    ----------
+    int
+        The union of the bits of the genres
+    """
+    bits = cursor.execute(
+        f"""SELECT DISTINCT bit FROM genre_bits
+        JOIN genres ON genre_bits.genre_id = genres.genre_id
+        WHERE TRIM(genres.name) IN ({','.join('?' * len(genres))})""",
+        [genre.strip() for genre in genres],
+    ).fetchall()
+    if len(bits) < len({genre.strip() for genre in genres}):
+        return None
+    return sum(1 << bit for (bit,) in bits)
+
+
+def migrate_to_compact(db_name: str) -> tuple:
+    """Converts a database with the original layout to the compact layout, then vacuums it.
+
+    Ids are preserved, so the links, the search index, the sketches and the saved graph remain
+    valid. The conversion runs in a single transaction: the database is left untouched if it
+    fails. The change log records a load of every converted table.
+
+    Parameters
+    ----------
+    db_name : str
+        The name of the database to migrate
+
+    Returns
+    ----------
+    tuple
+        The size of the database file in bytes before and after the migration
+    """
+    before = os.path.getsize(db_name)
+    conn = connect(db_name, isolation_level=None)
+    cursor = conn.cursor()
+    try:
+        if is_compact_layout(cursor):
+            return before, before
+        types = {
+            row[0]
+            for row in cursor.execute(
+                """SELECT DISTINCT title_type FROM imdb_ratings"""
+            )
+        }
+        invalid = cursor.execute(
+            """SELECT const FROM imdb_ratings
+            WHERE const IS NULL OR printf('tt%07d', CAST(substr(const, 3) AS INTEGER)) != const
+            LIMIT 1"""
+        ).fetchone()
+        if invalid:
+            raise ValueError(f"{invalid[0]!r} is not an IMDb id of the form tt0000000")
+
+        cursor.execute("BEGIN")
+        drop_change_triggers(cursor)
+        create_dictionary_tables(cursor)
+        add_title_types(cursor, types)
+        create_compact_ratings_table(cursor, "imdb_ratings_compact")
+        cursor.execute(
+            """INSERT INTO imdb_ratings_compact (
+                id, imdb_id, type_id, your_rating, title, imdb_rating, runtime_mins, year,
+                genres, num_votes, directors, "cast", date_rated_epoch, release_date_epoch
+            )
+            SELECT id, CAST(substr(const, 3) AS INTEGER),
+            (SELECT type_id FROM title_types WHERE name = title_type),
+            your_rating, title, imdb_rating, runtime_mins, year, genres, num_votes,
+            directors, "cast",
+            COALESCE(date_rated_epoch, CAST(strftime('%s', date_rated) AS INTEGER)),
+            COALESCE(release_date_epoch, CAST(strftime('%s', release_date) AS INTEGER))
+            FROM imdb_ratings"""
+        )
+        sequence = cursor.execute(
+            """SELECT seq FROM sqlite_sequence WHERE name = 'imdb_ratings'"""
+        ).fetchone()
+        cursor.execute("""DROP TABLE imdb_ratings""")
+        cursor.execute("""ALTER TABLE imdb_ratings_compact RENAME TO imdb_ratings""")
+        if sequence:  # keeps the ids of deleted titles from being reused
+            cursor.execute(
+                """UPDATE sqlite_sequence SET seq = MAX(seq, ?)
+                WHERE name = 'imdb_ratings'""",
+                sequence,
+            )
+        create_compact_indexes(cursor)
+        migrated = ["imdb_ratings"]
+
+        tables = {
+            row[0]
+            for row in cursor.execute(
+                """SELECT name FROM sqlite_master WHERE type = 'table'"""
+            )
+        }
+        for table_name, columns in LINK_TABLES.items():
+            if table_name not in tables:
+                continue
+            column_id = columns[0]
+            create_link_table(cursor, f"{table_name}_compact", columns)
+            # the reverse index is created once the table is renamed and filled
+            cursor.execute(
+                f"""DROP INDEX IF EXISTS idx_{table_name}_compact_{column_id}"""
+            )
+            cursor.execute(
+                f"""INSERT OR IGNORE INTO {table_name}_compact (movie_id, {column_id})
+                SELECT movie_id, {column_id} FROM {table_name}
+                WHERE movie_id IS NOT NULL AND {column_id} IS NOT NULL
+                ORDER BY movie_id, {column_id}"""
+            )
+            cursor.execute(f"""DROP TABLE {table_name}""")
+            cursor.execute(
+                f"""ALTER TABLE {table_name}_compact RENAME TO {table_name}"""
+            )
+            create_link_table(cursor, table_name, columns)
+            migrated.append(table_name)
+        update_genre_masks(cursor)
+
+        create_change_log(cursor)
+        for table_name in migrated:
+            record_load(cursor, table_name)
+        cursor.execute("COMMIT")
+    except Exception:
+        if conn.in_transaction:
+            cursor.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+    index = SearchIndex(db_name)
+    if "search_words" in existing_tables(index.cursor):
+        index.create_triggers("title")  # they were dropped with the old table
+        index.conn.commit()
+    del index
+    conn = connect(db_name)
+    conn.execute("VACUUM")
+    conn.close()
+    return before, os.path.getsize(db_name)
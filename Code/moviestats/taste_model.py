@@ -0,0 +1,269 @@
+"""This module models how personal ratings deviate from IMDb ratings.
+
+Each title is described by a sparse vector of binary features: its genres, its directors and
+actors (only those credited on enough rated titles), its decade and its runtime bucket. A ridge
+regression of your_rating - imdb_rating on these features is fitted with the sparse LSQR solver,
+whose damping is the ridge penalty, so the design matrix is never densified.
+
+The coefficient of a feature is the number of points it adds to or removes from the IMDb rating
+of a title, all other features being equal. Adding the predicted deviation to the IMDb rating
+of an unrated title predicts its personal rating.
+"""
+
+from typing import NamedTuple
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.linalg import lsqr
+
+from Code.moviestats.ratings_analyser import POSITIVE_INT_ERR_MESSAGE, RatingsAnalyser
+
+
+RUNTIME_BUCKETS = [60, 90, 120, 150, 180]  # upper bounds in minutes, the last is open
+MIN_TITLES = 3
+MAX_PEOPLE = 1000
+ALPHA = 1.0
+PEOPLE_FEATURES = {
+    "director": ("directors", "director_id", "movie_directors"),
+    "actor": ("actors", "actor_id", "movie_actors"),
+}
+
+
+class FeatureEffect(NamedTuple):
+    """A feature, the number of rated titles having it and its effect on the rating gap."""
+
+    feature: str
+    count: int
+    effect: float
+
+
+class PredictedRating(NamedTuple):
+    """An unrated title with its IMDb rating and predicted personal rating."""
+
+    title: str
+    imdb_rating: float
+    predicted_rating: float
+
+
+class TasteModel:
+    """A regularised linear model of the gap between personal and IMDb ratings.
+
+    Parameters
+    ----------
+    analyser : RatingsAnalyser
+        The analyser whose (possibly user scoped) ratings are modelled
+    alpha : float
+        The ridge penalty. Larger values shrink the effects of rare features towards 0
+    min_titles : int
+        The number of rated titles a director or actor needs to become a feature
+    max_people : int
+        The maximum number of directors and of actors kept as features, most frequent first
+    """
+
+    def __init__(
+        self,
+        analyser: RatingsAnalyser,
+        alpha: float = ALPHA,
+        min_titles: int = MIN_TITLES,
+        max_people: int = MAX_PEOPLE,
+    ):
+        if alpha < 0:
+            raise ValueError("alpha must be non-negative")
+        self.analyser = analyser
+        self.alpha = alpha
+        self.min_titles = min_titles
+        self.max_people = max_people
+        self.features = np.empty(0, dtype=object)
+        self.coefficients = np.empty(0)
+        self.intercept = 0.0
+        self.r_squared = None
+        self._design = None
+
+    def _title_features(self) -> tuple:
+        """Builds the design matrix of every title of the database.
+
+        Returns
+        ----------
+        tuple
+            The title ids, titles and IMDb ratings, the sparse design matrix (one row per title)
+            and the name of each of its columns
+        """
+        # main.imdb_ratings lists every title, also when the analyser is scoped to a user
+        rows = self.analyser.cursor.execute(
+            """SELECT id, title, imdb_rating, year, runtime_mins
+            FROM main.imdb_ratings ORDER BY id"""
+        ).fetchall()
+        if not rows:
+            raise ValueError("there are no rated titles to fit the model on")
+        ids, titles, imdb_ratings, years, runtimes = zip(*rows)
+        ids = np.array(ids, dtype=np.int64)
+        rows, names = [], []
+
+        def add(title_ids: np.ndarray, values: np.ndarray) -> None:
+            positions = np.searchsorted(ids, title_ids)
+            known = positions < len(ids)
+            known[known] = ids[positions[known]] == title_ids[known]
+            rows.append(positions[known])
+            names.append(values[known])
+
+        years = np.array(years, dtype=np.float64)
+        has_year = ~np.isnan(years)
+        decades = (years[has_year] // 10 * 10).astype(np.int64)
+        add(ids[has_year], np.array([f"decade:{d}s" for d in decades], dtype=object))
+
+        runtimes = np.array(runtimes, dtype=np.float64)
+        has_runtime = ~np.isnan(runtimes)
+        buckets = np.digitize(runtimes[has_runtime], RUNTIME_BUCKETS, right=True)
+        labels = [f"runtime:<={bound}" for bound in RUNTIME_BUCKETS]
+        labels.append(f"runtime:>{RUNTIME_BUCKETS[-1]}")
+        add(ids[has_runtime], np.array(labels, dtype=object)[buckets])
+
+        pairs = [
+            (
+                "genre",
+                """SELECT movie_genres.movie_id, TRIM(genres.name) FROM movie_genres
+                JOIN genres ON movie_genres.genre_id = genres.genre_id""",
+            )
+        ]
+        for kind, (table_name, column_id, link_table) in PEOPLE_FEATURES.items():
+            pairs.append(
+                (
+                    kind,
+                    f"""SELECT {link_table}.movie_id, {table_name}.name FROM {link_table}
+                    JOIN {table_name} ON {link_table}.{column_id} = {table_name}.{column_id}
+                    WHERE {link_table}.{column_id} IN (
+                        SELECT {column_id} FROM {link_table}
+                        JOIN imdb_ratings ON imdb_ratings.id = {link_table}.movie_id
+                        WHERE imdb_ratings.your_rating IS NOT NULL
+                        GROUP BY {column_id} HAVING COUNT(*) >= {int(self.min_titles)}
+                        ORDER BY COUNT(*) DESC LIMIT {int(self.max_people)}
+                    )""",
+                )
+            )
+        for kind, query in pairs:
+            links = self.analyser._execute(  # pylint: disable=protected-access
+                query
+            ).fetchall()
+            if links:
+                title_ids, values = zip(*links)
+                add(
+                    np.array(title_ids, dtype=np.int64),
+                    np.array([f"{kind}:{value}" for value in values], dtype=object),
+                )
+
+        rows = np.concatenate(rows) if rows else np.empty(0, dtype=np.int64)
+        names = np.concatenate(names) if names else np.empty(0, dtype=object)
+        features, columns = np.unique(names.astype(str), return_inverse=True)
+        design = csr_matrix(
+            (np.ones(len(rows)), (rows, columns)), shape=(len(ids), len(features))
+        )
+        design.data[:] = 1.0  # a title credited twice with the same feature has it once
+        return (
+            ids,
+            np.array(titles, dtype=object),
+            np.array(imdb_ratings, dtype=np.float64),
+            design,
+            features,
+        )
+
+    def _personal_ratings(self, ids: np.ndarray) -> np.ndarray:
+        """Returns the personal rating of each title of ids in the analyser scope, NaN if unrated."""
+        ratings = np.full(len(ids), np.nan)
+        rows = self.analyser._execute(  # pylint: disable=protected-access
+            """SELECT id, your_rating FROM imdb_ratings WHERE your_rating IS NOT NULL"""
+        ).fetchall()
+        if rows:
+            rated_ids, values = np.array(rows, dtype=np.float64).T
+            positions = np.searchsorted(ids, rated_ids.astype(np.int64))
+            ratings[positions] = values
+        return ratings
+
+    def fit(self) -> "TasteModel":
+        """Fits the model on the titles having both a personal and an IMDb rating.
+
+        Returns
+        ----------
+        TasteModel
+            The fitted model itself
+        """
+        ids, self._titles, self._imdb_ratings, design, self.features = (
+            self._title_features()
+        )
+        self._personal = self._personal_ratings(ids)
+        self._design = design
+        self._train = ~np.isnan(self._personal) & ~np.isnan(self._imdb_ratings)
+        if not self._train.any():
+            raise ValueError("there are no rated titles to fit the model on")
+        gaps = (self._personal - self._imdb_ratings)[self._train]
+        train_design = design[self._train]
+        self.intercept = float(gaps.mean())
+        self.coefficients = lsqr(
+            train_design, gaps - self.intercept, damp=np.sqrt(self.alpha)
+        )[0]
+        self._counts = np.asarray(train_design.sum(axis=0)).ravel().astype(np.int64)
+        residuals = gaps - self.intercept - train_design @ self.coefficients
+        total = ((gaps - self.intercept) ** 2).sum()
+        self.r_squared = float(1 - (residuals**2).sum() / total) if total else None
+        return self
+
+    def _check_fitted(self) -> None:
+        if self._design is None:
+            raise ValueError("the model must be fitted first")
+
+    def get_feature_effects(self, top_n: int = 10, above: bool = True) -> list:
+        """Gets the features that push personal ratings furthest above or below IMDb ratings.
+
+        Parameters
+        ----------
+        top_n : int
+            the number of features to return
+        above : bool
+            if True, return the features raising personal ratings. Otherwise, those lowering them
+
+        Returns
+        ----------
+        list[FeatureEffect]
+            The features with their number of rated titles and their effect in rating points
+        """
+        if top_n < 1:
+            raise ValueError(POSITIVE_INT_ERR_MESSAGE)
+        self._check_fitted()
+        order = np.argsort(-self.coefficients if above else self.coefficients)
+        order = order[self._counts[order] > 0][:top_n]
+        return [
+            FeatureEffect(
+                str(self.features[i]), int(self._counts[i]), float(self.coefficients[i])
+            )
+            for i in order
+        ]
+
+    def predict(self, top_n: int = None) -> list:
+        """Predicts the personal rating of every unrated title that has an IMDb rating.
+
+        All predictions are computed at once with a single sparse matrix-vector product.
+
+        Parameters
+        ----------
+        top_n : int
+            the number of titles to return, best predicted first. All if None
+
+        Returns
+        ----------
+        list[PredictedRating]
+            The unrated titles with their predicted personal rating, best first
+        """
+        self._check_fitted()
+        unrated = np.isnan(self._personal) & ~np.isnan(self._imdb_ratings)
+        predicted = np.clip(
+            self._imdb_ratings[unrated]
+            + self.intercept
+            + self._design[unrated] @ self.coefficients,
+            1,
+            10,
+        )
+        order = np.argsort(-predicted, kind="stable")[:top_n]
+        titles, imdb_ratings = self._titles[unrated], self._imdb_ratings[unrated]
+        return [
+            PredictedRating(titles[i], float(imdb_ratings[i]), float(predicted[i]))
+            for i in order
+        ]
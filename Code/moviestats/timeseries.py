@@ -0,0 +1,219 @@
+"""This module provides time-based statistics over the dates at which titles were rated.
+
+The ratings are loaded once, ordered by their indexed date_rated_epoch column, into NumPy
+arrays; every statistic is then a vectorised resampling of these arrays into calendar periods.
+New ratings are appended incrementally by refresh, which only reads the rows rated after the
+latest rating already loaded.
+"""
+
+import numpy as np
+from Code.moviestats.ratings_analyser import RatingsAnalyser
+from Code.moviestats.records import TimeSeries
+
+
+PERIODS = {
+    "D": "datetime64[D]",
+    "W": "datetime64[W]",
+    "M": "datetime64[M]",
+    "Y": "datetime64[Y]",
+}
+
+
+class RatingsTimeSeries:
+    """A class to compute rating activity and taste drift over time.
+
+    Parameters
+    ----------
+    analyser : RatingsAnalyser
+        The analyser whose database holds the ratings
+    """
+
+    def __init__(self, analyser: RatingsAnalyser):
+        self.analyser = analyser
+        # (date_rated_epoch, id) of the latest loaded rating
+        self.watermark = (-(2**63), 0)
+        self.rated_at = np.empty(0, dtype="datetime64[s]")
+        self.your_ratings = np.empty(0, dtype=np.float64)
+        self.imdb_ratings = np.empty(0, dtype=np.float64)
+        self.runtimes = np.empty(0, dtype=np.float64)
+        self.is_movie = np.empty(0, dtype=bool)
+        self.refresh()
+
+    def __len__(self) -> int:
+        return len(self.rated_at)
+
+    def refresh(self) -> int:
+        """Loads the ratings added to the database since the last load.
+
+        Ratings are read past a (date, id) watermark rather than by id, since a user profile can
+        rate a title that was added to the database long ago. Ratings dated before the latest
+        loaded one are therefore not picked up: they only show up in a new RatingsTimeSeries.
+
+        Returns
+        ----------
+        int
+            The number of new ratings
+        """
+        rows = self.analyser._execute(  # pylint: disable=protected-access
+            """SELECT id, date_rated_epoch, your_rating, imdb_rating, runtime_mins,
+            title_type = 'movie' FROM imdb_ratings
+            WHERE (date_rated_epoch, id) > (?, ?) ORDER BY date_rated_epoch, id""",
+            self.watermark,
+        ).fetchall()
+        if not rows:
+            return 0
+        ids, epochs, your_ratings, imdb_ratings, runtimes, is_movie = zip(*rows)
+        self.watermark = (epochs[-1], ids[-1])
+
+        rated_at = np.concatenate(
+            [self.rated_at, np.array(epochs, dtype="datetime64[s]")]
+        )
+        order = np.argsort(rated_at, kind="stable")
+        self.rated_at = rated_at[order]
+        self.your_ratings = np.concatenate(
+            [self.your_ratings, np.array(your_ratings, dtype=np.float64)]
+        )[order]
+        self.imdb_ratings = np.concatenate(
+            [self.imdb_ratings, np.array(imdb_ratings, dtype=np.float64)]
+        )[order]
+        self.runtimes = np.concatenate(
+            [self.runtimes, np.array(runtimes, dtype=np.float64)]
+        )[order]
+        self.is_movie = np.concatenate([self.is_movie, np.array(is_movie, dtype=bool)])[
+            order
+        ]
+        return len(rows)
+
+    def _resample(
+        self, values: np.ndarray, period: str, mask: np.ndarray = None
+    ) -> tuple:
+        """Sums values and counts them per period, over a contiguous range of periods.
+
+        Parameters
+        ----------
+        values : np.ndarray
+            The values to aggregate, aligned with self.rated_at. NaNs are ignored
+        period : str
+            The period length: D (day), W (week), M (month) or Y (year)
+        mask : np.ndarray
+            The entries to aggregate. All if None
+
+        Returns
+        ----------
+        tuple
+            The periods, and the sum and count of the values in each period
+        """
+        if period not in PERIODS:
+            raise ValueError(f"period must be one of {', '.join(PERIODS)}")
+        keep = ~np.isnan(values) if mask is None else mask & ~np.isnan(values)
+        buckets = self.rated_at[keep].astype(PERIODS[period])
+        if not len(buckets):
+            return np.empty(0, dtype=PERIODS[period]), np.empty(0), np.empty(0)
+        first = buckets[0]  # rated_at is sorted, so the buckets are too
+        offsets = (buckets - first).astype(np.int64)
+        periods = first + np.arange(offsets[-1] + 1)
+        sums = np.bincount(offsets, weights=values[keep], minlength=len(periods))
+        counts = np.bincount(offsets, minlength=len(periods)).astype(np.float64)
+        return periods, sums, counts
+
+    def ratings_per_period(self, period: str = "M") -> TimeSeries:
+        """Gets the number of titles rated in each period.
+
+        Parameters
+        ----------
+        period : str
+            The period length: D (day), W (week), M (month) or Y (year)
+
+        Returns
+        ----------
+        TimeSeries
+            The number of ratings of each period, including periods without any
+        """
+        periods, _, counts = self._resample(self.your_ratings, period)
+        return TimeSeries(periods, counts)
+
+    def mean_rating_per_period(self, period: str = "M") -> TimeSeries:
+        """Gets the mean personal rating of the titles rated in each period.
+
+        Parameters
+        ----------
+        period : str
+            The period length: D (day), W (week), M (month) or Y (year)
+
+        Returns
+        ----------
+        TimeSeries
+            The mean rating of each period, NaN for periods without ratings
+        """
+        periods, sums, counts = self._resample(self.your_ratings, period)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return TimeSeries(periods, sums / counts)
+
+    def _rolling_mean(self, values: np.ndarray, window: int, period: str) -> TimeSeries:
+        """Computes the mean of values over the last window periods, for each period."""
+        if window < 1:
+            raise ValueError("window must be a positive integer")
+        periods, sums, counts = self._resample(values, period)
+        sums = np.concatenate([[0.0], np.cumsum(sums)])
+        counts = np.concatenate([[0.0], np.cumsum(counts)])
+        start = np.maximum(np.arange(len(periods)) + 1 - window, 0)
+        end = np.arange(1, len(periods) + 1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return TimeSeries(
+                periods, (sums[end] - sums[start]) / (counts[end] - counts[start])
+            )
+
+    def rolling_mean_rating(self, window: int = 12, period: str = "M") -> TimeSeries:
+        """Gets the mean personal rating over a rolling window of periods.
+
+        Parameters
+        ----------
+        window : int
+            The number of periods covered by each mean
+        period : str
+            The period length: D (day), W (week), M (month) or Y (year)
+
+        Returns
+        ----------
+        TimeSeries
+            For each period, the mean rating of the titles rated in the window ending with it
+        """
+        return self._rolling_mean(self.your_ratings, window, period)
+
+    def rolling_rating_gap(self, window: int = 12, period: str = "M") -> TimeSeries:
+        """Gets the mean difference between personal and IMDb ratings over a rolling window.
+
+        Parameters
+        ----------
+        window : int
+            The number of periods covered by each mean
+        period : str
+            The period length: D (day), W (week), M (month) or Y (year)
+
+        Returns
+        ----------
+        TimeSeries
+            For each period, the mean of your_rating - imdb_rating over the window ending with it
+        """
+        return self._rolling_mean(self.your_ratings - self.imdb_ratings, window, period)
+
+    def watch_hours_per_period(
+        self, period: str = "M", movies_only: bool = True
+    ) -> TimeSeries:
+        """Gets the runtime of the titles rated in each period, in hours.
+
+        Parameters
+        ----------
+        period : str
+            The period length: D (day), W (week), M (month) or Y (year)
+        movies_only : bool
+            if True, only movies are counted, as in get_total_movie_watching_time
+
+        Returns
+        ----------
+        TimeSeries
+            The watch hours of each period. Titles without a runtime are ignored
+        """
+        mask = self.is_movie if movies_only else None
+        periods, sums, _ = self._resample(self.runtimes, period, mask)
+        return TimeSeries(periods, sums / 60)
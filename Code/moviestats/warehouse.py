@@ -0,0 +1,339 @@
+"""This module exports the ratings database to columnar Arrow or Parquet files and imports it back.
+
+Every table is written to its own file of the snapshot directory, e.g. imdb_ratings.arrow. Rows
+are streamed from sqlite in batches of batch_size, each written as a record batch (Arrow IPC) or a
+row group (Parquet), so that tables larger than memory can be exported. Repetitive text columns
+are dictionary-encoded with one dictionary per column that grows across batches.
+
+Arrow IPC files are memory-mappable: reading them back with read_snapshot_table does not copy
+the data, which is what ArrowRatingsAnalyser relies on to query a snapshot directly.
+"""
+
+from pathlib import Path
+from sqlite3 import connect
+
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+
+
+WAREHOUSE_TABLES = [
+    "imdb_ratings",
+    "actors",
+    "directors",
+    "genres",
+    "musicians",
+    "movie_actors",
+    "movie_directors",
+    "movie_genres",
+    "movie_musicians",
+    "users",
+    "user_ratings",
+]
+DICTIONARY_COLUMNS = {"name", "title_type", "genres", "directors"}
+# columns of the compact layout that are encodings of exported columns (see storage.py)
+STORAGE_COLUMNS = {"imdb_id", "type_id", "genre_mask"}
+SQLITE_TYPES = {
+    "INTEGER": pa.int64(),
+    "REAL": pa.float64(),
+    "TEXT": pa.string(),
+    "BLOB": pa.binary(),
+}
+ARROW_TYPES = {
+    pa.int64(): "INTEGER",
+    pa.float64(): "REAL",
+    pa.string(): "TEXT",
+    pa.binary(): "BLOB",
+}
+FORMATS = {"arrow": ".arrow", "parquet": ".parquet"}
+BATCH_SIZE = 65_536
+
+
+def quote(columns: list) -> str:
+    """Returns the quoted, comma-separated column names (imdb_ratings has a cast column)."""
+    return ", ".join(f'"{column}"' for column in columns)
+
+
+def table_schema(cursor, table_name: str) -> pa.Schema:
+    """Returns the Arrow schema of a sqlite table, with DICTIONARY_COLUMNS dictionary-encoded.
+
+    The schema has the columns of the original layout whatever the layout of the table, so a
+    snapshot of a compact database (see storage.py) has its generated const, title_type, url and
+    dates rather than the encoded imdb_id and type_id.
+
+    Parameters
+    ----------
+    cursor : Cursor
+        The cursor of the database holding the table
+    table_name : str
+        The name of the table
+
+    Returns
+    ----------
+    pa.Schema
+        One field per column of the table
+    """
+    fields = []
+    for _, name, column_type, *_, hidden in cursor.execute(
+        f"PRAGMA table_xinfo({table_name})"
+    ):
+        if hidden == 1 or name in STORAGE_COLUMNS:
+            continue
+        arrow_type = SQLITE_TYPES.get(column_type.upper(), pa.string())
+        if name in DICTIONARY_COLUMNS and arrow_type == pa.string():
+            arrow_type = pa.dictionary(pa.int32(), pa.string())
+        fields.append(pa.field(name, arrow_type))
+    return pa.schema(fields)
+
+
+class DictionaryEncoder:
+    """Encodes the values of a column against a dictionary shared by all of its batches.
+
+    New values are appended to the dictionary, so each batch's dictionary extends that of the
+    previous batch and only the new entries are written to Arrow IPC files (dictionary deltas).
+    """
+
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def encode(self, values: tuple) -> pa.DictionaryArray:
+        """Returns the values as indices into the dictionary, extending it if needed."""
+        indices = []
+        for value in values:
+            if value is None:
+                indices.append(None)
+                continue
+            code = self.codes.get(value)
+            if code is None:
+                code = self.codes[value] = len(self.values)
+                self.values.append(value)
+            indices.append(code)
+        return pa.DictionaryArray.from_arrays(
+            pa.array(indices, pa.int32()), pa.array(self.values, pa.string())
+        )
+
+
+def iter_record_batches(cursor, table_name: str, schema: pa.Schema, batch_size: int):
+    """Streams the rows of a sqlite table as record batches of at most batch_size rows.
+
+    Yields
+    ----------
+    pa.RecordBatch
+        The next batch of rows, in rowid order
+    """
+    encoders = {
+        field.name: DictionaryEncoder()
+        for field in schema
+        if pa.types.is_dictionary(field.type)
+    }
+    rows = cursor.execute(f"""SELECT {quote(schema.names)} FROM {table_name}""")
+    while batch := rows.fetchmany(batch_size):
+        columns = zip(*batch)
+        yield pa.record_batch(
+            [
+                (
+                    encoders[field.name].encode(values)
+                    if field.name in encoders
+                    else pa.array(values, field.type)
+                )
+                for field, values in zip(schema, columns)
+            ],
+            schema=schema,
+        )
+
+
+def export_database(
+    db_name: str, directory: str, fmt: str = "arrow", batch_size: int = BATCH_SIZE
+) -> dict:
+    """Exports the tables of a sqlite database to one Arrow IPC or Parquet file each.
+
+    Parameters
+    ----------
+    db_name : str
+        The name of the database to export
+    directory : str
+        The directory to write the files to, created if missing
+    fmt : str
+        arrow (memory-mappable Arrow IPC files) or parquet (compressed, one row group per batch)
+    batch_size : int
+        The number of rows read from sqlite and written at once
+
+    Returns
+    ----------
+    dict
+        Maps each exported table to its number of rows
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"fmt must be one of {', '.join(FORMATS)}")
+    if batch_size < 1:
+        raise ValueError("batch_size must be a positive integer")
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    conn = connect(db_name)
+    cursor = conn.cursor()
+    tables = {
+        row[0]
+        for row in cursor.execute(
+            """SELECT name FROM sqlite_master WHERE type = 'table'"""
+        )
+    }
+    exported = {}
+    for table_name in WAREHOUSE_TABLES:
+        if table_name not in tables:
+            continue
+        schema = table_schema(cursor, table_name)
+        path = directory / f"{table_name}{FORMATS[fmt]}"
+        if fmt == "arrow":
+            writer = ipc.new_file(
+                path, schema, options=ipc.IpcWriteOptions(emit_dictionary_deltas=True)
+            )
+        else:
+            writer = pq.ParquetWriter(path, schema)
+        exported[table_name] = 0
+        with writer:
+            for batch in iter_record_batches(
+                conn.cursor(), table_name, schema, batch_size
+            ):
+                if fmt == "arrow":
+                    writer.write_batch(batch)
+                else:
+                    writer.write_batch(batch, row_group_size=batch_size)
+                exported[table_name] += batch.num_rows
+    conn.close()
+    return exported
+
+
+def snapshot_files(directory: str) -> dict:
+    """Maps the name of each table of a snapshot directory to its file."""
+    files = {}
+    for table_name in WAREHOUSE_TABLES:
+        for extension in FORMATS.values():
+            path = Path(directory) / f"{table_name}{extension}"
+            if path.exists():
+                files[table_name] = path
+    return files
+
+
+def read_snapshot_table(path: Path) -> pa.Table:
+    """Reads a snapshot table. Arrow IPC files are memory-mapped rather than copied.
+
+    Each Parquet row group has its own dictionaries, which are unified so that the columns of
+    the table can be joined on.
+    """
+    if path.suffix == FORMATS["arrow"]:
+        return ipc.open_file(pa.memory_map(str(path))).read_all()
+    return pq.read_table(path, memory_map=True).unify_dictionaries()
+
+
+def iter_snapshot_batches(path: Path, batch_size: int = BATCH_SIZE):
+    """Streams the rows of a snapshot table as record batches."""
+    if path.suffix == FORMATS["arrow"]:
+        reader = ipc.open_file(pa.memory_map(str(path)))
+        for i in range(reader.num_record_batches):
+            yield reader.get_batch(i)
+    else:
+        yield from pq.ParquetFile(path, memory_map=True).iter_batches(batch_size)
+
+
+def batch_rows(batch: pa.RecordBatch, columns: list) -> list:
+    """Returns the given columns of a record batch as rows of Python values."""
+    return list(zip(*(batch.column(column).to_pylist() for column in columns)))
+
+
+def import_snapshot(
+    directory: str,
+    db_name: str = None,
+    backend: str = "sqlite",
+    batch_size: int = BATCH_SIZE,
+) -> dict:
+    """Bulk-loads a snapshot into an empty sqlite or MySQL database.
+
+    Rows keep their ids, so the links between titles, people and genres are preserved. Each
+    table is inserted batch by batch, within a single sqlite transaction. The change log triggers
+    are suspended during the load, which records one load change per table instead. Titles are
+    inserted with storage.insert_titles, so a snapshot loads into either storage layout.
+
+    Parameters
+    ----------
+    directory : str
+        The snapshot directory written by export_database
+    db_name : str
+        The name of the sqlite database to create. Unused with the mysql backend
+    backend : str
+        sqlite or mysql
+    batch_size : int
+        The number of rows inserted at once
+
+    Returns
+    ----------
+    dict
+        Maps each imported table to its number of rows
+    """
+    files = snapshot_files(directory)
+    if not files:
+        raise ValueError(f"no snapshot tables found in {directory}")
+    if backend == "mysql":
+        from Code.moviestats.db import MySQLDatabaseHandler
+
+        handler = MySQLDatabaseHandler()
+        handler.create_db_tables()
+        imported = {}
+        for table_name, path in files.items():
+            target_columns = handler.table_columns(table_name)
+            if not target_columns:
+                continue
+            imported[table_name] = 0
+            for batch in iter_snapshot_batches(path, batch_size):
+                columns = [c for c in batch.schema.names if c in target_columns]
+                handler.bulk_insert(table_name, columns, batch_rows(batch, columns))
+                imported[table_name] += batch.num_rows
+        return imported
+
+    from Code.moviestats.changes import (
+        create_change_log,
+        drop_change_triggers,
+        record_load,
+    )
+    from Code.moviestats.db_functions import create_local_database
+    from Code.moviestats.storage import (
+        insert_titles,
+        table_columns,
+        update_genre_masks,
+    )
+
+    create_local_database(db_name)
+    conn = connect(db_name)
+    cursor = conn.cursor()
+    drop_change_triggers(cursor)
+    imported = {}
+    for table_name, path in files.items():
+        schema = pq.read_schema(path) if path.suffix == ".parquet" else None
+        schema = schema or ipc.open_file(pa.memory_map(str(path))).schema
+        cursor.execute(
+            f"""CREATE TABLE IF NOT EXISTS {table_name}({', '.join(
+                f'"{field.name}" {ARROW_TYPES.get(field.type, "TEXT")}' for field in schema
+            )})"""
+        )
+        if cursor.execute(f"""SELECT 1 FROM {table_name} LIMIT 1""").fetchone():
+            conn.close()
+            raise ValueError(f"table {table_name} of {db_name} is not empty")
+        target_columns = table_columns(cursor, table_name)
+        columns = [c for c in schema.names if c in target_columns]
+        imported[table_name] = 0
+        for batch in iter_snapshot_batches(path, batch_size):
+            if table_name == "imdb_ratings":
+                insert_titles(cursor, columns, batch_rows(batch, columns))
+            else:
+                cursor.executemany(
+                    f"""INSERT INTO {table_name} ({quote(columns)})
+                    VALUES ({','.join('?' * len(columns))})""",
+                    batch_rows(batch, columns),
+                )
+            imported[table_name] += batch.num_rows
+        record_load(cursor, table_name)
+    update_genre_masks(cursor)
+    create_change_log(cursor)
+    conn.commit()
+    conn.close()
+    return imported
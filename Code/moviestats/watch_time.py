@@ -0,0 +1,409 @@
+"""This module maintains watch time totals broken down by title type, genre, year and month.
+
+The watch time of a movie is its runtime. That of a series is its episode runtime times its
+number of episodes, read from the series_episodes cache filled once per series during
+ingestion. The IMDb scraper exposes episode runtimes but not episode counts, so series without a
+known count are estimated with DEFAULT_EPISODES, until set_episodes records the real count.
+Titles without a runtime are left out of every total instead of failing the sums.
+
+The contribution of every rated title is stored in watch_time_titles and summed into
+watch_time_totals, one row per (user, dimension, value). Totals are kept up to date
+incrementally by consuming the change log (see changes.py): only the contributions of the
+titles that changed are subtracted and added again. Answering a query then reads a handful of
+rows, whatever the size of the library.
+
+Queries never write: the totals are brought up to date by refresh, which ingestion runs after
+loading ratings and the refresh subcommand runs after manual changes. Queries thus also run on
+read-only connections and replicas, and report the totals of the latest refresh.
+"""
+
+from sqlite3 import OperationalError
+from typing import NamedTuple
+
+from Code.moviestats.changes import ChangeFeed, create_change_log
+
+
+CONSUMER = "watch_time"
+SOURCE_TABLES = [
+    "imdb_ratings",
+    "user_ratings",
+    "movie_genres",
+    "series_episodes",
+]
+DIMENSIONS = ["type", "genre", "year", "month"]
+# estimated number of episodes of a series whose episode count is unknown
+DEFAULT_EPISODES = {"tvSeries": 10, "tvMiniSeries": 6}
+UNKNOWN = "unknown"
+LEGACY_USER_ID = 0  # the ratings stored in imdb_ratings rather than in a user profile
+SERIES_TYPES = ", ".join(f"'{title_type}'" for title_type in DEFAULT_EPISODES)
+DEFAULT_EPISODES_CASE = " ".join(
+    f"WHEN '{title_type}' THEN {count}"
+    for title_type, count in DEFAULT_EPISODES.items()
+)
+# watch time contribution of every rating of the titles whose const is selected by {titles}
+CONTRIBUTIONS = f"""WITH rated(user_id, const, date_rated_epoch) AS (
+    SELECT {LEGACY_USER_ID}, const, date_rated_epoch FROM imdb_ratings
+    WHERE your_rating IS NOT NULL AND const IN ({{titles}})
+    UNION ALL
+    SELECT user_id, const, date_rated_epoch FROM user_ratings
+    WHERE your_rating IS NOT NULL AND const IN ({{titles}})
+)
+SELECT * FROM (
+    SELECT rated.user_id, rated.const, t.title_type, t.year,
+    strftime('%Y-%m', rated.date_rated_epoch, 'unixepoch'),
+    (
+        SELECT GROUP_CONCAT(TRIM(genres.name)) FROM movie_genres
+        JOIN genres ON genres.genre_id = movie_genres.genre_id
+        WHERE movie_genres.movie_id = t.id
+    ),
+    CASE WHEN t.title_type IN ({SERIES_TYPES})
+        THEN COALESCE(e.episode_runtime_mins, t.runtime_mins)
+            * COALESCE(e.episodes, CASE t.title_type {DEFAULT_EPISODES_CASE} END)
+        ELSE t.runtime_mins
+    END AS minutes
+    FROM rated JOIN imdb_ratings t ON t.const = rated.const
+    LEFT JOIN series_episodes e ON e.const = t.const
+) WHERE minutes IS NOT NULL"""
+
+
+class WatchTimeShare(NamedTuple):
+    """The watch time of the rated titles sharing a type, genre, year or month."""
+
+    value: str
+    titles: int
+    hours: float
+
+
+class EstimatedSeries(NamedTuple):
+    """A rated series whose watch time relies on DEFAULT_EPISODES, see WatchTime.set_episodes."""
+
+    const: str
+    title: str
+    episodes: int  # the estimate
+    hours: float
+
+
+def create_watch_time_tables(cursor) -> None:
+    """Creates the series episode cache and the watch time aggregates.
+
+    Parameters
+    ----------
+    cursor : Cursor
+        The SQL cursor to use
+    """
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS series_episodes(
+            const TEXT PRIMARY KEY,
+            episodes INTEGER,
+            episode_runtime_mins INTEGER
+        )"""
+    )
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS watch_time_titles(
+            user_id INTEGER NOT NULL,
+            const TEXT NOT NULL,
+            title_type TEXT,
+            year INTEGER,
+            month TEXT,
+            genres TEXT,
+            minutes REAL NOT NULL,
+            PRIMARY KEY(user_id, const)
+        ) WITHOUT ROWID"""
+    )
+    cursor.execute(
+        """CREATE INDEX IF NOT EXISTS idx_watch_time_titles_const
+        ON watch_time_titles(const)"""
+    )
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS watch_time_totals(
+            user_id INTEGER NOT NULL,
+            dimension TEXT NOT NULL,
+            value TEXT NOT NULL,
+            titles INTEGER NOT NULL,
+            minutes REAL NOT NULL,
+            PRIMARY KEY(user_id, dimension, value)
+        ) WITHOUT ROWID"""
+    )
+
+
+def cache_series_episodes(const: str, runtime_mins, cursor, fetcher) -> None:
+    """Caches the episode runtime of a series, fetching it only if the export has none.
+
+    Parameters
+    ----------
+    const : str
+        The IMDb ID of the series
+    runtime_mins : int
+        The runtime of the export, which IMDb gives per episode for series. None if missing
+    cursor : Cursor
+        The SQL cursor to use
+    fetcher : IMDbDataFetcher
+        The object used to fetch the episode runtime
+    """
+    if cursor.execute(
+        """SELECT 1 FROM series_episodes WHERE const = ?""", (const,)
+    ).fetchone():
+        return
+    if runtime_mins is None:
+        runtime_mins = fetcher.get_episode_runtime(const)
+    cursor.execute(
+        """INSERT INTO series_episodes (const, episodes, episode_runtime_mins)
+        VALUES (?, NULL, ?)""",
+        (const, runtime_mins),
+    )
+
+
+def contribution_rows(row: tuple) -> list:
+    """Returns the (dimension, value) pairs a watch_time_titles row counts towards."""
+    _, _, title_type, year, month, genres, _ = row
+    pairs = [
+        ("type", title_type or UNKNOWN),
+        ("year", UNKNOWN if year is None else str(year)),
+        ("month", month or UNKNOWN),
+    ]
+    pairs.extend(("genre", genre) for genre in (genres or UNKNOWN).split(","))
+    return pairs
+
+
+class WatchTime:
+    """A class to answer watch time queries from incrementally maintained aggregates.
+
+    Parameters
+    ----------
+    db_name : str
+        The name of the database
+    user : str
+        The user profile whose watch time is reported. The ratings of imdb_ratings if None
+    read_only : bool
+        Whether to open the database read-only, e.g. a replica. Only queries are then possible
+    """
+
+    def __init__(
+        self,
+        db_name: str = "imdb_ratings.db",
+        user: str = None,
+        read_only: bool = False,
+    ):
+        self.feed = ChangeFeed(db_name, read_only)
+        self.conn = self.feed.conn
+        self.cursor = self.conn.cursor()
+        if not read_only:
+            create_watch_time_tables(self.cursor)
+            # tracks series_episodes in older databases
+            create_change_log(self.cursor)
+            self.conn.commit()
+        self.user_id = LEGACY_USER_ID
+        if user is not None:
+            row = self.cursor.execute(
+                """SELECT user_id FROM users WHERE name = ?""", (user,)
+            ).fetchone()
+            if row is None:
+                raise ValueError(f"unknown user: {user}")
+            self.user_id = row[0]
+
+    def _apply(self, rows: list, sign: int) -> None:
+        """Adds (sign 1) or subtracts (sign -1) title contributions to the totals."""
+        deltas = {}
+        for row in rows:
+            for dimension, value in contribution_rows(row):
+                key = (row[0], dimension, value)
+                titles, minutes = deltas.get(key, (0, 0.0))
+                deltas[key] = (titles + sign, minutes + sign * row[-1])
+        self.cursor.executemany(
+            """INSERT INTO watch_time_totals (user_id, dimension, value, titles, minutes)
+            VALUES (?,?,?,?,?)
+            ON CONFLICT(user_id, dimension, value) DO UPDATE SET
+                titles = titles + excluded.titles,
+                minutes = minutes + excluded.minutes""",
+            [(*key, titles, minutes) for key, (titles, minutes) in deltas.items()],
+        )
+
+    def _recompute(self, titles: str) -> None:
+        """Replaces the contributions of the titles selected by the titles subquery."""
+        self._apply(
+            self.cursor.execute(
+                f"""SELECT * FROM watch_time_titles WHERE const IN ({titles})"""
+            ).fetchall(),
+            -1,
+        )
+        self.cursor.execute(
+            f"""DELETE FROM watch_time_titles WHERE const IN ({titles})"""
+        )
+        rows = self.cursor.execute(CONTRIBUTIONS.format(titles=titles)).fetchall()
+        self.cursor.executemany(
+            """INSERT INTO watch_time_titles VALUES (?,?,?,?,?,?,?)""", rows
+        )
+        self._apply(rows, 1)
+        self.cursor.execute("""DELETE FROM watch_time_totals WHERE titles = 0""")
+
+    def rebuild(self) -> None:
+        """Recomputes the aggregates of every title from scratch."""
+        version = self.feed.latest_version()
+        self.cursor.execute("""DELETE FROM watch_time_titles""")
+        self.cursor.execute("""DELETE FROM watch_time_totals""")
+        self._recompute("SELECT const FROM imdb_ratings")
+        self.feed.acknowledge(CONSUMER, version)
+
+    def refresh(self) -> int:
+        """Updates the aggregates with the changes logged since the last refresh.
+
+        The first refresh, and any refresh following a bulk load, rebuilds the aggregates.
+
+        Returns
+        ----------
+        int
+            The number of changes processed
+        """
+        if not self.feed.has_consumer(CONSUMER):
+            self.rebuild()
+            return 0
+        changes = self.feed.pull(CONSUMER, SOURCE_TABLES)
+        if not changes:
+            return 0
+        if any(change.op == "load" for change in changes):
+            self.rebuild()
+            return len(changes)
+        consts, movie_ids = set(), set()
+        for change in changes:
+            if change.table_name == "movie_genres":
+                movie_ids.add(int(change.key.split(":")[0]))
+            else:
+                consts.add(change.key.split(":")[-1])
+        self.cursor.execute(
+            """CREATE TEMP TABLE IF NOT EXISTS watch_time_changed(const TEXT PRIMARY KEY)"""
+        )
+        self.cursor.execute("""DELETE FROM temp.watch_time_changed""")
+        self.cursor.executemany(
+            """INSERT OR IGNORE INTO temp.watch_time_changed VALUES (?)""",
+            [(const,) for const in consts],
+        )
+        self.cursor.executemany(
+            """INSERT OR IGNORE INTO temp.watch_time_changed
+            SELECT const FROM imdb_ratings WHERE id = ?""",
+            [(movie_id,) for movie_id in movie_ids],
+        )
+        self._recompute("SELECT const FROM temp.watch_time_changed")
+        self.feed.acknowledge(CONSUMER, changes[-1].version)
+        return len(changes)
+
+    def _check_refreshed(self) -> None:
+        """Raises a ValueError if the totals were never computed."""
+        try:
+            refreshed = self.feed.has_consumer(CONSUMER)
+        except OperationalError:  # database created before the change log
+            refreshed = False
+        if not refreshed:
+            raise ValueError(
+                "watch time totals are not computed yet, run the refresh subcommand"
+            )
+
+    def set_episodes(self, const: str, episodes: int) -> None:
+        """Records the number of episodes of a series, replacing the DEFAULT_EPISODES estimate.
+
+        The totals account for it at the next refresh.
+
+        Parameters
+        ----------
+        const : str
+            The IMDb ID of the series
+        episodes : int
+            Its number of episodes
+        """
+        if episodes < 1:
+            raise ValueError("episodes must be a positive integer")
+        self.cursor.execute(
+            """INSERT INTO series_episodes (const, episodes) VALUES (?, ?)
+            ON CONFLICT(const) DO UPDATE SET episodes = excluded.episodes""",
+            (const, episodes),
+        )
+        self.conn.commit()
+
+    def get_total_watching_time(
+        self, days: bool = False, title_types: list = None
+    ) -> float:
+        """Gets the total watching time in hours/days from the totals of the latest refresh.
+
+        Parameters
+        ----------
+        days : bool
+            if True, return the total watching time in days. Otherwise, return it in hours
+        title_types : list
+            The title types to count, e.g. ["movie"]. All if None
+
+        Returns
+        ----------
+        float
+            The total watching time
+        """
+        self._check_refreshed()
+        type_filter, params = "", (self.user_id,)
+        if title_types:
+            type_filter = f"AND value IN ({','.join('?' * len(title_types))})"
+            params += tuple(title_types)
+        minutes = self.cursor.execute(
+            f"""SELECT TOTAL(minutes) FROM watch_time_totals
+            WHERE user_id = ? AND dimension = 'type' {type_filter}""",
+            params,
+        ).fetchone()[0]
+        return minutes / 60 / (24 if days else 1)
+
+    def get_watching_time_by(self, dimension: str, days: bool = False) -> list:
+        """Breaks the watching time down by title type, genre, year or month.
+
+        A title counts towards each of its genres, so the genre shares add up to more than
+        the total watching time.
+
+        Parameters
+        ----------
+        dimension : str
+            type, genre, year (of release) or month (of rating)
+        days : bool
+            if True, watching times are in days. Otherwise, they are in hours
+
+        Returns
+        ----------
+        list[WatchTimeShare]
+            The watching time of each value, longest first (chronological for year and month)
+        """
+        if dimension not in DIMENSIONS:
+            raise ValueError(f"dimension must be one of {', '.join(DIMENSIONS)}")
+        self._check_refreshed()
+        order = "value" if dimension in ("year", "month") else "minutes DESC"
+        return [
+            WatchTimeShare(value, titles, minutes / 60 / (24 if days else 1))
+            for value, titles, minutes in self.cursor.execute(
+                f"""SELECT value, titles, minutes FROM watch_time_totals
+                WHERE user_id = ? AND dimension = ? ORDER BY {order}""",
+                (self.user_id, dimension),
+            )
+        ]
+
+    def get_estimated_series(self, days: bool = False) -> list:
+        """Gets the rated series whose number of episodes is estimated with DEFAULT_EPISODES.
+
+        Their watch time is part of every total until set_episodes records their real number
+        of episodes.
+
+        Parameters
+        ----------
+        days : bool
+            if True, watching times are in days. Otherwise, they are in hours
+
+        Returns
+        ----------
+        list[EstimatedSeries]
+            The estimated series, longest first
+        """
+        self._check_refreshed()
+        return [
+            EstimatedSeries(const, title, episodes, minutes / 60 / (24 if days else 1))
+            for const, title, episodes, minutes in self.cursor.execute(
+                f"""SELECT w.const, t.title, CASE w.title_type {DEFAULT_EPISODES_CASE} END,
+                w.minutes FROM watch_time_titles AS w
+                JOIN imdb_ratings AS t ON t.const = w.const
+                LEFT JOIN series_episodes AS e ON e.const = w.const
+                WHERE w.user_id = ? AND w.title_type IN ({SERIES_TYPES})
+                AND e.episodes IS NULL ORDER BY w.minutes DESC""",
+                (self.user_id,),
+            )
+        ]